@@ -49,6 +49,7 @@ from functools import partial
 from PySide import QtCore, QtGui
 
 from leap.bitmask import __version__ as VERSION
+from leap.bitmask.crypto import srpbackend
 from leap.bitmask.util import leap_argparse
 from leap.bitmask.util import log_silencer, LOG_FORMAT
 from leap.bitmask.util.leap_log_handler import LeapLogHandler
@@ -265,6 +266,7 @@ def main():
     logger.info('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
     logger.info('Bitmask version %s', VERSION)
     logger.info('leap.mail version %s', MAIL_VERSION)
+    logger.info('SRP backend %s', srpbackend.get_backend_name())
     logger.info('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
 
     logger.info('Starting app')
@@ -18,13 +18,14 @@
 Backend for everything
 """
 import logging
+import os
 
+from collections import deque
 from functools import partial
-from Queue import Queue, Empty
+from urlparse import urlparse
 
-from twisted.internet import threads, defer
-from twisted.internet.task import LoopingCall
-from twisted.python import log
+from twisted.internet import reactor, threads, defer
+from twisted.python import log, threadable
 
 import zope.interface
 
@@ -32,6 +33,9 @@ from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.crypto.srpregister import SRPRegister
 from leap.bitmask.provider import get_provider_path
 from leap.bitmask.provider.providerbootstrapper import ProviderBootstrapper
+from leap.bitmask.services.eip.eipconfig import EIPConfig
+from leap.bitmask.signaler import SignalCoalescer, SignalerKeys
+from leap.bitmask.util import get_path_prefix, monotonic, resolver
 
 # Frontend side
 from PySide import QtCore
@@ -111,7 +115,7 @@ class Provider(object):
 
     PROBLEM_SIGNAL = "prov_problem_with_provider"
 
-    def __init__(self, signaler=None, bypass_checks=False):
+    def __init__(self, signaler=None, bypass_checks=False, prefetch=None):
         """
         Constructor for the Provider component
 
@@ -122,12 +126,16 @@ class Provider(object):
                               first round of checks for CA
                               certificates at bootstrap
         :type bypass_checks: bool
+        :param prefetch: the component that checks the configured
+                         providers in the background, if any.
+        :type prefetch: ProviderPrefetch
         """
         object.__init__(self)
         self.key = "provider"
+        self._signaler = signaler
+        self._prefetch = prefetch
         self._provider_bootstrapper = ProviderBootstrapper(signaler,
                                                            bypass_checks)
-        self._download_provider_defer = None
         self._provider_config = ProviderConfig()
 
     def setup_provider(self, provider):
@@ -141,18 +149,19 @@ class Provider(object):
         :rtype: twisted.internet.defer.Deferred
         """
         log.msg("Setting up provider %s..." % (provider.encode("idna"),))
-        pb = self._provider_bootstrapper
-        d = pb.run_provider_select_checks(provider, download_if_needed=True)
-        self._download_provider_defer = d
-        return d
+        if self._prefetch is not None and self._prefetch.is_healthy(provider):
+            log.msg("The provider was checked recently, skipping checks")
+            data = {ProviderBootstrapper.PASSED_KEY: True,
+                    ProviderBootstrapper.ERROR_KEY: ""}
+            for key in (self._signaler.PROV_NAME_RESOLUTION_KEY,
+                        self._signaler.PROV_HTTPS_CONNECTION_KEY,
+                        self._signaler.PROV_DOWNLOAD_PROVIDER_INFO_KEY):
+                self._signaler.signal(key, data)
+            return defer.succeed(None)
 
-    def cancel_setup_provider(self):
-        """
-        Cancel the ongoing setup provider defer (if any).
-        """
-        d = self._download_provider_defer
-        if d is not None:
-            d.cancel()
+        pb = self._provider_bootstrapper
+        return pb.run_provider_select_checks(provider,
+                                             download_if_needed=True)
 
     def bootstrap(self, provider):
         """
@@ -173,6 +182,7 @@ class Provider(object):
             self._provider_config.load(get_provider_path(provider))
 
         if self._provider_config.loaded():
+            self._preresolve(self._provider_config)
             d = self._provider_bootstrapper.run_provider_setup_checks(
                 self._provider_config,
                 download_if_needed=True)
@@ -186,6 +196,172 @@ class Provider(object):
             d = defer.Deferred()
         return d
 
+    def _preresolve(self, provider_config):
+        """
+        Starts resolving the names the bootstrap is going to need: the
+        provider, its API and the EIP gateways we already know of.
+
+        :param provider_config: the loaded config of the provider.
+        :type provider_config: ProviderConfig
+        """
+        domain = provider_config.get_domain()
+        hostnames = [domain.encode("idna"),
+                     urlparse(provider_config.get_api_uri()).hostname]
+
+        eip_path = os.path.join("leap", "providers", domain,
+                                "eip-service.json")
+        if os.path.exists(os.path.join(get_path_prefix(), eip_path)):
+            eip_config = EIPConfig()
+            eip_config.set_api_version(provider_config.get_api_version())
+            if eip_config.load(eip_path):
+                hostnames.extend(gateway.get("host")
+                                 for gateway in eip_config.get_gateways())
+
+        resolver.get_resolver().preresolve(hostnames)
+
+
+class ProviderPrefetch(object):
+    """
+    Runs the provider select checks for all the configured providers in
+    the background, so picking one of them in the wizard is instant.
+    """
+
+    zope.interface.implements(ILEAPComponent)
+
+    # how many providers are checked at the same time
+    CONCURRENCY = 4
+
+    # seconds a check result is valid
+    MAX_AGE = 10 * 60
+
+    HEALTHY = "healthy"
+    STALE = "stale"
+
+    def __init__(self, signaler=None, bypass_checks=False):
+        """
+        Constructor for the ProviderPrefetch component
+
+        :param signaler: Object in charge of handling communication
+                         back to the frontend
+        :type signaler: Signaler
+        :param bypass_checks: Set to true if the app should bypass
+                              first round of checks for CA
+                              certificates at bootstrap
+        :type bypass_checks: bool
+        """
+        object.__init__(self)
+        self.key = "prefetch"
+        self._signaler = signaler
+        self._bypass_checks = bypass_checks
+        self._semaphore = defer.DeferredSemaphore(self.CONCURRENCY)
+
+        # domain -> (healthy, time of the check)
+        self._results = {}
+
+    def prefetch_providers(self, providers):
+        """
+        Checks the providers that were not checked recently, and signals
+        the status of all of them once done.
+
+        :param providers: the domains of the providers.
+        :type providers: tuple of unicode
+
+        :returns: a defer that fires once all the checks are done.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        checks = [self._semaphore.run(self._check, domain)
+                  for domain in set(providers)
+                  if self._get_result(domain) is None]
+        d = defer.DeferredList(checks, consumeErrors=True)
+        d.addCallback(lambda _: self._signal_statuses(providers))
+        return d
+
+    def _check(self, domain):
+        """
+        Runs the select checks for a provider and stores the result.
+
+        :param domain: the domain of the provider.
+        :type domain: unicode
+
+        :rtype: twisted.internet.defer.Deferred
+        """
+        d = self._run_checks(domain)
+        d.addCallback(self._store_result, domain)
+        return d
+
+    def _run_checks(self, domain):
+        """
+        Runs the select checks for a provider, with a bootstrapper of its
+        own so the GUI is not told about them.
+
+        :param domain: the domain of the provider.
+        :type domain: unicode
+
+        :returns: a defer that fires with True if the checks passed.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        signaler = _RecordingSignaler()
+        pb = ProviderBootstrapper(signaler, self._bypass_checks)
+        d = pb.run_provider_select_checks(domain, download_if_needed=True)
+
+        def passed(_):
+            data = signaler.signals.get(
+                signaler.PROV_DOWNLOAD_PROVIDER_INFO_KEY)
+            return bool(data and data.get(pb.PASSED_KEY))
+        d.addCallback(passed)
+        return d
+
+    def _store_result(self, healthy, domain):
+        """
+        Stores the result of the checks for a provider.
+
+        :param healthy: whether the checks passed.
+        :type healthy: bool
+        :param domain: the domain of the provider.
+        :type domain: unicode
+        """
+        self._results[domain] = (healthy, monotonic())
+
+    def _get_result(self, domain):
+        """
+        Returns whether the checks for a provider passed, or None if it
+        was not checked recently.
+
+        :param domain: the domain of the provider.
+        :type domain: unicode
+
+        :rtype: bool or None
+        """
+        healthy, checked = self._results.get(domain, (None, None))
+        if healthy is None or monotonic() - checked >= self.MAX_AGE:
+            return None
+        return healthy
+
+    def is_healthy(self, domain):
+        """
+        Returns True if the provider passed the checks recently.
+
+        :param domain: the domain of the provider.
+        :type domain: unicode
+
+        :rtype: bool
+        """
+        return self._get_result(domain) is True
+
+    def _signal_statuses(self, providers):
+        """
+        Signals the status of each provider, healthy or stale.
+
+        :param providers: the domains of the providers.
+        :type providers: tuple of unicode
+        """
+        statuses = dict(
+            (domain, self.HEALTHY if self.is_healthy(domain)
+             else self.STALE)
+            for domain in providers)
+        if self._signaler is not None:
+            self._signaler.signal(self._signaler.PROV_PREFETCHED, statuses)
+
 
 class Register(object):
     """
@@ -234,11 +410,24 @@ class Register(object):
                 partial(srpregister.register_user, username, password))
         else:
             if self._signaler is not None:
-                self._signaler.signal(self._signaler.srp_registration_failed)
+                self._signaler.signal(self._signaler.SRP_REGISTRATION_FAILED)
             logger.error("Could not load provider configuration.")
 
 
-class Signaler(QtCore.QObject):
+class _RecordingSignaler(SignalerKeys):
+    """
+    Signaler that keeps the last data signaled for each key, instead of
+    telling the frontend.
+    """
+
+    def __init__(self):
+        self.signals = {}
+
+    def signal(self, key, data=None):
+        self.signals[key] = data
+
+
+class Signaler(QtCore.QObject, SignalerKeys):
     """
     Signaler object, handles converting string commands to Qt signals.
 
@@ -264,31 +453,13 @@ class Signaler(QtCore.QObject):
 
     prov_cancelled_setup = QtCore.Signal(object)
 
+    prov_prefetched = QtCore.Signal(object)
+
     # Signals for SRPRegister
     srp_registration_finished = QtCore.Signal(object)
     srp_registration_failed = QtCore.Signal(object)
     srp_registration_taken = QtCore.Signal(object)
 
-    ####################
-    # These will exist both in the backend AND the front end.
-    # The frontend might choose to not "interpret" all the signals
-    # from the backend, but the backend needs to have all the signals
-    # it's going to emit defined here
-    PROV_NAME_RESOLUTION_KEY = "prov_name_resolution"
-    PROV_HTTPS_CONNECTION_KEY = "prov_https_connection"
-    PROV_DOWNLOAD_PROVIDER_INFO_KEY = "prov_download_provider_info"
-    PROV_DOWNLOAD_CA_CERT_KEY = "prov_download_ca_cert"
-    PROV_CHECK_CA_FINGERPRINT_KEY = "prov_check_ca_fingerprint"
-    PROV_CHECK_API_CERTIFICATE_KEY = "prov_check_api_certificate"
-    PROV_PROBLEM_WITH_PROVIDER_KEY = "prov_problem_with_provider"
-    PROV_UNSUPPORTED_CLIENT = "prov_unsupported_client"
-    PROV_UNSUPPORTED_API = "prov_unsupported_api"
-    PROV_CANCELLED_SETUP = "prov_cancelled_setup"
-
-    SRP_REGISTRATION_FINISHED = "srp_registration_finished"
-    SRP_REGISTRATION_FAILED = "srp_registration_failed"
-    SRP_REGISTRATION_TAKEN = "srp_registration_taken"
-
     def __init__(self):
         """
         Constructor for the Signaler
@@ -296,30 +467,18 @@ class Signaler(QtCore.QObject):
         QtCore.QObject.__init__(self)
         self._signals = {}
 
-        signals = [
-            self.PROV_NAME_RESOLUTION_KEY,
-            self.PROV_HTTPS_CONNECTION_KEY,
-            self.PROV_DOWNLOAD_PROVIDER_INFO_KEY,
-            self.PROV_DOWNLOAD_CA_CERT_KEY,
-            self.PROV_CHECK_CA_FINGERPRINT_KEY,
-            self.PROV_CHECK_API_CERTIFICATE_KEY,
-            self.PROV_PROBLEM_WITH_PROVIDER_KEY,
-            self.PROV_UNSUPPORTED_CLIENT,
-            self.PROV_UNSUPPORTED_API,
-            self.PROV_CANCELLED_SETUP,
-
-            self.SRP_REGISTRATION_FINISHED,
-            self.SRP_REGISTRATION_FAILED,
-            self.SRP_REGISTRATION_TAKEN,
-        ]
-
-        for sig in signals:
+        for sig in self.SIGNALS:
             self._signals[sig] = getattr(self, sig)
 
+        self._coalescer = SignalCoalescer(self.emit_batch)
+
     def signal(self, key, data=None):
         """
         Emits a Qt signal based on the key provided, with the data if provided.
 
+        The signals are not emitted right away but batched once per
+        frame, see SignalCoalescer.
+
         :param key: string identifying the signal to emit
         :type key: str
         :param data: object to send with the data
@@ -329,19 +488,34 @@ class Signaler(QtCore.QObject):
         and an unserialized object in the frontend, but for now we
         just care about objects.
         """
-        # Right now it emits Qt signals. The backend version of this
-        # will do zmq.send_multipart, and the frontend version will be
-        # similar to this
-        log.msg("Signaling %s :: %s" % (key, data))
+        self._coalescer.signal(key, data)
 
-        # for some reason emitting 'None' gives a segmentation fault.
-        if data is None:
-            data = ''
+    def get_rates(self):
+        """
+        Returns the signaled and emitted rates per signal key.
 
-        try:
-            self._signals[key].emit(data)
-        except KeyError:
-            log.msg("Unknown key for signal %s!" % (key,))
+        :rtype: dict
+        """
+        return self._coalescer.get_rates()
+
+    def emit_batch(self, batch):
+        """
+        Emits the Qt signals for a batch of coalesced signals, right away.
+
+        :param batch: list of (key, data) tuples.
+        :type batch: list
+        """
+        for key, data in batch:
+            log.msg("Signaling %s :: %s" % (key, data))
+
+            # for some reason emitting 'None' gives a segmentation fault.
+            if data is None:
+                data = ''
+
+            try:
+                self._signals[key].emit(data)
+            except KeyError:
+                log.msg("Unknown key for signal %s!" % (key,))
 
 
 class Backend(object):
@@ -352,33 +526,67 @@ class Backend(object):
     PASSED_KEY = "passed"
     ERROR_KEY = "error"
 
-    def __init__(self, bypass_checks=False):
+    # status of the providers checked in the background
+    PROVIDER_HEALTHY = ProviderPrefetch.HEALTHY
+    PROVIDER_STALE = ProviderPrefetch.STALE
+
+    # How many commands of each component can run at the same time. The
+    # provider component keeps the state of the setup in progress, so
+    # its commands are run one at a time.
+    DEFAULT_CONCURRENCY = 2
+    CONCURRENCY = {
+        "provider": 1,
+    }
+
+    # Commands that carry secrets in their arguments. They are never
+    # shared with an identical one in progress, so we do not keep their
+    # arguments around.
+    PRIVATE_COMMANDS = (
+        ("register", "register_user"),
+    )
+
+    def __init__(self, bypass_checks=False, signaler=None):
         """
         Constructor for the backend.
+
+        :param bypass_checks: Set to true if the app should bypass
+                              first round of checks for CA
+                              certificates at bootstrap
+        :type bypass_checks: bool
+        :param signaler: Object in charge of handling communication
+                         back to the frontend. A Qt Signaler is created
+                         if None.
+        :type signaler: Signaler
         """
         object.__init__(self)
 
         # Components map for the commands received
         self._components = {}
 
-        # Ongoing defers that will be cancelled at stop time
-        self._ongoing_defers = []
+        # Ongoing defers that will be cancelled at stop time, as
+        # {component: {(method, args): defer}}. See _dispatch for the
+        # private commands.
+        self._ongoing = {}
+
+        # Concurrency limit for each component
+        self._semaphores = {}
 
         # Signaler object to translate commands into Qt signals
-        self._signaler = Signaler()
+        if signaler is None:
+            signaler = Signaler()
+        self._signaler = signaler
 
         # Component registration
-        self._register(Provider(self._signaler, bypass_checks))
+        prefetch = ProviderPrefetch(self._signaler, bypass_checks)
+        self._register(prefetch)
+        self._register(Provider(self._signaler, bypass_checks, prefetch))
         self._register(Register(self._signaler))
 
-        # We have a looping call on a thread executing all the
-        # commands in queue. Right now this queue is an actual Queue
-        # object, but it'll become the zmq recv_multipart queue
-        self._lc = LoopingCall(threads.deferToThread, self._worker)
-
-        # Temporal call_queue for worker, will be replaced with
-        # recv_multipart os something equivalent in the loopingcall
-        self._call_queue = Queue()
+        # Commands are dispatched in the reactor thread as soon as they
+        # arrive, nothing runs while we are idle. This queue only holds
+        # the commands received before we were started.
+        self._running = False
+        self._call_queue = deque()
 
     @property
     def signaler(self):
@@ -389,21 +597,46 @@ class Backend(object):
 
     def start(self):
         """
-        Starts the looping call
+        Starts dispatching commands, beginning with the ones received
+        so far.
         """
         log.msg("Starting worker...")
-        self._lc.start(0.01)
+        self._running = True
+        while self._call_queue:
+            self._dispatch(self._call_queue.popleft())
 
     def stop(self):
         """
-        Stops the looping call and tries to cancel all the defers.
+        Stops dispatching commands and tries to cancel all the defers.
         """
         log.msg("Stopping worker...")
-        if self._lc.running:
-            self._lc.stop()
-        while len(self._ongoing_defers) > 0:
-            d = self._ongoing_defers.pop()
-            d.cancel()
+        self._running = False
+        self._call_queue.clear()
+        for component in self._ongoing.keys():
+            self.cancel(component)
+
+    def cancel(self, component, method=None):
+        """
+        Cancels the commands for a component, both the running ones
+        and the ones waiting for their turn.
+
+        :param component: the key of the component.
+        :type component: str
+        :param method: if given, only the commands for this method are
+                       cancelled.
+        :type method: str
+        """
+        def matches(cmd_component, cmd_method):
+            return (cmd_component == component and
+                    method in (None, cmd_method))
+
+        self._call_queue = deque(
+            cmd for cmd in self._call_queue if not matches(*cmd[:2]))
+        ongoing = self._ongoing.get(component, {})
+        for request, d in ongoing.items():
+            if matches(component, request[0]):
+                del ongoing[request]
+                d.cancel()
 
     def _register(self, component):
         """
@@ -430,45 +663,125 @@ class Backend(object):
         """
         self._signaler.signal(signal)
 
-    def _worker(self):
+    def _call(self, *cmd):
+        """
+        Schedules a command to be dispatched in the reactor thread. It is
+        dispatched right away if we are already there.
+
+        :param cmd: component, method, signalback, *args
+        :type cmd: tuple
         """
-        Worker method, called from a different thread and as a part of
-        a looping call
+        self._in_reactor(self._queue_or_dispatch, cmd)
+
+    def _in_reactor(self, func, *args):
         """
+        Calls func in the reactor thread, right away if we are already
+        there.
+
+        :param func: the function to call.
+        :type func: callable
+        """
+        if threadable.isInIOThread():
+            func(*args)
+        else:
+            reactor.callFromThread(func, *args)
+
+    def _queue_or_dispatch(self, cmd):
+        """
+        Dispatches the command, or holds it until we are started.
+
+        :param cmd: component, method, signalback, *args
+        :type cmd: tuple
+        """
+        if self._running:
+            self._dispatch(cmd)
+        else:
+            self._call_queue.append(cmd)
+
+    def _get_semaphore(self, component):
+        """
+        Returns the semaphore that limits the concurrency of a component.
+
+        :param component: the key of the component.
+        :type component: str
+
+        :rtype: twisted.internet.defer.DeferredSemaphore
+        """
+        semaphore = self._semaphores.get(component)
+        if semaphore is None:
+            tokens = self.CONCURRENCY.get(component, self.DEFAULT_CONCURRENCY)
+            semaphore = defer.DeferredSemaphore(tokens)
+            self._semaphores[component] = semaphore
+        return semaphore
+
+    def _dispatch(self, cmd):
+        """
+        Schedules the component method for the command, and keeps track of
+        the defer it returns.
+
+        A command identical to one still in progress is not run again,
+        both share the same defer, unless it is one of PRIVATE_COMMANDS.
+
+        :param cmd: component, method, signalback, *args
+        :type cmd: tuple
+
+        :rtype: twisted.internet.defer.Deferred
+        """
+        # cmd is: component, method, signalback, *args
+        component, method, signal = cmd[:3]
+        if (component, method) in self.PRIVATE_COMMANDS:
+            request = (method, object())
+        else:
+            request = (method,) + tuple(cmd[3:])
+
+        ongoing = self._ongoing.setdefault(component, {})
+        if request in ongoing:
+            logger.debug("%s.%s already in progress." % (component, method))
+            return ongoing[request]
+
         try:
-            # this'll become recv_multipart
-            cmd = self._call_queue.get(block=False)
-
-            # cmd is: component, method, signalback, *args
-            func = getattr(self._components[cmd[0]], cmd[1])
-            d = func(*cmd[3:])
-            if d is not None:  # d may be None if a defer chain is cancelled.
-                # A call might not have a callback signal, but if it does,
-                # we add it to the chain
-                if cmd[2] is not None:
-                    d.addCallbacks(self._signal_back, log.err, cmd[2])
-                d.addCallbacks(self._done_action, log.err,
-                               callbackKeywords={"d": d})
-                d.addErrback(log.err)
-                self._ongoing_defers.append(d)
-        except Empty:
-            # If it's just empty we don't have anything to do.
-            pass
-        except defer.CancelledError:
-            logger.debug("defer cancelled somewhere (CancelledError).")
-        except Exception:
-            # But we log the rest
+            func = getattr(self._components[component], method)
+        except (KeyError, AttributeError):
             log.err()
+            return None
+
+        d = self._get_semaphore(component).run(func, *cmd[3:])
+        ongoing[request] = d
+
+        # A call might not have a callback signal, but if it does,
+        # we add it to the chain
+        if signal is not None:
+            d.addCallback(self._signal_back, signal)
+        d.addBoth(self._done_action, component, request, d)
+        d.addErrback(self._cancelled)
+        d.addErrback(log.err)
+        return d
 
-    def _done_action(self, _, d):
+    def _done_action(self, result, component, request, d):
         """
         Remover of the defer once it's done
 
+        :param component: the key of the component.
+        :type component: str
+        :param request: method and arguments of the command.
+        :type request: tuple
         :param d: defer to remove
         :type d: twisted.internet.defer.Deferred
         """
-        if d in self._ongoing_defers:
-            self._ongoing_defers.remove(d)
+        ongoing = self._ongoing.get(component)
+        if ongoing is not None and ongoing.get(request) is d:
+            del ongoing[request]
+        return result
+
+    def _cancelled(self, failure):
+        """
+        Errback that silences the cancelled commands.
+
+        :param failure: the failure that triggered the errback.
+        :type failure: twisted.python.failure.Failure
+        """
+        failure.trap(defer.CancelledError)
+        logger.debug("defer cancelled somewhere (CancelledError).")
 
     # XXX: Temporal interface until we migrate to zmq
     # We simulate the calls to zmq.send_multipart. Once we separate
@@ -476,14 +789,17 @@ class Backend(object):
     # send_multipart and this backend class will be really simple.
 
     def setup_provider(self, provider):
-        self._call_queue.put(("provider", "setup_provider", None, provider))
+        self._call("provider", "setup_provider", None, provider)
 
     def cancel_setup_provider(self):
-        self._call_queue.put(("provider", "cancel_setup_provider", None))
+        self._in_reactor(self.cancel, "provider", "setup_provider")
 
     def provider_bootstrap(self, provider):
-        self._call_queue.put(("provider", "bootstrap", None, provider))
+        self._call("provider", "bootstrap", None, provider)
+
+    def prefetch_providers(self, providers):
+        self._call("prefetch", "prefetch_providers", None, tuple(providers))
 
     def register_user(self, provider, username, password):
-        self._call_queue.put(("register", "register_user", None, provider,
-                              username, password))
+        self._call("register", "register_user", None, provider,
+                   username, password)
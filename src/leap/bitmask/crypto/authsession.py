@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# authsession.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Keeps the auth token of the logged in user fresh.
+
+The provider expires the tokens it issues, and a sync or a config
+download that runs into an expired one fails halfway. The manager logs in
+again in the background, with the credentials kept by SRPAuth, before the
+token gets that old.
+"""
+import logging
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import failure, threadable
+
+from leap.bitmask.crypto.srpauth import SRPAuthBadUserOrPassword
+from leap.bitmask.crypto.srpauth import SRPAuthLoggedOut
+from leap.common.check import leap_assert
+
+logger = logging.getLogger(__name__)
+
+# the manager of the current session, see start
+_manager = None
+
+# callables that get the new token after each refresh
+_listeners = []
+
+
+class AuthSessionManager(object):
+    """
+    Schedules a new login before the token of the current one expires.
+
+    Everything but refresh_blocking must be called from the reactor
+    thread.
+    """
+
+    # The provider does not tell how long a token lasts, this is how long
+    # we trust it to, in seconds.
+    TOKEN_MAX_AGE = 60 * 60
+
+    # part of TOKEN_MAX_AGE after which the token is refreshed
+    REFRESH_AT = 0.8
+
+    # seconds to wait before trying again if a refresh fails
+    RETRY_DELAY = 60
+
+    def __init__(self, srp_auth, reactor=reactor):
+        """
+        Constructor for AuthSessionManager
+
+        :param srp_auth: the authenticated SRPAuth.
+        :type srp_auth: SRPAuth
+        :param reactor: the reactor to schedule the refreshes on.
+        :type reactor: twisted.internet.interfaces.IReactorTime
+        """
+        self._srp_auth = srp_auth
+        self._reactor = reactor
+        self._delayed = None
+        self._refreshing = None
+        self._waiting = []
+        self._stopped = True
+
+    def start(self):
+        """
+        Starts refreshing the token of the current session.
+        """
+        self._stopped = False
+        self._schedule()
+
+    def stop(self):
+        """
+        Stops refreshing the token. A refresh already running is let to
+        finish, but nothing else is scheduled. If it ends after a logout,
+        SRPAuth drops it.
+        """
+        self._stopped = True
+        self._cancel()
+
+    def is_running(self):
+        """
+        Returns True if the token is being kept fresh.
+
+        :rtype: bool
+        """
+        return not self._stopped
+
+    def _cancel(self):
+        if self._delayed is not None and self._delayed.active():
+            self._delayed.cancel()
+        self._delayed = None
+
+    def _schedule(self, delay=None):
+        """
+        Schedules the next refresh, by default when the token reaches
+        REFRESH_AT of its lifetime.
+
+        :param delay: seconds to wait, instead of the default.
+        :type delay: float
+        """
+        self._cancel()
+        if self._stopped:
+            return
+        if delay is None:
+            age = self._srp_auth.get_token_age()
+            if age is None:
+                logger.debug("No token to refresh")
+                return
+            delay = max(0, self.TOKEN_MAX_AGE * self.REFRESH_AT - age)
+        logger.debug("Refreshing the auth token in %d seconds" % (delay,))
+        self._delayed = self._reactor.callLater(delay, self._scheduled)
+
+    def _scheduled(self):
+        self._delayed = None
+        # the failures are logged by _refreshed
+        self.refresh().addErrback(lambda _: None)
+
+    def refresh(self):
+        """
+        Logs in again to get a new token. If a refresh is already
+        running, it does not start another one.
+
+        :returns: a defer that fires with the new token.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        d = defer.Deferred()
+        self._waiting.append(d)
+        if self._refreshing is None:
+            self._cancel()
+            self._refreshing = self._srp_auth.refresh()
+            self._refreshing.addBoth(self._refreshed)
+        return d
+
+    def _refreshed(self, result):
+        """
+        Hands the result of a refresh to the callers, and schedules the
+        next one.
+
+        :param result: the new token or the failure of the refresh.
+        """
+        self._refreshing = None
+        waiting, self._waiting = self._waiting, []
+
+        if isinstance(result, failure.Failure):
+            if result.check(SRPAuthLoggedOut):
+                # SRPAuth dropped the new session, there is nothing to
+                # keep fresh anymore
+                logger.debug("Logged out while refreshing the auth token")
+                self.stop()
+            elif result.check(SRPAuthBadUserOrPassword):
+                # the password changed somewhere else, trying again will
+                # not help
+                logger.error("Could not refresh the auth token, the "
+                             "credentials are not valid anymore")
+                self.stop()
+            else:
+                logger.warning("Could not refresh the auth token: %r" %
+                               (result.value,))
+                self._schedule(self.RETRY_DELAY)
+        else:
+            logger.debug("Refreshed the auth token")
+            self._schedule()
+            _notify(result)
+
+        for d in waiting:
+            d.callback(result)
+
+    def refresh_blocking(self):
+        """
+        Refreshes the token, blocking until it is done. Must be called
+        from a thread other than the reactor one.
+
+        Raises the error of the refresh if it fails.
+
+        :returns: the new token.
+        :rtype: str
+        """
+        leap_assert(not threadable.isInIOThread(),
+                    "refresh_blocking cannot be used from the reactor "
+                    "thread")
+        return threads.blockingCallFromThread(self._reactor, self.refresh)
+
+
+def start(srp_auth):
+    """
+    Starts keeping the token of the session fresh, replacing the manager
+    of any previous session.
+
+    :param srp_auth: the authenticated SRPAuth.
+    :type srp_auth: SRPAuth
+
+    :rtype: AuthSessionManager
+    """
+    global _manager
+    stop()
+    _manager = AuthSessionManager(srp_auth)
+    _manager.start()
+    return _manager
+
+
+def stop():
+    """
+    Stops keeping the token of the session fresh.
+    """
+    global _manager
+    if _manager is not None:
+        _manager.stop()
+        _manager = None
+
+
+def add_listener(callback):
+    """
+    Registers a callable to be called, from the reactor thread, with the
+    new token after each refresh, so the users of the token can switch
+    to it.
+
+    :param callback: the callable.
+    :type callback: callable
+    """
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def remove_listener(callback):
+    """
+    Unregisters a callable registered with add_listener.
+
+    :param callback: the callable.
+    :type callback: callable
+    """
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+
+def _notify(token):
+    for callback in list(_listeners):
+        try:
+            callback(token)
+        except Exception as e:
+            logger.error("Error handing the new auth token to %r: %r" %
+                         (callback, e))
+
+
+def get_manager():
+    """
+    Returns the manager of the current session, or None if there is no
+    session.
+
+    :rtype: AuthSessionManager or None
+    """
+    return _manager
+
+
+def refresh_token():
+    """
+    Refreshes the token of the current session, for code running in a
+    thread that got an invalid token error. Nothing is done if called
+    from the reactor thread, since it cannot block.
+
+    :returns: the new token, or None if it could not be refreshed.
+    :rtype: str or None
+    """
+    manager = _manager
+    if manager is None or not manager.is_running() or \
+            threadable.isInIOThread():
+        return None
+    try:
+        return manager.refresh_blocking()
+    except Exception as e:
+        logger.warning("Could not refresh the auth token: %r" % (e,))
+        return None
@@ -44,8 +44,7 @@ def download_client_cert(provider_config, path, session):
     """
     # TODO we should implement the @with_srp_auth decorator
     # again.
-    srp_auth = SRPAuth(provider_config)
-    session_id = srp_auth.get_session_id()
+    session_id = SRPAuth(provider_config).get_credentials().session_id
     cookies = None
     if session_id:
         cookies = {"_session_id": session_id}
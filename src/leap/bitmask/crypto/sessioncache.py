@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# sessioncache.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Cache of the authenticated sessions, so a restart can resume the
+session instead of doing the whole SRP exchange again.
+"""
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+from leap.bitmask.util.keyring_helpers import get_keyring
+
+logger = logging.getLogger(__name__)
+
+
+class SessionCache(object):
+    """
+    Keeps the token, uuid and session id issued by the provider in the
+    keyring, which stores them encrypted. Nothing is cached if there is
+    no usable keyring.
+
+    A salted hash of the password the session was opened with is kept
+    with it, so a session is only resumed with the same password.
+
+    The keyring may block, so this should not be used from the reactor
+    thread.
+    """
+
+    KEYRING_KEY = "bitmask-session"
+
+    # seconds a cached session is tried for, the provider may expire it
+    # before
+    MAX_AGE = 24 * 60 * 60
+
+    UUID_KEY = "uuid"
+    TOKEN_KEY = "token"
+    SESSION_ID_KEY = "session_id"
+    EXPIRES_KEY = "expires"
+    ISSUED_KEY = "issued"
+    PASSWORD_SALT_KEY = "password_salt"
+    PASSWORD_HASH_KEY = "password_hash"
+
+    # PBKDF2 rounds for the password hash
+    HASH_ROUNDS = 100000
+
+    def __init__(self, keyring=None):
+        """
+        Constructor for SessionCache
+
+        :param keyring: the keyring to use, by default the one from
+                        keyring_helpers.
+        :type keyring: keyring.backend.KeyringBackend
+        """
+        self._keyring = keyring
+
+    def _get_keyring(self):
+        """
+        Returns the keyring to use, or None if there is no usable one.
+
+        :rtype: keyring.backend.KeyringBackend or None
+        """
+        if self._keyring is None:
+            return get_keyring() or None
+        return self._keyring
+
+    def _hash_password(self, password, salt):
+        """
+        Returns the hex encoded hash of the password.
+
+        :param password: the password.
+        :type password: unicode
+        :param salt: the hex encoded salt.
+        :type salt: str
+
+        :rtype: str
+        """
+        return binascii.hexlify(hashlib.pbkdf2_hmac(
+            "sha256", password.encode("utf-8"), binascii.unhexlify(salt),
+            self.HASH_ROUNDS))
+
+    def load(self, full_user_id, password):
+        """
+        Returns the cached session for the user, or None if there is
+        none, it expired or it was opened with another password.
+
+        :param full_user_id: the user, as user@domain.
+        :type full_user_id: str
+        :param password: the password of the user.
+        :type password: unicode
+
+        :returns: a dict with the uuid, token and session_id, and when
+                  the token was issued if known.
+        :rtype: dict or None
+        """
+        keyring = self._get_keyring()
+        if keyring is None:
+            return None
+        try:
+            data = keyring.get_password(self.KEYRING_KEY, full_user_id)
+            if not data:
+                return None
+            session = json.loads(data)
+        except Exception as e:
+            logger.warning("Could not load the cached session: %r" % (e,))
+            return None
+
+        keys = (self.UUID_KEY, self.TOKEN_KEY, self.SESSION_ID_KEY,
+                self.PASSWORD_SALT_KEY, self.PASSWORD_HASH_KEY)
+        if not isinstance(session, dict) or \
+                not all(session.get(key) for key in keys):
+            return None
+        if session.get(self.EXPIRES_KEY, 0) <= time.time():
+            return None
+        try:
+            password_hash = self._hash_password(
+                password, str(session[self.PASSWORD_SALT_KEY]))
+        except TypeError:
+            return None
+        if not hmac.compare_digest(
+                password_hash, str(session[self.PASSWORD_HASH_KEY])):
+            logger.debug("The cached session was opened with another "
+                         "password.")
+            return None
+        return session
+
+    def save(self, full_user_id, uuid, token, session_id, password,
+             issued=None):
+        """
+        Caches the session for the user.
+
+        :param full_user_id: the user, as user@domain.
+        :type full_user_id: str
+        :param uuid: the uuid of the user.
+        :type uuid: str
+        :param token: the token issued by the provider.
+        :type token: str
+        :param session_id: the session id issued by the provider.
+        :type session_id: str
+        :param password: the password the session was opened with.
+        :type password: unicode
+        :param issued: when the token was issued, in seconds since the
+                       epoch. Now by default. The session expires MAX_AGE
+                       after it.
+        :type issued: float
+        """
+        keyring = self._get_keyring()
+        if keyring is None:
+            return
+        if issued is None:
+            issued = time.time()
+        salt = binascii.hexlify(os.urandom(16))
+        data = json.dumps({
+            self.UUID_KEY: uuid,
+            self.TOKEN_KEY: token,
+            self.SESSION_ID_KEY: session_id,
+            self.PASSWORD_SALT_KEY: salt,
+            self.PASSWORD_HASH_KEY: self._hash_password(password, salt),
+            self.ISSUED_KEY: issued,
+            # saving the session again, like when the password changes,
+            # does not make it last longer
+            self.EXPIRES_KEY: issued + self.MAX_AGE,
+        })
+        try:
+            keyring.set_password(self.KEYRING_KEY, full_user_id, data)
+        except Exception as e:
+            logger.warning("Could not cache the session: %r" % (e,))
+
+    def clear(self, full_user_id):
+        """
+        Forgets the cached session for the user.
+
+        :param full_user_id: the user, as user@domain.
+        :type full_user_id: str
+        """
+        keyring = self._get_keyring()
+        if keyring is None:
+            return
+        try:
+            # old keyrings cannot delete, an empty value is ignored by
+            # load
+            keyring.set_password(self.KEYRING_KEY, full_user_id, "")
+        except Exception as e:
+            logger.warning("Could not clear the cached session: %r" % (e,))
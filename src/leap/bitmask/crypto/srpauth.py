@@ -18,22 +18,24 @@
 import binascii
 import logging
 import sys
+import threading
+import time
 
 import requests
-import srp
 import json
 
 #this error is raised from requests
 from simplejson.decoder import JSONDecodeError
-from functools import partial
-from requests.adapters import HTTPAdapter
+from collections import OrderedDict, namedtuple
 
 from PySide import QtCore
-from twisted.internet import threads
+from twisted.internet import defer, threads
 
 from leap.bitmask.config.leapsettings import LeapSettings
+from leap.bitmask.crypto import srpbackend
+from leap.bitmask.crypto.sessioncache import SessionCache
+from leap.bitmask.util import http_client, monotonic
 from leap.bitmask.util import request_helpers as reqhelper
-from leap.bitmask.util.compat import requests_has_max_retries
 from leap.bitmask.util.constants import REQUEST_TIMEOUT
 from leap.common.check import leap_assert
 from leap.common.events import signal as events_signal
@@ -117,6 +119,31 @@ class SRPAuthNoSessionId(SRPAuthenticationError):
     pass
 
 
+class SRPAuthLoggedOut(SRPAuthenticationError):
+    """
+    Exception raised when a login ends after a logout that happened
+    while it was running, so its result is dropped.
+    """
+    pass
+
+
+class SessionCredentials(namedtuple("SessionCredentials",
+                                    "session_id, uuid, token, issued")):
+    """
+    The credentials of the authenticated session.
+
+    session_id and token are the ones issued by the provider for the user
+    with the given uuid, and issued is when the token was issued, in
+    seconds since the epoch. They are all None if there is no session.
+
+    SRPAuth never changes the credentials it hands out, it replaces them
+    with new ones, so the values read from one always go together.
+    """
+
+
+NO_CREDENTIALS = SessionCredentials(None, None, None, None)
+
+
 class SRPAuth(QtCore.QObject):
     """
     SRPAuth singleton
@@ -135,6 +162,15 @@ class SRPAuth(QtCore.QObject):
         USER_SALT_KEY = 'user[password_salt]'
         AUTHORIZATION_KEY = "Authorization"
 
+        # phases of the login, for the timings
+        A_GENERATION = "A generation"
+        SALT_B_FETCH = "salt/B fetch"
+        M_COMPUTATION = "M computation"
+        HAMK_VERIFICATION = "HAMK verification"
+        SESSION_RESUME = "session resume"
+        CPU_PHASES = (A_GENERATION, M_COMPUTATION)
+        NETWORK_PHASES = (SESSION_RESUME, SALT_B_FETCH, HAMK_VERIFICATION)
+
         def __init__(self, provider_config):
             """
             Constructor for SRPAuth implementation
@@ -153,43 +189,67 @@ class SRPAuth(QtCore.QObject):
             # **************************************************** #
             # Dependency injection helpers, override this for more
             # granular testing
-            self._fetcher = requests
-            self._srp = srp
+            self._fetcher = http_client
+            self._srp = srpbackend.get_srp()
             self._hashfun = self._srp.SHA256
             self._ng = self._srp.NG_1024
+            self._session_cache = SessionCache()
             # **************************************************** #
 
-            self._reset_session()
+            # (api uri, ca cert path) and the session for them, see
+            # _get_session
+            self._session_entry = None
 
-            self._session_id = None
-            self._session_id_lock = QtCore.QMutex()
-            self._uuid = None
-            self._uuid_lock = QtCore.QMutex()
-            self._token = None
-            self._token_lock = QtCore.QMutex()
+            # Reading the credentials does not need the lock, they are
+            # replaced as a whole. The lock keeps concurrent updates from
+            # losing each other's changes.
+            self._credentials = NO_CREDENTIALS
+            self._credentials_lock = threading.Lock()
+
+            # Increased on each logout. A login only stores its results
+            # if there was no logout since it started.
+            self._generation = 0
+            self._login_generation = 0
 
             self._srp_user = None
             self._srp_a = None
 
-            # User credentials stored for password changing checks
+            # phase -> seconds it took, for the last login
+            self._timings = OrderedDict()
+
+            # User credentials stored for password changing checks and
+            # for refreshing the token
             self._username = None
             self._password = None
 
+            # whether the session is cached, see authenticate
+            self._resume = False
+
+        def _get_session(self):
+            """
+            Returns the session for the API of the current provider. It
+            is created on first use, so the provider config does not need
+            to be loaded before, and created again if the provider
+            changed. The session reuses the connections already open to
+            the provider API.
+
+            :rtype: requests.sessions.Session
+            """
+            key = (self._provider_config.get_api_uri(),
+                   self._provider_config.get_ca_cert_path())
+            if self._session_entry is None or \
+                    self._session_entry[0] != key:
+                self._session_entry = (key, self._fetcher.get_session(*key))
+            return self._session_entry[1]
+
+        _session = property(_get_session)
+
         def _reset_session(self):
             """
-            Resets the current session and sets max retries to 30.
+            Resets the current session. The new one is created on first
+            use.
             """
-            self._session = self._fetcher.session()
-            # We need to bump the default retries, otherwise logout
-            # fails most of the times
-            # NOTE: This is a workaround for the moment, the server
-            # side seems to return correctly every time, but it fails
-            # on the client end.
-            if requests_has_max_retries:
-                adapter = HTTPAdapter(max_retries=30)
-            else:
-                adapter = HTTPAdapter()
-            self._session.mount('https://', adapter)
+            self._session_entry = None
 
         def _safe_unhexlify(self, val):
             """
@@ -223,53 +283,45 @@ class SRPAuth(QtCore.QObject):
 
             self._srp_a = A
 
-        def _start_authentication(self, _, username):
+        def _get_start_request(self, username):
+            """
+            Returns the url and the data of the first request for
+            authentication.
+
+            :param username: username to login
+            :type username: str
+
+            :rtype: tuple
+            """
+            auth_data = {
+                self.LOGIN_KEY: username,
+                self.A_KEY: binascii.hexlify(self._srp_a)
+            }
+            # Clean up A value, we don't need it anymore
+            self._srp_a = None
+            sessions_url = "%s/%s/%s/" % \
+                (self._provider_config.get_api_uri(),
+                 self._provider_config.get_api_version(),
+                 "sessions")
+            return sessions_url, auth_data
+
+        def _parse_start_response(self, init_session):
             """
-            Sends the first request for authentication to retrieve the
-            salt and B parameter
+            Returns the salt and B parameters in the response to the
+            first request for authentication.
 
             Might raise all SRPAuthenticationError based:
-              SRPAuthenticationError
-              SRPAuthConnectionError
+              SRPAuthBadUserOrPassword
               SRPAuthBadStatusCode
               SRPAuthNoSalt
               SRPAuthNoB
 
-            :param _: IGNORED, output from the previous callback (None)
-            :type _: IGNORED
-            :param username: username to login
-            :type username: str
+            :param init_session: the response from the server.
+            :type init_session: requests.models.Response
 
             :return: salt and B parameters
             :rtype: tuple
             """
-            logger.debug("Starting authentication process...")
-            try:
-                auth_data = {
-                    self.LOGIN_KEY: username,
-                    self.A_KEY: binascii.hexlify(self._srp_a)
-                }
-                sessions_url = "%s/%s/%s/" % \
-                    (self._provider_config.get_api_uri(),
-                     self._provider_config.get_api_version(),
-                     "sessions")
-
-                ca_cert_path = self._provider_config.get_ca_cert_path()
-                ca_cert_path = ca_cert_path.encode(sys.getfilesystemencoding())
-
-                init_session = self._session.post(sessions_url,
-                                                  data=auth_data,
-                                                  verify=ca_cert_path,
-                                                  timeout=REQUEST_TIMEOUT)
-                # Clean up A value, we don't need it anymore
-                self._srp_a = None
-            except requests.exceptions.ConnectionError as e:
-                logger.error("No connection made (salt): {0!r}".format(e))
-                raise SRPAuthConnectionError()
-            except Exception as e:
-                logger.error("Unknown error: %r" % (e,))
-                raise SRPAuthenticationError()
-
             content, mtime = reqhelper.get_content(init_session)
 
             if init_session.status_code not in (200,):
@@ -296,27 +348,20 @@ class SRPAuth(QtCore.QObject):
 
             return salt, B
 
-        def _process_challenge(self, salt_B, username):
+        def _compute_M(self, salt_B):
             """
-            Given the salt and B processes the auth challenge and
-            generates the M2 parameter
+            Given the salt and B processes the auth challenge and returns
+            the M SRP parameter. This is the expensive part of the SRP
+            math.
 
             Might raise SRPAuthenticationError based:
-              SRPAuthenticationError
               SRPAuthBadDataFromServer
-              SRPAuthConnectionError
-              SRPAuthJSONDecodeError
-              SRPAuthBadUserOrPassword
 
             :param salt_B: salt and B parameters for the username
             :type salt_B: tuple
-            :param username: username for this session
-            :type username: str
 
-            :return: the M2 SRP parameter
             :rtype: str
             """
-            logger.debug("Processing challenge...")
             try:
                 salt, B = salt_B
                 unhex_salt = self._safe_unhexlify(salt)
@@ -324,8 +369,20 @@ class SRPAuth(QtCore.QObject):
             except (TypeError, ValueError) as e:
                 logger.error("Bad data from server: %r" % (e,))
                 raise SRPAuthBadDataFromServer()
-            M = self._srp_user.process_challenge(unhex_salt, unhex_B)
+            return self._srp_user.process_challenge(unhex_salt, unhex_B)
+
+        def _get_challenge_request(self, M, username):
+            """
+            Returns the url and the data of the request that sends the M
+            SRP parameter.
+
+            :param M: the M SRP parameter
+            :type M: str
+            :param username: username for this session
+            :type username: str
 
+            :rtype: tuple
+            """
             auth_url = "%s/%s/%s/%s" % (self._provider_config.get_api_uri(),
                                         self._provider_config.
                                         get_api_version(),
@@ -335,17 +392,22 @@ class SRPAuth(QtCore.QObject):
             auth_data = {
                 self.CLIENT_AUTH_KEY: binascii.hexlify(M)
             }
+            return auth_url, auth_data
 
-            try:
-                auth_result = self._session.put(auth_url,
-                                                data=auth_data,
-                                                verify=self._provider_config.
-                                                get_ca_cert_path(),
-                                                timeout=REQUEST_TIMEOUT)
-            except requests.exceptions.ConnectionError as e:
-                logger.error("No connection made (HAMK): %r" % (e,))
-                raise SRPAuthConnectionError()
+        def _parse_challenge_response(self, auth_result):
+            """
+            Returns the data in the response to the M SRP parameter.
+
+            Might raise SRPAuthenticationError based:
+              SRPAuthJSONDecodeError
+              SRPAuthBadUserOrPassword
+              SRPAuthBadStatusCode
 
+            :param auth_result: the response from the server.
+            :type auth_result: requests.models.Response
+
+            :rtype: dict
+            """
             try:
                 content, mtime = reqhelper.get_content(auth_result)
             except JSONDecodeError:
@@ -384,6 +446,9 @@ class SRPAuth(QtCore.QObject):
 
             :param json_content: Data received from the server
             :type json_content: dict
+
+            :returns: the M2 SRP parameter, the uuid and the token.
+            :rtype: tuple
             """
             try:
                 M2 = json_content.get("M2", None)
@@ -393,25 +458,18 @@ class SRPAuth(QtCore.QObject):
                 logger.error(e)
                 raise SRPAuthBadDataFromServer()
 
-            self.set_uuid(uuid)
-            self.set_token(token)
-
-            if M2 is None or self.get_uuid() is None:
+            if M2 is None or uuid is None:
                 logger.error("Something went wrong. Content = %r" %
                              (json_content,))
                 raise SRPAuthBadDataFromServer()
 
-            events_signal(
-                proto.CLIENT_UID, content=uuid,
-                reqcbk=lambda req, res: None)  # make the rpc call async
-
-            return M2
+            return M2, uuid, token
 
-        def _verify_session(self, M2):
+        def _verify_session(self, M2, uuid, token):
             """
             Verifies the session based on the M2 parameter. If the
-            verification succeeds, it sets the session_id for this
-            session
+            verification succeeds, it sets the session_id, uuid and
+            token for this session, all at once.
 
             Might raise SRPAuthenticationError based:
               SRPAuthBadDataFromServer
@@ -419,6 +477,10 @@ class SRPAuth(QtCore.QObject):
 
             :param M2: M2 SRP parameter
             :type M2: str
+            :param uuid: the uuid of the user, from the server.
+            :type uuid: str
+            :param token: the token of the session, from the server.
+            :type token: str
             """
             logger.debug("Verifying session...")
             try:
@@ -439,14 +501,273 @@ class SRPAuth(QtCore.QObject):
                 logger.error("Bad cookie from server (missing _session_id)")
                 raise SRPAuthNoSessionId()
 
+            self._update_login_credentials(
+                session_id=session_id, uuid=uuid, token=token)
+            self._save_uuid(uuid)
+
+            events_signal(
+                proto.CLIENT_UID, content=uuid,
+                reqcbk=lambda req, res: None)  # make the rpc call async
             events_signal(
                 proto.CLIENT_SESSION_ID, content=session_id,
                 reqcbk=lambda req, res: None)  # make the rpc call async
 
-            self.set_session_id(session_id)
+        def _send(self, method, url, data, what, headers=None,
+                  cookies=None):
+            """
+            Sends a login request without blocking, with the cookies of
+            the session, and keeps the cookies the server sets.
+
+            :param method: the HTTP method.
+            :type method: str
+            :param url: the url for the request.
+            :type url: str
+            :param data: the form data to send.
+            :type data: dict
+            :param what: what the request is for, for the logs.
+            :type what: str
+            :param headers: extra headers to send.
+            :type headers: dict
+            :param cookies: cookies to send besides the session ones.
+            :type cookies: dict
+
+            :returns: a defer that fires with the response.
+            :rtype: twisted.internet.defer.Deferred
+            """
+            ca_cert_path = self._provider_config.get_ca_cert_path()
+            ca_cert_path = ca_cert_path.encode(sys.getfilesystemencoding())
+            all_cookies = dict(self._session.cookies)
+            all_cookies.update(cookies or {})
+            d = self._fetcher.request(method, url, headers=headers,
+                                      data=data, cookies=all_cookies,
+                                      verify=ca_cert_path,
+                                      timeout=REQUEST_TIMEOUT)
+
+            def keep_cookies(response):
+                self._session.cookies.update(response.cookies)
+                return response
+
+            def failed(failure):
+                if failure.check(requests.exceptions.ConnectionError,
+                                 requests.exceptions.Timeout):
+                    logger.error("No connection made (%s): %r" %
+                                 (what, failure.value))
+                    raise SRPAuthConnectionError()
+                logger.error("Unknown error: %r" % (failure.value,))
+                raise SRPAuthenticationError()
+
+            d.addCallbacks(keep_cookies, failed)
+            return d
+
+        def _fetch_salt_B(self, _, username):
+            """
+            Sends the first request for authentication without blocking.
+
+            :param _: IGNORED, output from the previous callback (None)
+            :type _: IGNORED
+            :param username: username to login
+            :type username: str
+
+            :returns: a defer that fires with the salt and B parameters.
+            :rtype: twisted.internet.defer.Deferred
+            """
+            logger.debug("Starting authentication process...")
+            sessions_url, auth_data = self._get_start_request(username)
+            d = self._send("POST", sessions_url, auth_data, "salt")
+            d.addCallback(self._parse_start_response)
+            return d
+
+        def _verify_HAMK(self, M, username):
+            """
+            Sends the M SRP parameter without blocking, and verifies the
+            session with the server answer.
+
+            :param M: the M SRP parameter
+            :type M: str
+            :param username: username for this session
+            :type username: str
+
+            :rtype: twisted.internet.defer.Deferred
+            """
+            logger.debug("Processing challenge...")
+            auth_url, auth_data = self._get_challenge_request(M, username)
+            d = self._send("PUT", auth_url, auth_data, "HAMK")
+            d.addCallback(self._parse_challenge_response)
+            d.addCallback(self._extract_data)
+            d.addCallback(lambda data: self._verify_session(*data))
+            return d
+
+        def _get_full_user_id(self, username):
+            """
+            Returns the user as user@domain.
+
+            :param username: username for this session
+            :type username: str
+
+            :rtype: str
+            """
+            return "%s@%s" % (username, self._provider_config.get_domain())
+
+        def _resume_session(self, username, password):
+            """
+            Resumes the cached session for the user, if there is one, it
+            was opened with the same password and the provider still
+            accepts it.
+
+            :param username: username for this session
+            :type username: str
+            :param password: password for this user
+            :type password: unicode
+
+            :returns: a defer that fires with True if the session was
+                      resumed.
+            :rtype: twisted.internet.defer.Deferred
+            """
+            full_user_id = self._get_full_user_id(username)
+            d = threads.deferToThread(self._session_cache.load,
+                                      full_user_id, password)
+            d.addCallback(self._validate_session, full_user_id)
+            return d
+
+        def _validate_session(self, session, full_user_id):
+            """
+            Checks with one authenticated request that the provider still
+            accepts a cached session, and makes it the current one if so.
+
+            :param session: the cached session, or None.
+            :type session: dict
+            :param full_user_id: the user, as user@domain.
+            :type full_user_id: str
+
+            :returns: a defer that fires with True if the session was
+                      resumed.
+            :rtype: twisted.internet.defer.Deferred
+            """
+            if session is None:
+                return False
+
+            cache = self._session_cache
+            uuid = session[cache.UUID_KEY]
+            token = session[cache.TOKEN_KEY]
+            session_id = session[cache.SESSION_ID_KEY]
+
+            logger.debug("Validating the cached session...")
+            user_url = "%s/%s/users/%s.json" % (
+                self._provider_config.get_api_uri(),
+                self._provider_config.get_api_version(),
+                uuid)
+            headers = {
+                self.AUTHORIZATION_KEY: "Token token={0}".format(token)
+            }
+            d = self._send("GET", user_url, None, "session",
+                           headers=headers,
+                           cookies={self.SESSION_ID_KEY: session_id})
+
+            def validated(response):
+                if response.status_code != 200:
+                    logger.debug("The cached session is not valid "
+                                 "anymore (%s)" % (response.status_code,))
+                    threads.deferToThread(cache.clear, full_user_id)
+                    self._reset_session()
+                    return False
+
+                self._session.cookies.set(self.SESSION_ID_KEY, session_id)
+                self._update_login_credentials(
+                    session_id=session_id, uuid=uuid, token=token,
+                    issued=session.get(cache.ISSUED_KEY))
+                self._save_uuid(uuid)
+                events_signal(
+                    proto.CLIENT_UID, content=uuid,
+                    reqcbk=lambda req, res: None)  # make the rpc call async
+                events_signal(
+                    proto.CLIENT_SESSION_ID, content=session_id,
+                    reqcbk=lambda req, res: None)  # make the rpc call async
+                logger.debug("Resumed the cached session.")
+                return True
+
+            def failed(failure):
+                logger.debug("Could not validate the cached session: %r"
+                             % (failure.value,))
+                self._reset_session()
+                return False
+
+            d.addCallbacks(validated, failed)
+            return d
+
+        def _cache_session(self, _, username):
+            """
+            Caches the current session, so it can be resumed later.
+
+            :param _: IGNORED, output from the previous callback (None)
+            :type _: IGNORED
+            :param username: username for this session
+            :type username: str
+            """
+            credentials = self.get_credentials()
+            password = self._password
+            generation = self._login_generation
+            full_user_id = self._get_full_user_id(username)
+
+            def save():
+                # do not cache again a session logout just cleared
+                if generation != self._generation:
+                    return
+                self._session_cache.save(
+                    full_user_id, credentials.uuid, credentials.token,
+                    credentials.session_id, password, credentials.issued)
+
+            threads.deferToThread(save)
+
+        def _timed(self, phase, fun, *args, **kwargs):
+            """
+            Calls fun and records how long it took, until the defer it
+            returns fires if it returns one.
+
+            :param phase: the phase of the login.
+            :type phase: str
+            :param fun: the function to call.
+            :type fun: callable
+            """
+            start = monotonic()
+
+            def record(result):
+                self._timings[phase] = monotonic() - start
+                return result
 
-        def _threader(self, cb, res, *args, **kwargs):
-            return threads.deferToThread(cb, res, *args, **kwargs)
+            try:
+                result = fun(*args, **kwargs)
+            except Exception:
+                record(None)
+                raise
+            if isinstance(result, defer.Deferred):
+                return result.addBoth(record)
+            return record(result)
+
+        def _log_timings(self, result):
+            """
+            Logs how long each phase of the login took, and how much of
+            it was spent in the network and computing.
+
+            :param result: the result of the login, passed through.
+            """
+            network = sum(self._timings.get(phase, 0)
+                          for phase in self.NETWORK_PHASES)
+            cpu = sum(self._timings.get(phase, 0)
+                      for phase in self.CPU_PHASES)
+            logger.debug("Login timings: %s (network %.3fs, cpu %.3fs)" % (
+                ", ".join("%s %.3fs" % item
+                          for item in self._timings.items()),
+                network, cpu))
+            return result
+
+        def get_login_timings(self):
+            """
+            Returns how long each phase of the last login took, in
+            seconds.
+
+            :rtype: OrderedDict
+            """
+            return OrderedDict(self._timings)
 
         def change_password(self, current_password, new_password):
             """
@@ -463,7 +784,8 @@ class SRPAuth(QtCore.QObject):
             :param new_password: the new password for the user
             :type new_password: str
             """
-            leap_assert(self.get_uuid() is not None)
+            credentials = self.get_credentials()
+            leap_assert(credentials.uuid is not None)
 
             if current_password != self._password:
                 raise SRPAuthBadUserOrPassword
@@ -471,16 +793,16 @@ class SRPAuth(QtCore.QObject):
             url = "%s/%s/users/%s.json" % (
                 self._provider_config.get_api_uri(),
                 self._provider_config.get_api_version(),
-                self.get_uuid())
+                credentials.uuid)
 
             salt, verifier = self._srp.create_salted_verification_key(
                 self._username.encode('utf-8'), new_password.encode('utf-8'),
                 self._hashfun, self._ng)
 
-            cookies = {self.SESSION_ID_KEY: self.get_session_id()}
+            cookies = {self.SESSION_ID_KEY: credentials.session_id}
             headers = {
                 self.AUTHORIZATION_KEY:
-                "Token token={0}".format(self.get_token())
+                "Token token={0}".format(credentials.token)
             }
             user_data = {
                 self.USER_VERIFIER_KEY: binascii.hexlify(verifier),
@@ -498,8 +820,16 @@ class SRPAuth(QtCore.QObject):
             change_password.raise_for_status()
 
             self._password = new_password
-
-        def authenticate(self, username, password):
+            if self._resume:
+                # the cached session must not be resumed with the old
+                # password. We are not in the reactor thread, so the
+                # keyring can block here.
+                self._session_cache.save(
+                    self._get_full_user_id(self._username),
+                    credentials.uuid, credentials.token,
+                    credentials.session_id, new_password, credentials.issued)
+
+        def authenticate(self, username, password, resume=False):
             """
             Executes the whole authentication process for a user
 
@@ -509,36 +839,111 @@ class SRPAuth(QtCore.QObject):
             :type username: unicode
             :param password: password for this user
             :type password: unicode
+            :param resume: if True, resume the cached session if the
+                           provider still accepts it, and cache the new
+                           one otherwise.
+            :type resume: bool
 
             :returns: A defer on a different thread
             :rtype: twisted.internet.defer.Deferred
             """
             leap_assert(self.get_session_id() is None, "Already logged in")
 
-            # User credentials stored for password changing checks
+            # User credentials stored for password changing checks and
+            # for refreshing the token
             self._username = username
             self._password = password
+            self._resume = resume
+            self._login_generation = self._generation
 
             self._reset_session()
+            self._timings.clear()
+
+            if not resume:
+                d = self._srp_login(username, password)
+            else:
+                d = self._timed(self.SESSION_RESUME,
+                                self._resume_session, username, password)
+
+                def login_unless_resumed(resumed):
+                    if resumed:
+                        return
+                    login = self._srp_login(username, password)
+                    login.addCallback(self._cache_session, username)
+                    return login
+                d.addCallback(login_unless_resumed)
+            d.addBoth(self._log_timings)
+
+            return d
+
+        def refresh(self):
+            """
+            Logs in again with the credentials of the current session, to
+            get a new token before the current one expires. The current
+            session is kept if the new login fails.
+
+            Might raise SRPAuthenticationError, SRPAuthLoggedOut if there
+            is a logout before it ends.
+
+            :returns: a defer that fires with the new token.
+            :rtype: twisted.internet.defer.Deferred
+            """
+            leap_assert(self.get_session_id() is not None, "Not logged in")
+            leap_assert(self._password is not None,
+                        "No credentials to refresh the session with")
+
+            username = self._username
+            old_session_entry = self._session_entry
+            old_credentials = self.get_credentials()
+
+            logger.debug("Refreshing the session...")
+            self._login_generation = self._generation
+            self._reset_session()
+            self._timings.clear()
+
+            d = self._srp_login(username, self._password)
+
+            def restore(failure):
+                # nothing to restore if we logged out meanwhile
+                if self._replace_credentials(old_credentials._asdict(),
+                                             self._login_generation):
+                    self._session_entry = old_session_entry
+                return failure
+
+            d.addErrback(restore)
+            if self._resume:
+                d.addCallback(self._cache_session, username)
+            d.addBoth(self._log_timings)
+            d.addCallback(lambda _: self.get_token())
+            return d
+
+        def _srp_login(self, username, password):
+            """
+            Does the SRP exchange for the user.
 
-            d = threads.deferToThread(self._authentication_preprocessing,
-                                      username=username,
-                                      password=password)
+            :param username: username for this session
+            :type username: unicode
+            :param password: password for this user
+            :type password: unicode
 
+            :rtype: twisted.internet.defer.Deferred
+            """
+            # The SRP math runs in a thread and the requests are done
+            # without blocking from the reactor.
+            d = threads.deferToThread(
+                self._timed, self.A_GENERATION,
+                self._authentication_preprocessing,
+                username=username, password=password)
             d.addCallback(
-                partial(self._threader,
-                        self._start_authentication),
-                username=username)
+                lambda _: self._timed(self.SALT_B_FETCH,
+                                      self._fetch_salt_B, None, username))
             d.addCallback(
-                partial(self._threader,
-                        self._process_challenge),
-                username=username)
+                lambda salt_B: threads.deferToThread(
+                    self._timed, self.M_COMPUTATION,
+                    self._compute_M, salt_B))
             d.addCallback(
-                partial(self._threader,
-                        self._extract_data))
-            d.addCallback(partial(self._threader,
-                                  self._verify_session))
-
+                lambda M: self._timed(self.HAMK_VERIFICATION,
+                                      self._verify_HAMK, M, username))
             return d
 
         def logout(self):
@@ -548,7 +953,12 @@ class SRPAuth(QtCore.QObject):
             """
             logger.debug("Starting logout...")
 
-            if self.get_session_id() is None:
+            # drop the result of a login or refresh still running
+            with self._credentials_lock:
+                self._generation += 1
+
+            session_id = self.get_session_id()
+            if session_id is None:
                 logger.debug("Already logged out")
                 return
 
@@ -558,7 +968,7 @@ class SRPAuth(QtCore.QObject):
                                         "logout")
             try:
                 self._session.delete(logout_url,
-                                     data=self.get_session_id(),
+                                     data=session_id,
                                      verify=self._provider_config.
                                      get_ca_cert_path(),
                                      timeout=REQUEST_TIMEOUT)
@@ -567,40 +977,135 @@ class SRPAuth(QtCore.QObject):
                                (e,))
                 raise
             else:
-                self.set_session_id(None)
-                self.set_uuid(None)
-                self.set_token(None)
+                self._set_credentials(NO_CREDENTIALS)
                 # Also reset the session
-                self._session = self._fetcher.session()
+                self._reset_session()
+                if self._username is not None:
+                    self._session_cache.clear(
+                        self._get_full_user_id(self._username))
                 logger.debug("Successfully logged out.")
 
+        def _set_credentials(self, credentials):
+            """
+            Replaces the credentials of the session.
+
+            :param credentials: the new credentials.
+            :type credentials: SessionCredentials
+            """
+            with self._credentials_lock:
+                self._credentials = credentials
+
+        def _update_credentials(self, **values):
+            """
+            Replaces the credentials of the session with a copy that has
+            the given values. If the token is given and issued is not,
+            the token is taken as issued now.
+
+            :param values: the fields of SessionCredentials to change.
+            :type values: dict
+            """
+            self._replace_credentials(values)
+
+        def _update_login_credentials(self, **values):
+            """
+            Like _update_credentials, for the login that is running.
+
+            Raises SRPAuthLoggedOut, without changing the credentials, if
+            there was a logout since the login started, so a login that
+            ends late does not log the user in again.
+
+            :param values: the fields of SessionCredentials to change.
+            :type values: dict
+            """
+            if not self._replace_credentials(values,
+                                             self._login_generation):
+                logger.debug("Logged out during the login, dropping it")
+                raise SRPAuthLoggedOut()
+
+        def _replace_credentials(self, values, generation=None):
+            """
+            Replaces the credentials with a copy that has the given
+            values, unless generation is given and there was a logout
+            since then.
+
+            :param values: the fields of SessionCredentials to change.
+            :type values: dict
+            :param generation: the value of _generation to check.
+            :type generation: int
+
+            :returns: True if the credentials were replaced.
+            :rtype: bool
+            """
+            if "token" in values and values.get("issued") is None:
+                values["issued"] = \
+                    None if values["token"] is None else time.time()
+            with self._credentials_lock:
+                if generation is not None and \
+                        generation != self._generation:
+                    return False
+                self._credentials = self._credentials._replace(**values)
+            return True
+
+        def get_credentials(self):
+            """
+            Returns the credentials of the session, all of them from the
+            same moment.
+
+            :rtype: SessionCredentials
+            """
+            return self._credentials
+
+        def _save_uuid(self, uuid):
+            """
+            Remembers the uuid of the user in the settings.
+
+            :param uuid: the uuid, ignored if None.
+            :type uuid: str
+            """
+            if uuid is not None:  # avoid removing the uuid from settings
+                full_uid = "%s@%s" % (
+                    self._username, self._provider_config.get_domain())
+                self._settings.set_uuid(full_uid, uuid)
+
         def set_session_id(self, session_id):
-            QtCore.QMutexLocker(self._session_id_lock)
-            self._session_id = session_id
+            self._update_credentials(session_id=session_id)
 
         def get_session_id(self):
-            QtCore.QMutexLocker(self._session_id_lock)
-            return self._session_id
+            return self._credentials.session_id
 
         def set_uuid(self, uuid):
-            QtCore.QMutexLocker(self._uuid_lock)
-            full_uid = "%s@%s" % (
-                self._username, self._provider_config.get_domain())
-            if uuid is not None:  # avoid removing the uuid from settings
-                self._settings.set_uuid(full_uid, uuid)
-            self._uuid = uuid
+            self._save_uuid(uuid)
+            self._update_credentials(uuid=uuid)
 
         def get_uuid(self):
-            QtCore.QMutexLocker(self._uuid_lock)
-            return self._uuid
+            return self._credentials.uuid
 
-        def set_token(self, token):
-            QtCore.QMutexLocker(self._token_lock)
-            self._token = token
+        def set_token(self, token, issued=None):
+            """
+            Sets the token of the session.
+
+            :param token: the token, or None.
+            :type token: str
+            :param issued: when the token was issued, in seconds since the
+                           epoch. Now by default.
+            :type issued: float
+            """
+            self._update_credentials(token=token, issued=issued)
 
         def get_token(self):
-            QtCore.QMutexLocker(self._token_lock)
-            return self._token
+            return self._credentials.token
+
+        def get_token_age(self):
+            """
+            Returns how many seconds ago the token was issued, or None if
+            there is no token.
+
+            :rtype: float or None
+            """
+            issued = self._credentials.issued
+            if issued is None:
+                return None
+            return max(0, time.time() - issued)
 
     __instance = None
 
@@ -629,7 +1134,7 @@ class SRPAuth(QtCore.QObject):
         if provider_config is not None:
             SRPAuth.__instance._provider_config = provider_config
 
-    def authenticate(self, username, password):
+    def authenticate(self, username, password, resume=False):
         """
         Executes the whole authentication process for a user
 
@@ -639,12 +1144,25 @@ class SRPAuth(QtCore.QObject):
         :type username: str
         :param password: password for this user
         :type password: str
+        :param resume: if True, resume the cached session if the provider
+                       still accepts it, and cache the new one otherwise.
+        :type resume: bool
         """
         username = username.lower()
-        d = self.__instance.authenticate(username, password)
+        d = self.__instance.authenticate(username, password, resume)
         d.addCallback(self._gui_notify)
         return d
 
+    def refresh(self):
+        """
+        Logs in again with the credentials of the current session, to get
+        a new token.
+
+        :returns: a defer that fires with the new token.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        return self.__instance.refresh()
+
     def change_password(self, current_password, new_password):
         """
         Changes the user's password.
@@ -691,6 +1209,21 @@ class SRPAuth(QtCore.QObject):
     def get_token(self):
         return self.__instance.get_token()
 
+    def get_credentials(self):
+        """
+        Returns the session id, uuid and token of the session, all of
+        them from the same moment.
+
+        :rtype: SessionCredentials
+        """
+        return self.__instance.get_credentials()
+
+    def get_token_age(self):
+        return self.__instance.get_token_age()
+
+    def get_login_timings(self):
+        return self.__instance.get_login_timings()
+
     def logout(self):
         """
         Logs out the current session.
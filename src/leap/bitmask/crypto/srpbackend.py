@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# srpbackend.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Selection of the implementation used for the SRP computations.
+
+The srp module has a ctypes implementation on top of OpenSSL and a pure
+Python one that does the modular exponentiations with Python longs. If
+gmpy2 is installed we also build a variant of the pure Python one that
+does them with GMP.
+
+All of them have the interface of the srp module, so the one returned
+by get_srp can be used in its place.
+"""
+import imp
+import logging
+
+import srp
+
+from leap.common.check import leap_assert
+
+logger = logging.getLogger(__name__)
+
+GMPY2 = "gmpy2"
+CTSRP = "ctsrp"
+PYSRP = "pysrp"
+
+# in order of preference, the fastest first
+BACKENDS = (GMPY2, CTSRP, PYSRP)
+
+# (name, module) of the selected backend
+_backend = None
+
+
+def _load_gmpy2():
+    """
+    Returns a copy of the pure Python implementation that does the
+    modular exponentiations with gmpy2.
+
+    Raises ImportError if gmpy2 is not installed.
+    """
+    import gmpy2
+
+    found = imp.find_module("_pysrp", srp.__path__)
+    try:
+        module = imp.load_module("leap.bitmask.crypto._gmpy2srp", *found)
+    finally:
+        if found[0] is not None:
+            found[0].close()
+
+    def powmod(base, exp, mod):
+        return long(gmpy2.powmod(base, exp, mod))
+
+    # all the exponentiations in the module are done with pow
+    module.pow = powmod
+    return module
+
+
+def _load_ctsrp():
+    """
+    Returns the ctypes implementation.
+
+    Raises ImportError or OSError if OpenSSL cannot be loaded.
+    """
+    import srp._ctsrp
+    return srp._ctsrp
+
+
+def _load_pysrp():
+    """
+    Returns the pure Python implementation.
+    """
+    import srp._pysrp
+    return srp._pysrp
+
+
+_LOADERS = {
+    GMPY2: _load_gmpy2,
+    CTSRP: _load_ctsrp,
+    PYSRP: _load_pysrp,
+}
+
+
+def load_backend(name):
+    """
+    Returns the module of the given backend.
+
+    Might raise ImportError or OSError if it is not available.
+
+    :param name: one of BACKENDS.
+    :type name: str
+
+    :rtype: module
+    """
+    leap_assert(name in _LOADERS, "Unknown SRP backend %r" % (name,))
+    return _LOADERS[name]()
+
+
+def is_working(module, ng_type=None):
+    """
+    Returns True if a login with the given backend succeeds against a
+    verifier of the same backend.
+
+    :param module: the backend.
+    :type module: module
+    :param ng_type: the group to use, NG_1024 by default.
+    :type ng_type: int
+
+    :rtype: bool
+    """
+    if ng_type is None:
+        ng_type = module.NG_1024
+    hashfun = module.SHA256
+    try:
+        salt, vkey = module.create_salted_verification_key(
+            "user", "password", hashfun, ng_type)
+        user = module.User("user", "password", hashfun, ng_type)
+        _, A = user.start_authentication()
+        verifier = module.Verifier("user", salt, vkey, A, hashfun, ng_type)
+        s, B = verifier.get_challenge()
+        M = user.process_challenge(s, B)
+        HAMK = verifier.verify_session(M)
+        if HAMK is None:
+            return False
+        user.verify_session(HAMK)
+        return bool(user.authenticated())
+    except Exception as e:
+        logger.debug("SRP backend %s failed: %r" % (module.__name__, e))
+        return False
+
+
+def get_backend():
+    """
+    Returns the name and the module of the fastest backend that works
+    here. It is selected the first time this is called.
+
+    :rtype: tuple
+    """
+    global _backend
+    if _backend is None:
+        for name in BACKENDS:
+            try:
+                module = load_backend(name)
+            except (ImportError, OSError) as e:
+                logger.debug("SRP backend %s not available: %r" % (name, e))
+                continue
+            if is_working(module):
+                _backend = (name, module)
+                break
+            logger.warning("SRP backend %s does not work, skipping it"
+                           % (name,))
+        else:
+            logger.error("No SRP backend works, using the srp default")
+            _backend = ("srp", srp)
+    return _backend
+
+
+def get_backend_name():
+    """
+    Returns the name of the backend in use.
+
+    :rtype: str
+    """
+    return get_backend()[0]
+
+
+def get_srp():
+    """
+    Returns the module of the backend in use, that has the interface of
+    the srp module.
+
+    :rtype: module
+    """
+    return get_backend()[1]
@@ -20,12 +20,13 @@ import json
 import logging
 
 import requests
-import srp
 
 from PySide import QtCore
 from urlparse import urlparse
 
 from leap.bitmask.config.providerconfig import ProviderConfig
+from leap.bitmask.crypto import srpbackend
+from leap.bitmask.util import http_client
 from leap.bitmask.util.constants import SIGNUP_TIMEOUT
 from leap.bitmask.util.request_helpers import get_content
 from leap.common.check import leap_assert, leap_assert_type
@@ -72,8 +73,8 @@ class SRPRegister(QtCore.QObject):
         # **************************************************** #
         # Dependency injection helpers, override this for more
         # granular testing
-        self._fetcher = requests
-        self._srp = srp
+        self._fetcher = http_client
+        self._srp = srpbackend.get_srp()
         self._hashfun = self._srp.SHA256
         self._ng = self._srp.NG_1024
         # **************************************************** #
@@ -86,7 +87,25 @@ class SRPRegister(QtCore.QObject):
 
         self._register_path = register_path
 
-        self._session = self._fetcher.session()
+        # (api uri, ca cert path) and the session for them, see
+        # _get_session
+        self._session_entry = None
+
+    def _get_session(self):
+        """
+        Returns the session for the API of the provider, created on first
+        use. The session reuses the connections already open to the
+        provider API.
+
+        :rtype: requests.sessions.Session
+        """
+        key = (self._provider_config.get_api_uri(),
+               self._provider_config.get_ca_cert_path())
+        if self._session_entry is None or self._session_entry[0] != key:
+            self._session_entry = (key, self._fetcher.get_session(*key))
+        return self._session_entry[1]
+
+    _session = property(_get_session)
 
     def _get_registration_uri(self):
         """
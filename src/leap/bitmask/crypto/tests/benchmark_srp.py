@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# benchmark_srp.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compares the CPU time of the client side of a login with each SRP
+backend available, for each group size.
+
+Run it with:
+
+    python -m leap.bitmask.crypto.tests.benchmark_srp [rounds]
+"""
+import sys
+import time
+
+from leap.bitmask.crypto import srpbackend
+
+GROUPS = (("1024", "NG_1024"), ("2048", "NG_2048"), ("4096", "NG_4096"))
+
+
+def cpu_time():
+    """
+    Returns the CPU time used by the process.
+
+    os.times only counts whole clock ticks, 10ms in most systems, which
+    is about what a phase of a login takes, so we use time.clock, that
+    reads a high resolution CPU clock in POSIX systems. In Windows it is
+    the wall clock time, also with a high resolution.
+
+    :rtype: float
+    """
+    return time.clock()
+
+
+def time_login(module, ng_type, rounds):
+    """
+    Returns the mean CPU time the user side of a login takes.
+
+    :param module: the backend.
+    :type module: module
+    :param ng_type: the group to use.
+    :type ng_type: int
+    :param rounds: how many logins to do.
+    :type rounds: int
+
+    :rtype: float
+    """
+    hashfun = module.SHA256
+    salt, vkey = module.create_salted_verification_key(
+        "user", "password", hashfun, ng_type)
+
+    spent = 0
+    for _ in range(rounds):
+        start = cpu_time()
+        user = module.User("user", "password", hashfun, ng_type)
+        _, A = user.start_authentication()
+        spent += cpu_time() - start
+
+        verifier = module.Verifier("user", salt, vkey, A, hashfun, ng_type)
+        s, B = verifier.get_challenge()
+
+        start = cpu_time()
+        M = user.process_challenge(s, B)
+        spent += cpu_time() - start
+
+        HAMK = verifier.verify_session(M)
+
+        start = cpu_time()
+        user.verify_session(HAMK)
+        spent += cpu_time() - start
+
+        assert user.authenticated()
+    return spent / rounds
+
+
+def main(rounds=20):
+    print "%-8s %8s %8s %8s" % (("backend",) + tuple(
+        bits for bits, _ in GROUPS))
+    for name in srpbackend.BACKENDS:
+        try:
+            module = srpbackend.load_backend(name)
+        except (ImportError, OSError):
+            print "%-8s not available" % (name,)
+            continue
+        if not srpbackend.is_working(module):
+            print "%-8s does not work" % (name,)
+            continue
+        times = [time_login(module, getattr(module, ng), rounds) * 1000
+                 for _, ng in GROUPS]
+        print "%-8s %6.2fms %6.2fms %6.2fms" % ((name,) + tuple(times))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
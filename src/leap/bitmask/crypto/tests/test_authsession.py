@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# test_authsession.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the manager that keeps the auth token fresh
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from twisted.internet import defer, task
+
+from leap.bitmask.crypto import authsession
+from leap.bitmask.crypto.authsession import AuthSessionManager
+from leap.bitmask.crypto.srpauth import SRPAuthBadUserOrPassword
+from leap.bitmask.crypto.srpauth import SRPAuthConnectionError
+from leap.bitmask.crypto.srpauth import SRPAuthLoggedOut
+
+REFRESH_AGE = AuthSessionManager.TOKEN_MAX_AGE * \
+    AuthSessionManager.REFRESH_AT
+
+
+class FakeSRPAuth(object):
+    """
+    SRPAuth whose refreshes are finished by the test.
+    """
+
+    def __init__(self, clock, age):
+        self._clock = clock
+        self.issued = clock.seconds() - age
+        self.token = "token"
+        self.refreshes = []
+
+    def get_token_age(self):
+        return self._clock.seconds() - self.issued
+
+    def refresh(self):
+        d = defer.Deferred()
+        self.refreshes.append(d)
+        return d
+
+    def finish_refresh(self, token):
+        self.token = token
+        self.issued = self._clock.seconds()
+        self.refreshes.pop(0).callback(token)
+
+    def fail_refresh(self, error):
+        self.refreshes.pop(0).errback(error)
+
+
+class AuthSessionManagerTest(unittest.TestCase):
+    """
+    Tests for the AuthSessionManager class
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.srp_auth = FakeSRPAuth(self.clock, 100)
+        self.manager = AuthSessionManager(self.srp_auth, reactor=self.clock)
+        self.manager.start()
+
+    def tearDown(self):
+        self.manager.stop()
+
+    def test_refreshes_before_expiry(self):
+        self.clock.advance(REFRESH_AGE - 101)
+        self.assertEqual(len(self.srp_auth.refreshes), 0)
+        self.clock.advance(1)
+        self.assertEqual(len(self.srp_auth.refreshes), 1)
+
+        # the next one is scheduled from the new token
+        self.srp_auth.finish_refresh("new")
+        self.clock.advance(REFRESH_AGE - 1)
+        self.assertEqual(len(self.srp_auth.refreshes), 0)
+        self.clock.advance(1)
+        self.assertEqual(len(self.srp_auth.refreshes), 1)
+
+    def test_concurrent_refreshes_share_the_login(self):
+        tokens = []
+        self.manager.refresh().addCallback(tokens.append)
+        self.manager.refresh().addCallback(tokens.append)
+        self.assertEqual(len(self.srp_auth.refreshes), 1)
+        self.srp_auth.finish_refresh("new")
+        self.assertEqual(tokens, ["new", "new"])
+
+    def test_retries_after_failure(self):
+        errors = []
+        self.manager.refresh().addErrback(errors.append)
+        self.srp_auth.fail_refresh(SRPAuthConnectionError())
+        self.assertTrue(errors[0].check(SRPAuthConnectionError))
+
+        self.clock.advance(AuthSessionManager.RETRY_DELAY)
+        self.assertEqual(len(self.srp_auth.refreshes), 1)
+
+    def test_stops_on_bad_credentials(self):
+        self.manager.refresh().addErrback(lambda _: None)
+        self.srp_auth.fail_refresh(SRPAuthBadUserOrPassword())
+        self.assertFalse(self.manager.is_running())
+
+        self.clock.advance(AuthSessionManager.TOKEN_MAX_AGE)
+        self.assertEqual(len(self.srp_auth.refreshes), 0)
+
+    def test_stops_on_logout(self):
+        tokens = []
+        authsession.add_listener(tokens.append)
+        self.addCleanup(authsession.remove_listener, tokens.append)
+
+        self.manager.refresh().addErrback(lambda _: None)
+        self.manager.stop()
+        self.srp_auth.fail_refresh(SRPAuthLoggedOut())
+        self.assertFalse(self.manager.is_running())
+        self.assertEqual(tokens, [])
+
+        self.clock.advance(AuthSessionManager.TOKEN_MAX_AGE)
+        self.assertEqual(len(self.srp_auth.refreshes), 0)
+
+    def test_stop(self):
+        self.manager.stop()
+        self.clock.advance(AuthSessionManager.TOKEN_MAX_AGE)
+        self.assertEqual(len(self.srp_auth.refreshes), 0)
+
+    def test_listeners(self):
+        tokens = []
+        authsession.add_listener(tokens.append)
+        self.addCleanup(authsession.remove_listener, tokens.append)
+
+        self.manager.refresh()
+        self.srp_auth.finish_refresh("new")
+        self.assertEqual(tokens, ["new"])
+
+
+if __name__ == "__main__":
+    unittest.main()
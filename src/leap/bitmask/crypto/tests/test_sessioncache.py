@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# test_sessioncache.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the cache of the authenticated sessions
+"""
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from leap.bitmask.crypto import sessioncache
+from leap.bitmask.crypto.sessioncache import SessionCache
+
+USER = "user@example.org"
+
+
+class FakeKeyring(object):
+    """
+    Keyring that keeps the passwords in a dict.
+    """
+
+    def __init__(self):
+        self.passwords = {}
+
+    def get_password(self, service, username):
+        return self.passwords.get((service, username))
+
+    def set_password(self, service, username, password):
+        self.passwords[(service, username)] = password
+
+
+class SessionCacheTest(unittest.TestCase):
+    """
+    Tests for the SessionCache class
+    """
+
+    def setUp(self):
+        self.keyring = FakeKeyring()
+        self.cache = SessionCache(self.keyring)
+
+    def test_save_and_load(self):
+        self.cache.save(USER, "uuid", "token", "session_id", "pass")
+        session = self.cache.load(USER, "pass")
+        self.assertEqual(session[SessionCache.UUID_KEY], "uuid")
+        self.assertEqual(session[SessionCache.TOKEN_KEY], "token")
+        self.assertEqual(session[SessionCache.SESSION_ID_KEY], "session_id")
+        self.assertIsNone(self.cache.load("other@example.org", "pass"))
+
+    def test_other_password(self):
+        self.cache.save(USER, "uuid", "token", "session_id", u"pass\xe9")
+        self.assertIsNotNone(self.cache.load(USER, u"pass\xe9"))
+        self.assertIsNone(self.cache.load(USER, "pass"))
+
+    def test_no_password_hash(self):
+        # cached before the password hash was kept
+        self.keyring.set_password(
+            SessionCache.KEYRING_KEY, USER,
+            '{"uuid": "uuid", "token": "token", "session_id": "id", '
+            '"expires": %d}' % (time.time() + 60,))
+        self.assertIsNone(self.cache.load(USER, "pass"))
+
+    def test_issued(self):
+        issued = time.time() - 60
+        self.cache.save(USER, "uuid", "token", "session_id", "pass",
+                        issued=issued)
+        session = self.cache.load(USER, "pass")
+        self.assertEqual(session[SessionCache.ISSUED_KEY], issued)
+
+    def test_expires_after_issued(self):
+        issued = time.time() - SessionCache.MAX_AGE
+        self.cache.save(USER, "uuid", "token", "session_id", "pass",
+                        issued=issued)
+        self.assertIsNone(self.cache.load(USER, "pass"))
+
+    def test_saving_again_keeps_the_expiry(self):
+        issued = time.time() - 60
+        self.cache.save(USER, "uuid", "token", "session_id", "pass",
+                        issued=issued)
+        expires = self.cache.load(USER, "pass")[SessionCache.EXPIRES_KEY]
+        self.cache.save(USER, "uuid", "token", "session_id", "new pass",
+                        issued=issued)
+        session = self.cache.load(USER, "new pass")
+        self.assertEqual(session[SessionCache.EXPIRES_KEY], expires)
+
+    def test_expired(self):
+        now = time.time()
+        with mock.patch("time.time", lambda: now - SessionCache.MAX_AGE):
+            self.cache.save(USER, "uuid", "token", "session_id", "pass")
+        self.assertIsNone(self.cache.load(USER, "pass"))
+
+    def test_incomplete(self):
+        self.cache.save(USER, "uuid", None, "session_id", "pass")
+        self.assertIsNone(self.cache.load(USER, "pass"))
+
+    def test_garbage(self):
+        self.keyring.set_password(SessionCache.KEYRING_KEY, USER, "{")
+        self.assertIsNone(self.cache.load(USER, "pass"))
+
+    def test_clear(self):
+        self.cache.save(USER, "uuid", "token", "session_id", "pass")
+        self.cache.clear(USER)
+        self.assertIsNone(self.cache.load(USER, "pass"))
+
+    def test_no_keyring(self):
+        with mock.patch.object(sessioncache, "get_keyring",
+                               return_value=None):
+            cache = SessionCache()
+            cache.save(USER, "uuid", "token", "session_id", "pass")
+            self.assertIsNone(cache.load(USER, "pass"))
+            cache.clear(USER)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
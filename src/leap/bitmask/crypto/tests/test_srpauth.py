@@ -25,21 +25,23 @@ except ImportError:
 import os
 import sys
 import binascii
+import time
 import requests
 import mock
 
-from functools import partial
-
 from mock import MagicMock
 from nose.twistedtools import reactor, deferred
 from twisted.python import log
-from twisted.internet import threads
+from twisted.internet import defer, threads
 from requests.models import Response
 from simplejson.decoder import JSONDecodeError
 
 from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.crypto import srpregister, srpauth
+from leap.bitmask.crypto.sessioncache import SessionCache
 from leap.bitmask.crypto.tests import fake_provider
+from leap.bitmask.crypto.tests.test_sessioncache import FakeKeyring
+from leap.bitmask.util import http_client
 from leap.bitmask.util.request_helpers import get_content
 from leap.common.testing.https_server import where
 
@@ -105,12 +107,8 @@ class SRPAuthTestCase(unittest.TestCase):
         self.auth = srpauth.SRPAuth(self.provider)
         self.auth_backend = self.auth._SRPAuth__instance
 
-        self.old_post = self.auth_backend._session.post
-        self.old_put = self.auth_backend._session.put
         self.old_delete = self.auth_backend._session.delete
 
-        self.old_start_auth = self.auth_backend._start_authentication
-        self.old_proc_challenge = self.auth_backend._process_challenge
         self.old_extract_data = self.auth_backend._extract_data
         self.old_verify_session = self.auth_backend._verify_session
         self.old_auth_preproc = self.auth_backend._authentication_preprocessing
@@ -119,12 +117,8 @@ class SRPAuthTestCase(unittest.TestCase):
         self.old_auth = self.auth_backend.authenticate
 
     def tearDown(self):
-        self.auth_backend._session.post = self.old_post
-        self.auth_backend._session.put = self.old_put
         self.auth_backend._session.delete = self.old_delete
 
-        self.auth_backend._start_authentication = self.old_start_auth
-        self.auth_backend._process_challenge = self.old_proc_challenge
         self.auth_backend._extract_data = self.old_extract_data
         self.auth_backend._verify_session = self.old_verify_session
         self.auth_backend._authentication_preprocessing = self.old_auth_preproc
@@ -140,28 +134,74 @@ class SRPAuthTestCase(unittest.TestCase):
         """
         return "https://localhost:%s" % (self.https_port,)
 
-    # Auth tests
+    def _request_over_http(self, method, url, **kwargs):
+        """
+        Stub for http_client.request that sends the request with requests,
+        in a thread, to the plain HTTP port of the fake provider. The
+        tests do not depend on the TLS setup of the fake provider this
+        way.
 
-    def _prepare_auth_test(self, code=200, side_effect=None):
+        :rtype: twisted.internet.defer.Deferred
         """
-        Creates the needed defers to test several test situations. It
-        adds up to the auth preprocessing step.
+        url = url.replace(self._get_https_uri(),
+                          "http://localhost:%s" % (self.http_port,))
+        kwargs.pop("verify", None)
+        return threads.deferToThread(requests.request, method, url,
+                                     **kwargs)
 
-        :param code: status code for the response of POST in requests
+    def _stub_request(self, code=200, side_effect=None):
+        """
+        Makes the login requests return a response with the given status
+        code, or fail with side_effect.
+
+        :param code: status code for the response.
         :type code: int
-        :param side_effect: side effect triggered by the POST method
-                            in requests
-        :type side_effect: some kind of Exception
+        :param side_effect: exception the requests fail with.
+        :type side_effect: Exception
+        """
+        if side_effect is not None:
+            result = defer.fail(side_effect)
+        else:
+            res = Response()
+            res.status_code = code
+            result = defer.succeed(res)
+        self._patch_request(lambda *args, **kwargs: result)
+
+    def _patch_request(self, side_effect):
+        """
+        Stubs http_client.request, that sends the login requests.
+
+        :param side_effect: called instead of http_client.request.
+        :type side_effect: callable
+        """
+        patcher = mock.patch.object(http_client, "request",
+                                    side_effect=side_effect)
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fails_with(self, d, exception):
+        """
+        Checks that d fails with exception.
+
+        :rtype: twisted.internet.defer.Deferred
+        """
+        def unexpected(result):
+            self.fail("%s not raised" % (exception.__name__,))
+
+        d.addCallbacks(unexpected, lambda failure: failure.trap(exception))
+        return d
+
+    # Auth tests
+
+    def _prepare_auth_test(self):
+        """
+        Registers the test user against the fake provider, and adds up to
+        the auth preprocessing step.
 
         :returns: the defer that is created
         :rtype: defer.Deferred
         """
-        res = Response()
-        res.status_code = code
-        self.auth_backend._session.post = mock.create_autospec(
-            self.auth_backend._session.post,
-            return_value=res,
-            side_effect=side_effect)
+        self._patch_request(self._request_over_http)
 
         d = threads.deferToThread(self.register.register_user,
                                   self.TEST_USER,
@@ -199,300 +239,131 @@ class SRPAuthTestCase(unittest.TestCase):
         self.assertTrue(len(self.auth_backend._srp_a) > 0)
 
     @deferred()
-    def test_start_authentication(self):
-        d = threads.deferToThread(self.register.register_user, self.TEST_USER,
-                                  self.TEST_PASS)
-
-        def wrapper_preproc(*args):
-            return threads.deferToThread(
-                self.auth_backend._authentication_preprocessing,
-                self.TEST_USER, self.TEST_PASS)
-
-        d.addCallback(wrapper_preproc)
-
-        def wrapper(_):
-            return threads.deferToThread(
-                self.auth_backend._start_authentication,
-                None, self.TEST_USER)
-
-        d.addCallback(wrapper)
+    def test_fetch_salt_B(self):
+        d = self._prepare_auth_test()
+
+        def check(salt_B):
+            salt, B = salt_B
+            self.assertTrue(salt)
+            self.assertTrue(B)
+            method, url = self.request.call_args[0]
+            self.assertEqual(method, "POST")
+            self.assertTrue(url.endswith("/1/sessions/"))
+
+        d.addCallback(self.auth_backend._fetch_salt_B, self.TEST_USER)
+        d.addCallback(check)
         return d
 
     @deferred()
-    def test_start_authentication_fails_connerror(self):
-        d = self._prepare_auth_test(
-            side_effect=requests.exceptions.ConnectionError())
-
-        def wrapper(_):
-            with self.assertRaises(srpauth.SRPAuthConnectionError):
-                self.auth_backend._start_authentication(None, self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-        return d
+    def test_fetch_salt_B_fails_connerror(self):
+        self.auth_backend._authentication_preprocessing("user", "pass")
+        self._stub_request(side_effect=requests.exceptions.ConnectionError())
+        d = self.auth_backend._fetch_salt_B(None, self.TEST_USER)
+        return self._fails_with(d, srpauth.SRPAuthConnectionError)
 
     @deferred()
-    def test_start_authentication_fails_any_error(self):
-        d = self._prepare_auth_test(side_effect=Exception())
+    def test_fetch_salt_B_fails_any_error(self):
+        self.auth_backend._authentication_preprocessing("user", "pass")
+        self._stub_request(side_effect=Exception())
+        d = self.auth_backend._fetch_salt_B(None, self.TEST_USER)
+        return self._fails_with(d, srpauth.SRPAuthenticationError)
 
-        def wrapper(_):
-            with self.assertRaises(srpauth.SRPAuthenticationError):
-                self.auth_backend._start_authentication(None, self.TEST_USER)
+    def _fetch_salt_B(self, code, content):
+        """
+        Fetches the salt and B parameters, getting content with the
+        status code from the server.
 
-        d.addCallback(partial(threads.deferToThread, wrapper))
-        return d
+        :rtype: twisted.internet.defer.Deferred
+        """
+        self.auth_backend._authentication_preprocessing("user", "pass")
+        self._stub_request(code)
+        with mock.patch('leap.bitmask.util.request_helpers.get_content',
+                        new=mock.create_autospec(get_content)) as \
+                get:
+            get.return_value = (content, 0)
+            return self.auth_backend._fetch_salt_B(None, self.TEST_USER)
 
     @deferred()
-    def test_start_authentication_fails_unknown_user(self):
-        d = self._prepare_auth_test(422)
-
-        def wrapper(_):
-            with self.assertRaises(srpauth.SRPAuthBadUserOrPassword):
-                with mock.patch(
-                        'leap.bitmask.util.request_helpers.get_content',
-                        new=mock.create_autospec(get_content)) as content:
-                    content.return_value = ("{}", 0)
-
-                    self.auth_backend._start_authentication(
-                        None, self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-        return d
+    def test_fetch_salt_B_fails_unknown_user(self):
+        return self._fails_with(self._fetch_salt_B(422, "{}"),
+                                srpauth.SRPAuthBadUserOrPassword)
 
     @deferred()
-    def test_start_authentication_fails_errorcode(self):
-        d = self._prepare_auth_test(302)
-
-        def wrapper(_):
-            with self.assertRaises(srpauth.SRPAuthBadStatusCode):
-                with mock.patch(
-                        'leap.bitmask.util.request_helpers.get_content',
-                        new=mock.create_autospec(get_content)) as content:
-                    content.return_value = ("{}", 0)
-
-                    self.auth_backend._start_authentication(None,
-                                                            self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-        return d
+    def test_fetch_salt_B_fails_errorcode(self):
+        return self._fails_with(self._fetch_salt_B(302, "{}"),
+                                srpauth.SRPAuthBadStatusCode)
 
     @deferred()
-    def test_start_authentication_fails_no_salt(self):
-        d = self._prepare_auth_test(200)
-
-        def wrapper(_):
-            with self.assertRaises(srpauth.SRPAuthNoSalt):
-                with mock.patch(
-                        'leap.bitmask.util.request_helpers.get_content',
-                        new=mock.create_autospec(get_content)) as content:
-                    content.return_value = ("{}", 0)
-
-                    self.auth_backend._start_authentication(None,
-                                                            self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-        return d
+    def test_fetch_salt_B_fails_no_salt(self):
+        return self._fails_with(self._fetch_salt_B(200, "{}"),
+                                srpauth.SRPAuthNoSalt)
 
     @deferred()
-    def test_start_authentication_fails_no_B(self):
-        d = self._prepare_auth_test(200)
-
-        def wrapper(_):
-            with self.assertRaises(srpauth.SRPAuthNoB):
-                with mock.patch(
-                        'leap.bitmask.util.request_helpers.get_content',
-                        new=mock.create_autospec(get_content)) as content:
-                    content.return_value = ('{"salt": ""}', 0)
-
-                    self.auth_backend._start_authentication(None,
-                                                            self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-        return d
+    def test_fetch_salt_B_fails_no_B(self):
+        return self._fails_with(self._fetch_salt_B(200, '{"salt": ""}'),
+                                srpauth.SRPAuthNoB)
 
     @deferred()
-    def test_start_authentication_correct_saltb(self):
-        d = self._prepare_auth_test(200)
-
+    def test_fetch_salt_B_correct_saltb(self):
         test_salt = "12345"
         test_B = "67890"
-
-        def wrapper(_):
-            with mock.patch('leap.bitmask.util.request_helpers.get_content',
-                            new=mock.create_autospec(get_content)) as \
-                    content:
-                content.return_value = ('{"salt":"%s", "B":"%s"}' % (test_salt,
-                                                                     test_B),
-                                        0)
-
-                salt, B = self.auth_backend._start_authentication(
-                    None,
-                    self.TEST_USER)
-                self.assertEqual(salt, test_salt)
-                self.assertEqual(B, test_B)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
+        d = self._fetch_salt_B(
+            200, '{"salt":"%s", "B":"%s"}' % (test_salt, test_B))
+        d.addCallback(self.assertEqual, (test_salt, test_B))
         return d
 
-    def _prepare_auth_challenge(self):
-        """
-        Creates the needed defers to test several test situations. It
-        adds up to the start authentication step.
+    def test_compute_M_wrong_saltb(self):
+        self.auth_backend._authentication_preprocessing("user", "pass")
+        with self.assertRaises(srpauth.SRPAuthBadDataFromServer):
+            self.auth_backend._compute_M("")
 
-        :returns: the defer that is created
-        :rtype: defer.Deferred
+    def _verify_HAMK(self, code=200, content="{}", side_effect=None):
         """
-        d = threads.deferToThread(self.register.register_user,
-                                  self.TEST_USER,
-                                  self.TEST_PASS)
-
-        def wrapper_preproc(*args):
-            return threads.deferToThread(
-                self.auth_backend._authentication_preprocessing,
-                self.TEST_USER, self.TEST_PASS)
-
-        d.addCallback(wrapper_preproc)
-
-        def wrapper_start(*args):
-            return threads.deferToThread(
-                self.auth_backend._start_authentication,
-                None, self.TEST_USER)
-
-        d.addCallback(wrapper_start)
+        Sends the M parameter, getting content with the status code
+        from the server, or failing with side_effect.
 
-        return d
-
-    @deferred()
-    def test_process_challenge_wrong_saltb(self):
-        d = self._prepare_auth_challenge()
-
-        def wrapper(salt_B):
-            with self.assertRaises(srpauth.SRPAuthBadDataFromServer):
-                self.auth_backend._process_challenge("",
-                                                     username=self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-        return d
+        :rtype: twisted.internet.defer.Deferred
+        """
+        self._stub_request(code, side_effect)
+        with mock.patch('leap.bitmask.util.request_helpers.get_content',
+                        new=mock.create_autospec(get_content)) as \
+                get:
+            if isinstance(content, Exception):
+                get.side_effect = content
+            else:
+                get.return_value = (content, 0)
+            return self.auth_backend._verify_HAMK("M", self.TEST_USER)
 
     @deferred()
-    def test_process_challenge_requests_problem_raises(self):
-        d = self._prepare_auth_challenge()
-
-        self.auth_backend._session.put = mock.create_autospec(
-            self.auth_backend._session.put,
+    def test_verify_HAMK_requests_problem_raises(self):
+        d = self._verify_HAMK(
             side_effect=requests.exceptions.ConnectionError())
-
-        def wrapper(salt_B):
-            with self.assertRaises(srpauth.SRPAuthConnectionError):
-                self.auth_backend._process_challenge(salt_B,
-                                                     username=self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-
-        return d
+        return self._fails_with(d, srpauth.SRPAuthConnectionError)
 
     @deferred()
-    def test_process_challenge_json_decode_error(self):
-        d = self._prepare_auth_challenge()
-
-        def wrapper(salt_B):
-            with mock.patch('leap.bitmask.util.request_helpers.get_content',
-                            new=mock.create_autospec(get_content)) as \
-                    content:
-                content.return_value = ("{", 0)
-                content.side_effect = JSONDecodeError("", "", 0)
-
-                with self.assertRaises(srpauth.SRPAuthJSONDecodeError):
-                    self.auth_backend._process_challenge(
-                        salt_B,
-                        username=self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-
-        return d
+    def test_verify_HAMK_json_decode_error(self):
+        d = self._verify_HAMK(content=JSONDecodeError("", "", 0))
+        return self._fails_with(d, srpauth.SRPAuthJSONDecodeError)
 
     @deferred()
-    def test_process_challenge_bad_password(self):
-        d = self._prepare_auth_challenge()
-
-        res = Response()
-        res.status_code = 422
-        self.auth_backend._session.put = mock.create_autospec(
-            self.auth_backend._session.put,
-            return_value=res)
-
-        def wrapper(salt_B):
-            with mock.patch('leap.bitmask.util.request_helpers.get_content',
-                            new=mock.create_autospec(get_content)) as \
-                    content:
-                content.return_value = ("", 0)
-                with self.assertRaises(srpauth.SRPAuthBadUserOrPassword):
-                    self.auth_backend._process_challenge(
-                        salt_B,
-                        username=self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-
-        return d
+    def test_verify_HAMK_bad_password(self):
+        d = self._verify_HAMK(422, "")
+        return self._fails_with(d, srpauth.SRPAuthBadUserOrPassword)
 
     @deferred()
-    def test_process_challenge_bad_password2(self):
-        d = self._prepare_auth_challenge()
-
-        res = Response()
-        res.status_code = 422
-        self.auth_backend._session.put = mock.create_autospec(
-            self.auth_backend._session.put,
-            return_value=res)
-
-        def wrapper(salt_B):
-            with mock.patch('leap.bitmask.util.request_helpers.get_content',
-                            new=mock.create_autospec(get_content)) as \
-                    content:
-                content.return_value = ("[]", 0)
-                with self.assertRaises(srpauth.SRPAuthBadUserOrPassword):
-                    self.auth_backend._process_challenge(
-                        salt_B,
-                        username=self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-
-        return d
+    def test_verify_HAMK_bad_password2(self):
+        d = self._verify_HAMK(422, "[]")
+        return self._fails_with(d, srpauth.SRPAuthBadUserOrPassword)
 
     @deferred()
-    def test_process_challenge_other_error_code(self):
-        d = self._prepare_auth_challenge()
-
-        res = Response()
-        res.status_code = 300
-        self.auth_backend._session.put = mock.create_autospec(
-            self.auth_backend._session.put,
-            return_value=res)
-
-        def wrapper(salt_B):
-            with mock.patch('leap.bitmask.util.request_helpers.get_content',
-                            new=mock.create_autospec(get_content)) as \
-                    content:
-                content.return_value = ("{}", 0)
-                with self.assertRaises(srpauth.SRPAuthBadStatusCode):
-                    self.auth_backend._process_challenge(
-                        salt_B,
-                        username=self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-
-        return d
+    def test_verify_HAMK_other_error_code(self):
+        d = self._verify_HAMK(300, "{}")
+        return self._fails_with(d, srpauth.SRPAuthBadStatusCode)
 
     @deferred()
-    def test_process_challenge(self):
-        d = self._prepare_auth_challenge()
-
-        def wrapper(salt_B):
-            self.auth_backend._process_challenge(salt_B,
-                                                 username=self.TEST_USER)
-
-        d.addCallback(partial(threads.deferToThread, wrapper))
-
-        return d
+    def test_verify_HAMK_bad_data(self):
+        d = self._verify_HAMK(200, '{"M2": "abc12"}')
+        return self._fails_with(d, srpauth.SRPAuthBadDataFromServer)
 
     def test_extract_data_wrong_data(self):
         with self.assertRaises(srpauth.SRPAuthBadDataFromServer):
@@ -508,7 +379,7 @@ class SRPAuthTestCase(unittest.TestCase):
         with self.assertRaises(srpauth.SRPAuthBadDataFromServer):
             self.auth_backend._extract_data({"M2": ""})
 
-    def test_extract_data_sets_uidtoken(self):
+    def test_extract_data_returns_uidtoken(self):
         test_uid = "someuid"
         test_m2 = "somem2"
         test_token = "sometoken"
@@ -517,15 +388,12 @@ class SRPAuthTestCase(unittest.TestCase):
             "id": test_uid,
             "token": test_token
         }
-        m2 = self.auth_backend._extract_data(test_data)
+        data = self.auth_backend._extract_data(test_data)
 
-        self.assertEqual(m2, test_m2)
-        self.assertEqual(self.auth_backend.get_uuid(), test_uid)
-        self.assertEqual(self.auth_backend.get_uuid(),
-                         self.auth.get_uuid())
-        self.assertEqual(self.auth_backend.get_token(), test_token)
-        self.assertEqual(self.auth_backend.get_token(),
-                         self.auth.get_token())
+        self.assertEqual(data, (test_m2, test_uid, test_token))
+        # nothing is published before the session is verified
+        self.assertIsNone(self.auth_backend.get_uuid())
+        self.assertIsNone(self.auth_backend.get_token())
 
     def _prepare_verify_session(self):
         """
@@ -535,18 +403,19 @@ class SRPAuthTestCase(unittest.TestCase):
         :returns: The defer to chain to
         :rtype: defer.Deferred
         """
-        d = self._prepare_auth_challenge()
+        d = self._prepare_auth_test()
+        d.addCallback(self.auth_backend._fetch_salt_B, self.TEST_USER)
 
-        def wrapper_proc_challenge(salt_B):
-            return self.auth_backend._process_challenge(
-                salt_B,
-                username=self.TEST_USER)
+        def send_M(salt_B):
+            M = self.auth_backend._compute_M(salt_B)
+            auth_url, auth_data = \
+                self.auth_backend._get_challenge_request(M, self.TEST_USER)
+            return self.auth_backend._send("PUT", auth_url, auth_data,
+                                           "HAMK")
 
-        def wrapper_extract_data(data):
-            return self.auth_backend._extract_data(data)
-
-        d.addCallback(partial(threads.deferToThread, wrapper_proc_challenge))
-        d.addCallback(partial(threads.deferToThread, wrapper_extract_data))
+        d.addCallback(send_M)
+        d.addCallback(self.auth_backend._parse_challenge_response)
+        d.addCallback(self.auth_backend._extract_data)
 
         return d
 
@@ -554,9 +423,10 @@ class SRPAuthTestCase(unittest.TestCase):
     def test_verify_session_unhexlifiable_m2(self):
         d = self._prepare_verify_session()
 
-        def wrapper(M2):
+        def wrapper((M2, uuid, token)):
             with self.assertRaises(srpauth.SRPAuthBadDataFromServer):
-                self.auth_backend._verify_session("za")  # unhexlifiable value
+                # unhexlifiable value
+                self.auth_backend._verify_session("za", uuid, token)
 
         d.addCallback(wrapper)
 
@@ -566,11 +436,12 @@ class SRPAuthTestCase(unittest.TestCase):
     def test_verify_session_unverifiable_m2(self):
         d = self._prepare_verify_session()
 
-        def wrapper(M2):
+        def wrapper((M2, uuid, token)):
             with self.assertRaises(srpauth.SRPAuthVerificationFailed):
                 # Correctly unhelifiable value, but not for verifying the
                 # session
-                self.auth_backend._verify_session("abc12")
+                self.auth_backend._verify_session("abc12", uuid, token)
+            self.assertIsNone(self.auth_backend.get_token())
 
         d.addCallback(wrapper)
 
@@ -580,12 +451,12 @@ class SRPAuthTestCase(unittest.TestCase):
     def test_verify_session_fails_on_no_session_id(self):
         d = self._prepare_verify_session()
 
-        def wrapper(M2):
+        def wrapper(data):
             self.auth_backend._session.cookies.get = mock.create_autospec(
                 self.auth_backend._session.cookies.get,
                 return_value=None)
             with self.assertRaises(srpauth.SRPAuthNoSessionId):
-                self.auth_backend._verify_session(M2)
+                self.auth_backend._verify_session(*data)
 
         d.addCallback(wrapper)
 
@@ -597,15 +468,15 @@ class SRPAuthTestCase(unittest.TestCase):
 
         test_session_id = "12345"
 
-        def wrapper(M2):
+        def wrapper((M2, uuid, token)):
             self.auth_backend._session.cookies.get = mock.create_autospec(
                 self.auth_backend._session.cookies.get,
                 return_value=test_session_id)
-            self.auth_backend._verify_session(M2)
-            self.assertEqual(self.auth_backend.get_session_id(),
-                             test_session_id)
-            self.assertEqual(self.auth_backend.get_session_id(),
-                             self.auth.get_session_id())
+            self.auth_backend._verify_session(M2, uuid, token)
+            credentials = self.auth.get_credentials()
+            self.assertEqual(credentials.session_id, test_session_id)
+            self.assertEqual(credentials.uuid, uuid)
+            self.assertEqual(credentials.token, token)
 
         d.addCallback(wrapper)
 
@@ -615,8 +486,8 @@ class SRPAuthTestCase(unittest.TestCase):
     def test_verify_session(self):
         d = self._prepare_verify_session()
 
-        def wrapper(M2):
-            self.auth_backend._verify_session(M2)
+        def wrapper(data):
+            self.auth_backend._verify_session(*data)
 
         d.addCallback(wrapper)
 
@@ -627,17 +498,14 @@ class SRPAuthTestCase(unittest.TestCase):
         self.auth_backend._authentication_preprocessing = mock.create_autospec(
             self.auth_backend._authentication_preprocessing,
             return_value=None)
-        self.auth_backend._start_authentication = mock.create_autospec(
-            self.auth_backend._start_authentication,
-            return_value=None)
-        self.auth_backend._process_challenge = mock.create_autospec(
-            self.auth_backend._process_challenge,
-            return_value=None)
-        self.auth_backend._extract_data = mock.create_autospec(
-            self.auth_backend._extract_data,
-            return_value=None)
-        self.auth_backend._verify_session = mock.create_autospec(
-            self.auth_backend._verify_session,
+        self.auth_backend._fetch_salt_B = mock.create_autospec(
+            self.auth_backend._fetch_salt_B,
+            return_value=("salt", "B"))
+        self.auth_backend._compute_M = mock.create_autospec(
+            self.auth_backend._compute_M,
+            return_value="M")
+        self.auth_backend._verify_HAMK = mock.create_autospec(
+            self.auth_backend._verify_HAMK,
             return_value=None)
 
         d = self.auth_backend.authenticate(self.TEST_USER, self.TEST_PASS)
@@ -648,20 +516,218 @@ class SRPAuthTestCase(unittest.TestCase):
                     username=self.TEST_USER,
                     password=self.TEST_PASS
                 )
-            self.auth_backend._start_authentication.assert_called_once_with(
-                None,
-                username=self.TEST_USER)
-            self.auth_backend._process_challenge.assert_called_once_with(
-                None,
-                username=self.TEST_USER)
-            self.auth_backend._extract_data.assert_called_once_with(
-                None)
-            self.auth_backend._verify_session.assert_called_once_with(None)
+            self.auth_backend._fetch_salt_B.assert_called_once_with(
+                None, self.TEST_USER)
+            self.auth_backend._compute_M.assert_called_once_with(
+                ("salt", "B"))
+            self.auth_backend._verify_HAMK.assert_called_once_with(
+                "M", self.TEST_USER)
 
         d.addCallback(check)
 
         return d
 
+    @deferred()
+    def test_authenticate_against_provider(self):
+        d = self._prepare_auth_test()
+
+        def authenticate(_):
+            return self.auth_backend.authenticate(self.TEST_USER,
+                                                  self.TEST_PASS)
+
+        def check(_):
+            self.assertIsNotNone(self.auth_backend.get_session_id())
+            self.assertIsNotNone(self.auth_backend.get_uuid())
+            timings = self.auth.get_login_timings()
+            self.assertEqual(timings.keys(),
+                             [self.auth_backend.A_GENERATION,
+                              self.auth_backend.SALT_B_FETCH,
+                              self.auth_backend.M_COMPUTATION,
+                              self.auth_backend.HAMK_VERIFICATION])
+            calls = self.request.call_args_list
+            methods = [call[0][0] for call in calls]
+            self.assertEqual(methods, ["POST", "PUT"])
+
+        d.addCallback(authenticate)
+        d.addCallback(check)
+
+        return d
+
+    def _prepare_resume(self, status_code):
+        """
+        Caches a session for the test user, and makes the provider answer
+        the validation request with status_code.
+        """
+        cache = SessionCache(FakeKeyring())
+        cache.save("%s@%s" % (self.TEST_USER, self.provider.get_domain()),
+                   "someuid", "sometoken", "1234", self.TEST_PASS)
+        self.auth_backend._session_cache = cache
+
+        res = Response()
+        res.status_code = status_code
+        self.auth_backend._send = mock.create_autospec(
+            self.auth_backend._send,
+            return_value=defer.succeed(res))
+        self.auth_backend._srp_login = mock.create_autospec(
+            self.auth_backend._srp_login,
+            return_value=defer.succeed(None))
+
+    @deferred()
+    def test_authenticate_resumes_session(self):
+        self._prepare_resume(200)
+        d = self.auth_backend.authenticate(self.TEST_USER, self.TEST_PASS,
+                                           resume=True)
+
+        def check(_):
+            self.assertFalse(self.auth_backend._srp_login.called)
+            self.assertEqual(self.auth_backend.get_session_id(), "1234")
+            self.assertEqual(self.auth_backend.get_uuid(), "someuid")
+            self.assertEqual(self.auth_backend.get_token(), "sometoken")
+
+            args, kwargs = self.auth_backend._send.call_args
+            self.assertEqual(args[0], "GET")
+            self.assertTrue(args[1].endswith("/users/someuid.json"))
+            self.assertEqual(
+                kwargs["headers"],
+                {self.auth_backend.AUTHORIZATION_KEY:
+                 "Token token=sometoken"})
+
+        d.addCallback(check)
+        return d
+
+    @deferred()
+    def test_authenticate_resume_falls_back_to_srp(self):
+        self._prepare_resume(401)
+        d = self.auth_backend.authenticate(self.TEST_USER, self.TEST_PASS,
+                                           resume=True)
+
+        def check(_):
+            self.auth_backend._srp_login.assert_called_once_with(
+                self.TEST_USER, self.TEST_PASS)
+            self.assertIsNone(self.auth_backend.get_session_id())
+
+        d.addCallback(check)
+        return d
+
+    @deferred()
+    def test_authenticate_resume_checks_the_password(self):
+        self._prepare_resume(200)
+        self.auth_backend._srp_login.return_value = defer.fail(
+            srpauth.SRPAuthBadUserOrPassword())
+        d = self.auth_backend.authenticate(self.TEST_USER, "wrongpass",
+                                           resume=True)
+
+        def check(failure):
+            failure.trap(srpauth.SRPAuthBadUserOrPassword)
+            self.assertFalse(self.auth_backend._send.called)
+            self.auth_backend._srp_login.assert_called_once_with(
+                self.TEST_USER, "wrongpass")
+            self.assertIsNone(self.auth_backend.get_session_id())
+
+        d.addCallbacks(lambda _: self.fail("logged in"), check)
+        return d
+
+    @deferred()
+    def test_authenticate_does_not_resume_by_default(self):
+        self._prepare_resume(200)
+        d = self.auth_backend.authenticate(self.TEST_USER, self.TEST_PASS)
+
+        def check(_):
+            self.assertFalse(self.auth_backend._send.called)
+            self.assertTrue(self.auth_backend._srp_login.called)
+
+        d.addCallback(check)
+        return d
+
+    def test_resumed_session_keeps_token_age(self):
+        self._prepare_resume(200)
+        cache = self.auth_backend._session_cache
+        cache.save("%s@%s" % (self.TEST_USER, self.provider.get_domain()),
+                   "someuid", "sometoken", "1234", self.TEST_PASS,
+                   issued=time.time() - 600)
+        d = self.auth_backend.authenticate(self.TEST_USER, self.TEST_PASS,
+                                           resume=True)
+
+        def check(_):
+            self.assertTrue(self.auth_backend.get_token_age() >= 600)
+
+        d.addCallback(check)
+        return d
+
+    def _prepare_refresh(self, login_result):
+        """
+        Logs in the test user, and makes the next login return
+        login_result after setting a new token.
+        """
+        self.auth_backend._username = self.TEST_USER
+        self.auth_backend._password = self.TEST_PASS
+        self.auth_backend.set_uuid("someuid")
+        self.auth_backend.set_token("oldtoken", time.time() - 600)
+        self.auth_backend.set_session_id("1234")
+
+        def login(username, password):
+            self.auth_backend.set_token("newtoken")
+            return login_result
+        self.auth_backend._srp_login = mock.create_autospec(
+            self.auth_backend._srp_login, side_effect=login)
+
+    @deferred()
+    def test_refresh(self):
+        self._prepare_refresh(defer.succeed(None))
+        d = self.auth_backend.refresh()
+
+        def check(token):
+            self.auth_backend._srp_login.assert_called_once_with(
+                self.TEST_USER, self.TEST_PASS)
+            self.assertEqual(token, "newtoken")
+            self.assertTrue(self.auth_backend.get_token_age() < 600)
+
+        d.addCallback(check)
+        return d
+
+    @deferred()
+    def test_refresh_keeps_session_on_failure(self):
+        self._prepare_refresh(
+            defer.fail(srpauth.SRPAuthConnectionError()))
+        old_session = self.auth_backend._session
+        d = self.auth_backend.refresh()
+
+        def check(failure):
+            failure.trap(srpauth.SRPAuthConnectionError)
+            self.assertEqual(self.auth_backend.get_token(), "oldtoken")
+            self.assertEqual(self.auth_backend.get_session_id(), "1234")
+            self.assertTrue(self.auth_backend.get_token_age() >= 600)
+            self.assertEqual(self.auth_backend._session, old_session)
+
+        d.addCallbacks(lambda _: self.fail("The refresh should fail"),
+                       check)
+        return d
+
+    def test_logout_during_refresh(self):
+        self._prepare_refresh(None)
+        self.auth_backend._resume = True
+        self.auth_backend._session_cache = mock.Mock()
+
+        # the login ends storing the new session, like _verify_HAMK
+        login = defer.Deferred()
+        login.addCallback(
+            lambda _: self.auth_backend._update_login_credentials(
+                token="newtoken", session_id="5678"))
+        self.auth_backend._srp_login = mock.Mock(return_value=login)
+
+        failures = []
+        d = self.auth_backend.refresh()
+        d.addErrback(failures.append)
+
+        self.auth_backend._session.delete = mock.Mock()
+        self.auth_backend.logout()
+        login.callback(None)
+
+        self.assertTrue(failures[0].check(srpauth.SRPAuthLoggedOut))
+        self.assertEqual(self.auth_backend.get_credentials(),
+                         srpauth.NO_CREDENTIALS)
+        self.assertFalse(self.auth_backend._session_cache.save.called)
+
     @deferred()
     def test_logout_does_not_fail_if_not_logged_in(self):
 
@@ -685,7 +751,7 @@ class SRPAuthTestCase(unittest.TestCase):
 
     @deferred()
     def test_logout_clears(self):
-        self.auth_backend._session_id = "1234"
+        self.auth_backend.set_session_id("1234")
 
         def wrapper(*args):
             old_session = self.auth_backend._session
@@ -697,6 +763,29 @@ class SRPAuthTestCase(unittest.TestCase):
         d = threads.deferToThread(wrapper)
         return d
 
+    def test_session_follows_the_provider(self):
+        session = self.auth_backend._session
+        self.assertIs(self.auth_backend._session, session)
+
+        self.provider.get_api_uri.return_value = "https://other.example.org"
+        self.assertIsNot(self.auth_backend._session, session)
+
+    def test_credentials_are_a_snapshot(self):
+        self.auth_backend.set_uuid("someuid")
+        self.auth_backend.set_token("sometoken", 1234)
+        self.auth_backend.set_session_id("1234")
+        credentials = self.auth.get_credentials()
+
+        self.auth_backend.set_token("newtoken")
+        self.assertEqual(credentials, srpauth.SessionCredentials(
+            "1234", "someuid", "sometoken", 1234))
+        self.assertEqual(self.auth.get_credentials().token, "newtoken")
+        self.assertEqual(self.auth.get_credentials().session_id, "1234")
+
+        self.auth_backend._set_credentials(srpauth.NO_CREDENTIALS)
+        self.assertIsNone(self.auth.get_token_age())
+        self.assertEqual(credentials.token, "sometoken")
+
 
 class SRPAuthSingletonTestCase(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# test_srpbackend.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the selection of the SRP backend
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+import srp._pysrp
+
+from leap.bitmask.crypto import srpbackend
+
+
+class SRPBackendTest(unittest.TestCase):
+    """
+    Tests for the srpbackend module
+    """
+
+    def setUp(self):
+        srpbackend._backend = None
+
+    def tearDown(self):
+        srpbackend._backend = None
+
+    def _broken(self):
+        module = mock.Mock()
+        module.__name__ = "broken"
+        module.User.side_effect = TypeError()
+        return module
+
+    def test_pysrp_works(self):
+        module = srpbackend.load_backend(srpbackend.PYSRP)
+        self.assertTrue(srpbackend.is_working(module))
+
+    def test_broken_backend(self):
+        self.assertFalse(srpbackend.is_working(self._broken()))
+
+    def test_fastest_working_backend_is_used(self):
+        loaders = {
+            srpbackend.GMPY2: mock.Mock(side_effect=ImportError()),
+            srpbackend.CTSRP: self._broken,
+            srpbackend.PYSRP: lambda: srp._pysrp,
+        }
+        with mock.patch.object(srpbackend, "_LOADERS", loaders):
+            self.assertEqual(srpbackend.get_backend_name(),
+                             srpbackend.PYSRP)
+            self.assertIs(srpbackend.get_srp(), srp._pysrp)
+
+    def test_backend_is_selected_once(self):
+        srpbackend.get_srp()
+        with mock.patch.object(srpbackend, "is_working") as is_working:
+            srpbackend.get_srp()
+            self.assertFalse(is_working.called)
+
+    def test_gmpy2(self):
+        gmpy2 = mock.Mock()
+        gmpy2.powmod.side_effect = pow
+        with mock.patch.dict("sys.modules", {"gmpy2": gmpy2}):
+            module = srpbackend.load_backend(srpbackend.GMPY2)
+        self.assertTrue(srpbackend.is_working(module))
+        self.assertTrue(gmpy2.powmod.called)
+        # the pure Python module is not modified
+        self.assertFalse(hasattr(srp._pysrp, "pow"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -19,7 +19,6 @@ EIP Status Panel widget implementation
 """
 import logging
 
-from datetime import datetime
 from functools import partial
 
 from PySide import QtCore, QtGui
@@ -28,7 +27,8 @@ from leap.bitmask.services.eip.connection import EIPConnection
 from leap.bitmask.services.eip.vpnprocess import VPNManager
 from leap.bitmask.services import get_service_display_name, EIP_SERVICE
 from leap.bitmask.platform_init import IS_LINUX
-from leap.bitmask.util.averages import RateMovingAverage
+from leap.bitmask.util.averages import ThroughputSeries
+from leap.bitmask.util.averages import write_history_csv
 from leap.common.check import leap_assert_type
 
 from ui_eip_status import Ui_EIPStatus
@@ -74,6 +74,7 @@ class EIPStatusWidget(QtGui.QWidget):
 
         self._set_traffic_rates()
         self._make_status_clickable()
+        self._add_export_history_action()
 
         self._provider = ""
 
@@ -89,6 +90,38 @@ class EIPStatusWidget(QtGui.QWidget):
         self.ui.btnUpload.clicked.connect(onclicked)
         self.ui.btnDownload.clicked.connect(onclicked)
 
+    def _add_export_history_action(self):
+        """
+        Adds the action to export the traffic history to the context menu
+        of the upload and download figures.
+        """
+        action = QtGui.QAction(self.tr("Export traffic history..."), self)
+        action.triggered.connect(self._on_export_history_triggered)
+        for button in (self.ui.btnUpload, self.ui.btnDownload):
+            button.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
+            button.addAction(action)
+
+    def _on_export_history_triggered(self):
+        """
+        SLOT
+        TRIGGER: the export traffic history action
+
+        Lets the user save the traffic history of the tunnel as csv.
+        """
+        fileName, filtr = QtGui.QFileDialog.getSaveFileName(
+            self, self.tr("Save As"), "traffic.csv",
+            options=QtGui.QFileDialog.DontUseNativeDialog)
+
+        if fileName:
+            try:
+                with open(fileName, 'w') as output:
+                    self.export_traffic_history(output)
+                logger.debug('Traffic history saved in %s' % (fileName,))
+            except IOError as e:
+                logger.error("Error saving the traffic history: %r" % (e,))
+        else:
+            logger.debug('Traffic history not saved!')
+
     def _on_VPN_status_clicked(self):
         """
         SLOT
@@ -105,8 +138,8 @@ class EIPStatusWidget(QtGui.QWidget):
         """
         Initializes up and download rates.
         """
-        self._up_rate = RateMovingAverage()
-        self._down_rate = RateMovingAverage()
+        self._up_rate = ThroughputSeries()
+        self._down_rate = ThroughputSeries()
 
         self.ui.btnUpload.setText(self.RATE_STR % (0,))
         self.ui.btnDownload.setText(self.RATE_STR % (0,))
@@ -119,18 +152,19 @@ class EIPStatusWidget(QtGui.QWidget):
         self._down_rate.reset()
         self.update_vpn_status(None)
 
-    def _update_traffic_rates(self, up, down):
+    def _update_traffic_rates(self, ts, up, down):
         """
         Updates up and download rates.
 
+        :param ts: monotonic timestamp of the reading.
+        :type ts: float
         :param up: upload total.
         :type up: int
         :param down: download total.
         :type down: int
         """
-        ts = datetime.now()
-        self._up_rate.append((ts, up))
-        self._down_rate.append((ts, down))
+        self._up_rate.append(ts, up)
+        self._down_rate.append(ts, down)
 
     def _get_traffic_rates(self):
         """
@@ -142,7 +176,20 @@ class EIPStatusWidget(QtGui.QWidget):
         up = self._up_rate
         down = self._down_rate
 
-        return (up.get_average(), down.get_average())
+        return (up.get_rate() / 1024, down.get_rate() / 1024)
+
+    def _get_traffic_averages(self):
+        """
+        Gets the moving averages of the traffic rates (in KB/s), which
+        change more smoothly than the rates.
+
+        :returns: a tuple with the (up, down) averages
+        :rtype: tuple
+        """
+        up = self._up_rate
+        down = self._down_rate
+
+        return (up.get_ewma() / 1024, down.get_ewma() / 1024)
 
     def _get_traffic_totals(self):
         """
@@ -154,7 +201,16 @@ class EIPStatusWidget(QtGui.QWidget):
         up = self._up_rate
         down = self._down_rate
 
-        return (up.get_total(), down.get_total())
+        return (up.get_total() / 1024, down.get_total() / 1024)
+
+    def export_traffic_history(self, fileobj):
+        """
+        Writes the up and download history of the current tunnel as csv.
+
+        :param fileobj: where to write the history.
+        :type fileobj: file
+        """
+        write_history_csv(fileobj, self._up_rate, self._down_rate)
 
     def _set_eip_icons(self):
         """
@@ -356,15 +412,13 @@ class EIPStatusWidget(QtGui.QWidget):
         Updates the download/upload labels based on the data provided
         by the VPN thread.
 
-        :param data: a dictionary with the tcp/udp write and read totals.
-                     If data is None, we just will refresh the display based
-                     on the previous data.
-        :type data: dict
+        :param data: the tcp/udp traffic counters. If data is None, we just
+                     will refresh the display based on the previous data.
+        :type data: TrafficCounters
         """
         if data:
-            upload = float(data[VPNManager.TCPUDP_WRITE_KEY] or "0")
-            download = float(data[VPNManager.TCPUDP_READ_KEY] or "0")
-            self._update_traffic_rates(upload, download)
+            self._update_traffic_rates(
+                data.ts, data.bytes_out, data.bytes_in)
 
         if self.DISPLAY_TRAFFIC_RATES:
             uprate, downrate = self._get_traffic_rates()
@@ -379,6 +433,11 @@ class EIPStatusWidget(QtGui.QWidget):
         self.ui.btnUpload.setText(upload_str)
         self.ui.btnDownload.setText(download_str)
 
+        upaverage, downaverage = self._get_traffic_averages()
+        average_str = self.tr("Average: %1.2f KB/s")
+        self.ui.btnUpload.setToolTip(average_str % (upaverage,))
+        self.ui.btnDownload.setToolTip(average_str % (downaverage,))
+
     def update_vpn_state(self, data):
         """
         SLOT
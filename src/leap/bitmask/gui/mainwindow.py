@@ -18,7 +18,6 @@
 Main window for Bitmask.
 """
 import logging
-import socket
 
 from threading import Condition
 from datetime import datetime
@@ -27,6 +26,7 @@ from PySide import QtCore, QtGui
 from zope.proxy import ProxyBase, setProxiedObject
 from twisted.internet import reactor, threads
 from twisted.internet.defer import CancelledError
+from twisted.internet.error import DNSLookupError
 
 from leap.bitmask import __version__ as VERSION
 from leap.bitmask import __version_hash__ as VERSION_HASH
@@ -34,6 +34,7 @@ from leap.bitmask.config import flags
 from leap.bitmask.config.leapsettings import LeapSettings
 from leap.bitmask.config.providerconfig import ProviderConfig
 
+from leap.bitmask.crypto import authsession
 from leap.bitmask.crypto import srpauth
 from leap.bitmask.crypto.srpauth import SRPAuth
 
@@ -53,6 +54,7 @@ from leap.bitmask.platform_init import IS_WIN, IS_MAC, IS_LINUX
 from leap.bitmask.platform_init.initializers import init_platform
 
 from leap.bitmask import backend
+from leap.bitmask import remotebackend
 
 from leap.bitmask.services import get_service_display_name
 
@@ -77,6 +79,7 @@ from leap.bitmask.services.soledad.soledadbootstrapper import \
     SoledadBootstrapper
 
 from leap.bitmask.util import make_address
+from leap.bitmask.util import resolver
 from leap.bitmask.util.keyring_helpers import has_keyring
 from leap.bitmask.util.leap_log_handler import LeapLogHandler
 
@@ -158,11 +161,21 @@ class MainWindow(QtGui.QMainWindow):
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
         self.menuBar().setNativeMenuBar(not IS_LINUX)
-        self._backend = backend.Backend(bypass_checks)
+        if IS_WIN:
+            # there are no unix sockets to talk to a backend daemon
+            self._backend = backend.Backend(bypass_checks)
+        else:
+            self._backend = remotebackend.BackendProxy(
+                remotebackend.get_socket_path())
+            self._backend.spawn(bypass_checks)
         self._backend.start()
 
         self._settings = LeapSettings()
 
+        # check the configured providers before the wizard is opened
+        self._backend.prefetch_providers(
+            self._settings.get_configured_providers())
+
         self._login_widget = LoginWidget(
             self._settings,
             self)
@@ -206,12 +219,9 @@ class MainWindow(QtGui.QMainWindow):
         self.eip_needs_login.connect(
             self._disable_eip_start_action)
 
-        # This is loaded only once, there's a bug when doing that more
-        # than once
-        # XXX HACK!! But we need it as long as we are using
-        # provider_config in here
-        self._provider_config = (
-            self._backend._components["provider"]._provider_config)
+        # The backend keeps its own copy, this one is loaded from the
+        # definition the backend downloads.
+        self._provider_config = ProviderConfig()
         # Used for automatic start of EIP
         self._provisional_provider_config = ProviderConfig()
         self._eip_config = eipconfig.EIPConfig()
@@ -1006,7 +1016,12 @@ class MainWindow(QtGui.QMainWindow):
         """
         if data[self._backend.PASSED_KEY]:
             selected_provider = self._login_widget.get_selected_provider()
-            self._backend.provider_bootstrap(selected_provider)
+            if self._provider_config.load(
+                    provider.get_provider_path(selected_provider)):
+                self._backend.provider_bootstrap(selected_provider)
+            else:
+                logger.error("Could not load provider configuration.")
+                self._login_problem_provider()
         else:
             logger.error(data[self._backend.ERROR_KEY])
             self._login_widget.set_enabled(True)
@@ -1145,7 +1160,9 @@ class MainWindow(QtGui.QMainWindow):
                 self._srp_auth.logout_ok.connect(self._logout_ok)
                 self._srp_auth.logout_error.connect(self._logout_error)
 
-            self._login_defer = self._srp_auth.authenticate(username, password)
+            self._login_defer = self._srp_auth.authenticate(
+                username, password,
+                resume=self._login_widget.get_remember())
             self._login_defer.addErrback(self._login_errback)
         else:
             self._login_widget.set_status(
@@ -1169,6 +1186,10 @@ class MainWindow(QtGui.QMainWindow):
         full_user_id = make_address(user, domain)
         self._mail_conductor.userid = full_user_id
         self._login_defer = None
+
+        # get a new token before this one expires
+        authsession.start(self._srp_auth)
+
         self._start_eip_bootstrap()
 
         # if soledad/mail is enabled:
@@ -1492,15 +1513,9 @@ class MainWindow(QtGui.QMainWindow):
         :param domain: the domain to check.
         :type domain: str
         """
-        def do_check():
-            """
-            Try to resolve the domain name.
-            """
-            socket.gethostbyname(domain.encode('idna'))
-
         def check_err(failure):
             """
-            Errback handler for `do_check`.
+            Errback handler for the name resolution.
 
             :param failure: the failure that triggered the errback.
             :type failure: twisted.python.failure.Failure
@@ -1522,11 +1537,12 @@ class MainWindow(QtGui.QMainWindow):
                 self, self.tr("Connection Error"), msg)
             reactor.callLater(0, show_err)
 
-            # python 2.7.4 raises socket.error
-            # python 2.7.5 raises socket.gaierror
-            failure.trap(socket.gaierror, socket.error)
+            failure.trap(DNSLookupError)
 
-        d = threads.deferToThread(do_check)
+        # we are checking that the DNS works now, a cached answer would
+        # hide the problem
+        d = resolver.get_resolver().resolve(domain.encode('idna'),
+                                            use_cache=False)
         d.addErrback(check_err)
 
     def _try_autostart_eip(self):
@@ -1592,17 +1608,38 @@ class MainWindow(QtGui.QMainWindow):
                          "available provider!")
             return
 
-        try:
-            # XXX move this to EIPConductor
-            host, port = get_openvpn_management()
-            self._vpn.start(eipconfig=self._eip_config,
+        # XXX move this to EIPConductor
+        host, port = get_openvpn_management()
+        d = self._vpn.start(eipconfig=self._eip_config,
                             providerconfig=provider_config,
                             socket_host=host,
                             socket_port=port)
-            self._settings.set_defaultprovider(provider)
+        d.addCallbacks(self._eip_started, self._eip_start_failed,
+                       callbackArgs=(provider,))
+
+    def _eip_started(self, _, provider):
+        """
+        Callback for the start of the vpn, once openvpn is spawned.
+
+        :param provider: the domain of the provider we connect to.
+        :type provider: str
+        """
+        self._settings.set_defaultprovider(provider)
 
-            # XXX move to the state machine too
-            self._eip_status.set_provider(provider)
+        # XXX move to the state machine too
+        self._eip_status.set_provider(provider)
+        self._already_started_eip = True
+
+    def _eip_start_failed(self, failure):
+        """
+        Errback for the start of the vpn, shows what kept us from
+        spawning openvpn.
+
+        :param failure: the failure that triggered the errback.
+        :type failure: twisted.python.failure.Failure
+        """
+        try:
+            failure.raiseException()
 
         # TODO refactor exceptions so they provide translatable
         # usef-facing messages.
@@ -1654,8 +1691,6 @@ class MainWindow(QtGui.QMainWindow):
             # we can pass a translatable string to the panel (usermessage attr)
             self._eip_status.set_eip_status("%s" % (e,), error=True)
             self._set_eipstatus_off()
-        else:
-            self._already_started_eip = True
 
     @QtCore.Slot()
     def _stop_eip(self):
@@ -1772,6 +1807,8 @@ class MainWindow(QtGui.QMainWindow):
             eip_status_label = eip_status_label.format(self._eip_name)
             self._eip_status.set_eip_status(eip_status_label, error=True)
             signal = qtsigs.connection_died_signal
+            logger.debug("Last openvpn output:\n%s" % (
+                "\n".join(self._vpn.get_output_tail()[-20:]),))
 
         if exitCode == 0 and IS_MAC:
             # XXX remove this warning after I fix cocoasudo.
@@ -1901,6 +1938,7 @@ class MainWindow(QtGui.QMainWindow):
 
         Starts the logout sequence
         """
+        authsession.stop()
         self._soledad_bootstrapper.cancel_bootstrap()
         setProxiedObject(self._soledad, None)
 
@@ -2005,16 +2043,27 @@ class MainWindow(QtGui.QMainWindow):
 
     def _cleanup_and_quit(self):
         """
-        Call all the cleanup actions in a serialized way.
+        Call all the cleanup actions in a serialized way, except for the
+        vpn teardown that runs in parallel with the rest of them.
         Should be called from the quit function.
+
+        :returns: a deferred that fires when the vpn is down.
+        :rtype: twisted.internet.defer.Deferred
         """
         logger.debug('About to quit, doing cleanup...')
 
+        # openvpn takes a while to go down, so we start with it and do
+        # the rest of the cleanup meanwhile.
+        logger.debug('Terminating vpn')
+        vpn_down = self._vpn.terminate(shutdown=True)
+
         self._stop_imap_service()
 
+        authsession.stop()
         if self._srp_auth is not None:
-            if self._srp_auth.get_session_id() is not None or \
-               self._srp_auth.get_token() is not None:
+            credentials = self._srp_auth.get_credentials()
+            if credentials.session_id is not None or \
+               credentials.token is not None:
                 # XXX this can timeout after loong time: See #3368
                 self._srp_auth.logout()
 
@@ -2024,9 +2073,6 @@ class MainWindow(QtGui.QMainWindow):
         else:
             logger.error("No instance of soledad was found.")
 
-        logger.debug('Terminating vpn')
-        self._vpn.terminate(shutdown=True)
-
         self._cancel_ongoing_defers()
 
         # TODO missing any more cancels?
@@ -2034,6 +2080,8 @@ class MainWindow(QtGui.QMainWindow):
         logger.debug('Cleaning pidfiles')
         self._cleanup_pidfiles()
 
+        return vpn_down
+
     def quit(self):
         """
         Cleanup and tidely close the main window before quitting.
@@ -2045,7 +2093,7 @@ class MainWindow(QtGui.QMainWindow):
         QtGui.QApplication.setQuitOnLastWindowClosed(True)
 
         self._backend.stop()
-        self._cleanup_and_quit()
+        cleanup = self._cleanup_and_quit()
         self._really_quit = True
 
         if self._wizard:
@@ -2056,7 +2104,8 @@ class MainWindow(QtGui.QMainWindow):
 
         self.close()
 
+        # we keep the reactor running until the vpn is down
         if self._quit_callback:
-            self._quit_callback()
+            cleanup.addBoth(lambda _: self._quit_callback())
 
         logger.debug('Bye.')
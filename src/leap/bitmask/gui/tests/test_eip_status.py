@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# test_eip_status.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the traffic figures of the EIP status widget
+"""
+import types
+
+from StringIO import StringIO
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from leap.bitmask.gui.eip_status import EIPStatusWidget
+from leap.bitmask.services.eip.vpnprocess import TrafficCounters
+
+
+class TrafficTest(unittest.TestCase):
+    """
+    Tests for the traffic figures, called without building the whole
+    widget.
+    """
+
+    def setUp(self):
+        self.widget = mock.Mock()
+        self.widget.DISPLAY_TRAFFIC_RATES = True
+        self.widget.tr = lambda text: text
+        for name in ("RATE_STR", "TOTAL_STR"):
+            setattr(self.widget, name, getattr(EIPStatusWidget, name))
+        for name in ("_set_traffic_rates", "_update_traffic_rates",
+                     "_get_traffic_rates", "_get_traffic_totals",
+                     "_get_traffic_averages", "update_vpn_status",
+                     "export_traffic_history"):
+            method = getattr(EIPStatusWidget, name).im_func
+            setattr(self.widget, name,
+                    types.MethodType(method, self.widget))
+        self.widget._set_traffic_rates()
+
+    def _status(self, ts, bytes_out, bytes_in):
+        self.widget.update_vpn_status(
+            TrafficCounters(ts, bytes_in, bytes_out, 0, 0))
+
+    def test_average_tooltips(self):
+        self._status(0, 0, 0)
+        self._status(1, 2048, 1024)
+        self.widget.ui.btnUpload.setToolTip.assert_called_with(
+            "Average: 2.00 KB/s")
+        self.widget.ui.btnDownload.setToolTip.assert_called_with(
+            "Average: 1.00 KB/s")
+
+    def test_export_traffic_history(self):
+        self._status(0, 0, 0)
+        self._status(1, 2048, 1024)
+        out = StringIO()
+        self.widget.export_traffic_history(out)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ["timestamp,upload,download",
+                          "0.000,0,0",
+                          "1.000,2048,1024"])
+
+
+if __name__ == "__main__":
+    unittest.main()
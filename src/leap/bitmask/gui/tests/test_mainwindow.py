@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# test_mainwindow.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the slots of the main window
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from leap.bitmask.gui.mainwindow import MainWindow
+from leap.bitmask.services.eip.vpnprocess import VPN
+
+
+class EIPFinishedTest(unittest.TestCase):
+    """
+    Tests for MainWindow._eip_finished, called without building the
+    whole window.
+    """
+
+    def setUp(self):
+        self.window = mock.Mock()
+        self.window.tr = lambda text: text
+        self.window._vpn = mock.Mock(spec=VPN)
+        self.window._vpn.get_output_tail.return_value = ["line"]
+        self.qtsigs = self.window._eip_connection.qtsigs
+
+    def _eip_finished(self, exit_code):
+        MainWindow._eip_finished.im_func(self.window, exit_code)
+
+    def test_unexpected_exit(self):
+        self.window.user_stopped_eip = True
+        self._eip_finished(1)
+
+        self.window._vpn.get_output_tail.assert_called_once_with()
+        self.qtsigs.connection_died_signal.emit.assert_called_once_with()
+        self.assertFalse(self.qtsigs.disconnected_signal.emit.called)
+
+    def test_user_stopped(self):
+        self.window.user_stopped_eip = True
+        self._eip_finished(0)
+
+        self.qtsigs.disconnected_signal.emit.assert_called_once_with()
+        self.assertFalse(self.qtsigs.connection_died_signal.emit.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
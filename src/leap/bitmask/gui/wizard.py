@@ -88,10 +88,8 @@ class Wizard(QtGui.QWizard):
         self._backend_connect()
 
         self._domain = None
-        # HACK!! We need provider_config for the time being, it'll be
-        # removed
-        self._provider_config = (
-            self._backend._components["provider"]._provider_config)
+        # loaded from the definition the backend downloads
+        self._provider_config = ProviderConfig()
 
         # We will store a reference to the defers for eventual use
         # (eg, to cancel them) but not doing anything with them right now.
@@ -165,6 +163,8 @@ class Wizard(QtGui.QWizard):
         """
         ls = LeapSettings()
         providers = ls.get_configured_providers()
+        # the checks done in the background are shown as icons
+        self._backend.prefetch_providers(providers)
         if not providers:
             self.ui.rbExistingProvider.setEnabled(False)
             self.ui.label_8.setEnabled(False)  # 'https://' label
@@ -195,6 +195,26 @@ class Wizard(QtGui.QWizard):
         # 'Use existing provider' option.
         self.ui.rbExistingProvider.setChecked(True)
 
+    def _providers_prefetched(self, statuses):
+        """
+        SLOT
+        TRIGGER: self._backend.signaler.prov_prefetched
+
+        Marks the configured providers as checked or not.
+
+        :param statuses: the status of each provider, healthy or stale.
+        :type statuses: dict
+        """
+        for domain, status in statuses.items():
+            index = self.ui.cbProviders.findText(domain)
+            if index < 0:
+                continue
+            if status == self._backend.PROVIDER_HEALTHY:
+                icon = self.OK_ICON
+            else:
+                icon = self.QUESTION_ICON
+            self.ui.cbProviders.setItemIcon(index, QtGui.QIcon(icon))
+
     def get_domain(self):
         return self._domain
 
@@ -698,6 +718,8 @@ class Wizard(QtGui.QWizard):
         sig.prov_check_ca_fingerprint.connect(self._check_ca_fingerprint)
         sig.prov_check_api_certificate.connect(self._check_api_certificate)
 
+        sig.prov_prefetched.connect(self._providers_prefetched)
+
         sig.srp_registration_finished.connect(self._registration_finished)
         sig.srp_registration_failed.connect(self._registration_failed)
         sig.srp_registration_taken.connect(self._registration_taken)
@@ -720,5 +742,7 @@ class Wizard(QtGui.QWizard):
                 self._check_ca_fingerprint)
             sig.prov_check_api_certificate.disconnect(
                 self._check_api_certificate)
+
+            sig.prov_prefetched.disconnect(self._providers_prefetched)
         except RuntimeError:
             pass  # Signal was not connected
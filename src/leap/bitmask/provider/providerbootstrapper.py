@@ -18,20 +18,23 @@
 Provider bootstrapping
 """
 import logging
-import socket
 import os
 import sys
 
 import requests
 
+from twisted.internet import reactor, threads
+
 from leap.bitmask import provider
 from leap.bitmask import util
 from leap.bitmask.config import flags
 from leap.bitmask.config.providerconfig import ProviderConfig, MissingCACert
 from leap.bitmask.provider import get_provider_path
+from leap.bitmask.provider.verification import VerificationLedger
 from leap.bitmask.services.abstractbootstrapper import AbstractBootstrapper
+from leap.bitmask.util import http_cache
+from leap.bitmask.util import resolver
 from leap.bitmask.util.constants import REQUEST_TIMEOUT
-from leap.bitmask.util.request_helpers import get_content
 from leap.common import ca_bundle
 from leap.common.certs import get_digest
 from leap.common.check import leap_assert, leap_assert_type, leap_check
@@ -71,6 +74,10 @@ class ProviderBootstrapper(AbstractBootstrapper):
 
     MIN_CLIENT_VERSION = 'x-minimum-client-version'
 
+    # seconds to wait before revalidating a CA cert whose checks were
+    # skipped, so it does not compete with the rest of the bootstrap
+    REVALIDATION_DELAY = 60
+
     def __init__(self, signaler=None, bypass_checks=False):
         """
         Constructor for provider bootstrapper object
@@ -88,6 +95,7 @@ class ProviderBootstrapper(AbstractBootstrapper):
         self._domain = None
         self._provider_config = None
         self._download_if_needed = False
+        self._verification = None
 
     @property
     def verify(self):
@@ -120,7 +128,9 @@ class ProviderBootstrapper(AbstractBootstrapper):
         # system to work
         # err --- but we can do it after a failure, to diagnose what went
         # wrong. Right now we're just adding connection overhead. -- kali
-        socket.gethostbyname(self._domain.encode('idna'))
+        # The answer is cached, so this is cheap after the first time.
+        resolver.get_resolver().resolve_blocking(
+            self._domain.encode('idna'))
 
     def _check_https(self, *args):
         """
@@ -169,16 +179,12 @@ class ProviderBootstrapper(AbstractBootstrapper):
         # TODO factor out with the download routines in services.
         # Watch out! We're handling the verify paramenter differently here.
 
-        headers = {}
         domain = self._domain.encode(sys.getfilesystemencoding())
         provider_json = os.path.join(util.get_path_prefix(),
                                      get_provider_path(domain))
 
         mtime = get_mtime(provider_json)
 
-        if self._download_if_needed and mtime:
-            headers['if-modified-since'] = mtime
-
         uri = "https://%s/%s" % (self._domain, "provider.json")
         verify = self.verify
 
@@ -197,35 +203,37 @@ class ProviderBootstrapper(AbstractBootstrapper):
         if verify:
             verify = verify.encode(sys.getfilesystemencoding())
         logger.debug("Requesting for provider.json... "
-                     "uri: {0}, verify: {1}, headers: {2}".format(
-                         uri, verify, headers))
-        res = self._session.get(uri.encode('idna'), verify=verify,
-                                headers=headers, timeout=REQUEST_TIMEOUT)
-        res.raise_for_status()
-        logger.debug("Request status code: {0}".format(res.status_code))
-
-        min_client_version = res.headers.get(self.MIN_CLIENT_VERSION, '0')
+                     "uri: {0}, verify: {1}".format(uri, verify))
+        provider_path = ["leap", "providers", domain, "provider.json"]
+        res = http_cache.fetch(self._session, uri.encode('idna'),
+                               provider_path,
+                               download_if_needed=self._download_if_needed,
+                               verify=verify,
+                               keep_headers=(self.MIN_CLIENT_VERSION,))
+
+        # kept with the cache metadata, so it is checked even when the
+        # definition was not requested
+        min_client_version = res.kept_headers.get(
+            self.MIN_CLIENT_VERSION, '0')
+
+        if flags.APP_VERSION_CHECK:
+            # TODO split
+            if not provider.supports_client(min_client_version):
+                self._signaler.signal(
+                    self._signaler.PROV_UNSUPPORTED_CLIENT)
+                raise UnsupportedClientVersionError()
 
         # Not modified
-        if res.status_code == 304:
+        if not res.modified:
             logger.debug("Provider definition has not been modified")
+            res.commit()
         # --------------------------------------------------------------
         # end refactor, more or less...
         # XXX Watch out, have to check the supported api yet.
         else:
-            if flags.APP_VERSION_CHECK:
-                # TODO split
-                if not provider.supports_client(min_client_version):
-                    self._signaler.signal(
-                        self._signaler.PROV_UNSUPPORTED_CLIENT)
-                    raise UnsupportedClientVersionError()
-
-            provider_definition, mtime = get_content(res)
-
             provider_config = ProviderConfig()
-            provider_config.load(data=provider_definition, mtime=mtime)
-            provider_config.save(["leap", "providers",
-                                  domain, "provider.json"])
+            provider_config.load(data=res.content, mtime=res.mtime)
+            provider_config.save(provider_path)
 
             if flags.API_VERSION_CHECK:
                 # TODO split
@@ -242,6 +250,10 @@ class ProviderBootstrapper(AbstractBootstrapper):
                     self._signaler.signal(self._signaler.PROV_UNSUPPORTED_API)
                     raise UnsupportedProviderAPI(error)
 
+            # only now, so a rejected definition is downloaded and
+            # checked again next time
+            res.commit()
+
     def run_provider_select_checks(self, domain, download_if_needed=False):
         """
         Populates the check queue.
@@ -258,15 +270,19 @@ class ProviderBootstrapper(AbstractBootstrapper):
         self._domain = ProviderConfig.sanitize_path_component(domain)
         self._download_if_needed = download_if_needed
 
-        cb_chain = [
+        # The name resolution and the https check do not depend on each
+        # other, so they run at the same time.
+        cb_graph = [
             (self._check_name_resolution,
-             self._signaler.PROV_NAME_RESOLUTION_KEY),
-            (self._check_https, self._signaler.PROV_HTTPS_CONNECTION_KEY),
+             self._signaler.PROV_NAME_RESOLUTION_KEY, []),
+            (self._check_https,
+             self._signaler.PROV_HTTPS_CONNECTION_KEY, []),
             (self._download_provider_info,
-             self._signaler.PROV_DOWNLOAD_PROVIDER_INFO_KEY)
+             self._signaler.PROV_DOWNLOAD_PROVIDER_INFO_KEY,
+             [self._check_name_resolution, self._check_https])
         ]
 
-        return self.addCallbackChain(cb_chain)
+        return self.addCallbackGraph(cb_graph)
 
     def _should_proceed_cert(self):
         """
@@ -283,6 +299,19 @@ class ProviderBootstrapper(AbstractBootstrapper):
         return not os.path.exists(self._provider_config
                                   .get_ca_cert_path(about_to_download=True))
 
+    def _should_check_cert(self):
+        """
+        Returns False if the certificate already exists for the given
+        provider and it was verified recently. True otherwise
+
+        :rtype: bool
+        """
+        if self._should_proceed_cert():
+            return True
+
+        return not (self._verification is not None and
+                    self._verification.is_verified())
+
     def _download_ca_cert(self, *args):
         """
         Downloads the CA cert that is going to be used for the api URL
@@ -327,10 +356,20 @@ class ProviderBootstrapper(AbstractBootstrapper):
                      (self._domain,
                       self._provider_config.get_ca_cert_path()))
 
-        if not self._should_proceed_cert():
+        if not self._should_check_cert():
             return
 
-        parts = self._provider_config.get_ca_cert_fingerprint().split(":")
+        self._verify_ca_fingerprint(self._provider_config)
+
+    def _verify_ca_fingerprint(self, provider_config):
+        """
+        Checks the CA cert of the given provider against the fingerprint
+        in its definition. Raises WrongFingerprint if it does not match.
+
+        :param provider_config: Provider configuration
+        :type provider_config: ProviderConfig
+        """
+        parts = provider_config.get_ca_cert_fingerprint().split(":")
 
         error_msg = "Wrong fingerprint format"
         leap_check(len(parts) == 2, error_msg, WrongFingerprint)
@@ -338,7 +377,7 @@ class ProviderBootstrapper(AbstractBootstrapper):
         method = parts[0].strip()
         fingerprint = parts[1].strip()
         cert_data = None
-        with open(self._provider_config.get_ca_cert_path()) as f:
+        with open(provider_config.get_ca_cert_path()) as f:
             cert_data = f.read()
 
         leap_assert(len(cert_data) > 0, "Could not read certificate data")
@@ -359,17 +398,78 @@ class ProviderBootstrapper(AbstractBootstrapper):
                      (self._provider_config.get_api_uri(),
                       self._provider_config.get_ca_cert_path()))
 
-        if not self._should_proceed_cert():
+        if not self._should_check_cert():
+            if self._verification is not None:
+                self._schedule_revalidation(self._provider_config,
+                                            self._verification)
             return
 
-        test_uri = "%s/%s/cert" % (self._provider_config.get_api_uri(),
-                                   self._provider_config.get_api_version())
-        ca_cert_path = self._provider_config.get_ca_cert_path()
+        self._verify_api_certificate(self._provider_config)
+
+        # the three checks passed
+        if self._verification is not None:
+            self._verification.record()
+
+    def _verify_api_certificate(self, provider_config):
+        """
+        Makes an API call to the given provider, validating its
+        certificate against the provider CA cert.
+
+        :param provider_config: Provider configuration
+        :type provider_config: ProviderConfig
+        """
+        test_uri = "%s/%s/cert" % (provider_config.get_api_uri(),
+                                   provider_config.get_api_version())
+        ca_cert_path = provider_config.get_ca_cert_path()
         ca_cert_path = ca_cert_path.encode(sys.getfilesystemencoding())
         res = self._session.get(test_uri, verify=ca_cert_path,
                                 timeout=REQUEST_TIMEOUT)
         res.raise_for_status()
 
+    def _schedule_revalidation(self, provider_config, verification):
+        """
+        Checks the CA cert again in the background a while after a
+        bootstrap that skipped the checks.
+
+        :param provider_config: Provider configuration
+        :type provider_config: ProviderConfig
+        :param verification: the record of the checks for the provider.
+        :type verification: VerificationLedger
+        """
+        reactor.callFromThread(reactor.callLater, self.REVALIDATION_DELAY,
+                               threads.deferToThread, self._revalidate,
+                               provider_config, verification)
+
+    def _revalidate(self, provider_config, verification):
+        """
+        Checks the CA cert fingerprint and the API certificate, and
+        updates the record of the checks with the result.
+
+        :param provider_config: Provider configuration
+        :type provider_config: ProviderConfig
+        :param verification: the record of the checks for the provider.
+        :type verification: VerificationLedger
+        """
+        logger.debug("Revalidating the ca cert for %s" %
+                     (provider_config.get_domain(),))
+        try:
+            self._verify_ca_fingerprint(provider_config)
+            self._verify_api_certificate(provider_config)
+        except requests.exceptions.SSLError as e:
+            logger.warning("The api certificate does not validate: %r" %
+                           (e,))
+            verification.clear()
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
+            # we may be offline, leave the record as it is
+            logger.debug("Could not revalidate the ca cert: %r" % (e,))
+        except Exception as e:
+            logger.warning("The ca cert could not be revalidated: %r" %
+                           (e,))
+            verification.clear()
+        else:
+            verification.record()
+
     def run_provider_setup_checks(self,
                                   provider_config,
                                   download_if_needed=False):
@@ -388,6 +488,7 @@ class ProviderBootstrapper(AbstractBootstrapper):
 
         self._provider_config = provider_config
         self._download_if_needed = download_if_needed
+        self._verification = VerificationLedger(provider_config)
 
         cb_chain = [
             (self._download_ca_cert, self._signaler.PROV_DOWNLOAD_CA_CERT_KEY),
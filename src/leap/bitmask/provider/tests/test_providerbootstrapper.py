@@ -42,8 +42,11 @@ from leap.bitmask.backend import Signaler
 from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.crypto.tests import fake_provider
 from leap.bitmask.provider.providerbootstrapper import ProviderBootstrapper
+from leap.bitmask.provider.providerbootstrapper import \
+    UnsupportedClientVersionError
 from leap.bitmask.provider.providerbootstrapper import UnsupportedProviderAPI
 from leap.bitmask.provider.providerbootstrapper import WrongFingerprint
+from leap.bitmask.util import http_cache
 from leap.common.files import mkdir_p
 from leap.common.testing.basetest import BaseLeapTest
 from leap.common.testing.https_server import where
@@ -78,8 +81,8 @@ class ProviderBootstrapperTest(BaseLeapTest):
 
         def check(*args):
             self.pb._check_name_resolution.assert_called_once_with()
-            self.pb._check_https.assert_called_once_with(None)
-            self.pb._download_provider_info.assert_called_once_with(None)
+            self.pb._check_https.assert_called_once_with()
+            self.pb._download_provider_info.assert_called_once_with()
         d.addCallback(check)
         return d
 
@@ -113,6 +116,30 @@ class ProviderBootstrapperTest(BaseLeapTest):
             return_value=where("somefilethatdoesntexist.pem"))
         self.assertTrue(self.pb._should_proceed_cert())
 
+    def test_should_check_cert(self):
+        self.pb._provider_config = mock.Mock()
+        self.pb._provider_config.get_ca_cert_path = mock.MagicMock(
+            return_value=where("cacert.pem"))
+
+        self.pb._download_if_needed = False
+        self.assertTrue(self.pb._should_check_cert())
+
+        self.pb._download_if_needed = True
+        # not verified yet, the certificate on disk is checked
+        self.assertTrue(self.pb._should_check_cert())
+
+        self.pb._verification = mock.Mock()
+        self.pb._verification.is_verified.return_value = True
+        self.assertFalse(self.pb._should_check_cert())
+
+        self.pb._verification.is_verified.return_value = False
+        self.assertTrue(self.pb._should_check_cert())
+
+        self.pb._verification.is_verified.return_value = True
+        self.pb._provider_config.get_ca_cert_path = mock.MagicMock(
+            return_value=where("somefilethatdoesntexist.pem"))
+        self.assertTrue(self.pb._should_check_cert())
+
     def _check_download_ca_cert(self, should_proceed):
         """
         Helper to check different paths easily for the download ca
@@ -183,7 +210,7 @@ class ProviderBootstrapperTest(BaseLeapTest):
             return_value="")
         self.pb._domain = "somedomain"
 
-        self.pb._should_proceed_cert = mock.MagicMock(return_value=False)
+        self.pb._should_check_cert = mock.MagicMock(return_value=False)
 
         self.pb._check_ca_fingerprint()
         self.assertFalse(self.pb._provider_config.
@@ -195,7 +222,7 @@ class ProviderBootstrapperTest(BaseLeapTest):
             return_value="wrongfprformat!!")
         self.pb._domain = "somedomain"
 
-        self.pb._should_proceed_cert = mock.MagicMock(return_value=True)
+        self.pb._should_check_cert = mock.MagicMock(return_value=True)
 
         with self.assertRaises(WrongFingerprint):
             self.pb._check_ca_fingerprint()
@@ -268,7 +295,7 @@ yV8e
 
         self._prepare_provider_config_with(cert_path, self.KNOWN_GOOD_HASH)
 
-        self.pb._should_proceed_cert = mock.MagicMock(return_value=True)
+        self.pb._should_check_cert = mock.MagicMock(return_value=True)
 
         self.pb._check_ca_fingerprint()
 
@@ -283,7 +310,7 @@ yV8e
 
         self._prepare_provider_config_with(cert_path, self.KNOWN_BAD_HASH)
 
-        self.pb._should_proceed_cert = mock.MagicMock(return_value=True)
+        self.pb._should_check_cert = mock.MagicMock(return_value=True)
 
         with self.assertRaises(WrongFingerprint):
             self.pb._check_ca_fingerprint()
@@ -496,6 +523,25 @@ class ProviderBootstrapperActiveTest(unittest.TestCase):
 
         self.pb._download_provider_info()
 
+    @mock.patch('leap.bitmask.provider.supports_client',
+                lambda version: False)
+    def test_download_provider_info_unsupported_client_not_cached(self):
+        path_prefix = tempfile.mkdtemp()
+        self._setup_provider_config_with("1", path_prefix)
+        self._setup_providerbootstrapper(False)
+        self.pb._signaler = mock.Mock()
+
+        with self.assertRaises(UnsupportedClientVersionError):
+            self.pb._download_provider_info()
+        self.assertFalse(ProviderConfig.save.called)
+
+        # the cache headers of the rejected definition are not kept, so
+        # it is downloaded and checked again next time
+        provider_path = os.path.join(
+            path_prefix, "leap", "providers", self.pb._domain,
+            "provider.json")
+        self.assertEqual(http_cache._load_metadata(provider_path), {})
+
     @mock.patch(
         'leap.bitmask.config.providerconfig.ProviderConfig.get_api_uri',
         lambda x: 'api.uri')
@@ -506,7 +552,7 @@ class ProviderBootstrapperActiveTest(unittest.TestCase):
         self.pb._provider_config = ProviderConfig()
         self.pb._session.get = mock.MagicMock(return_value=Response())
 
-        self.pb._should_proceed_cert = mock.MagicMock(return_value=False)
+        self.pb._should_check_cert = mock.MagicMock(return_value=False)
         self.pb._check_api_certificate()
         self.assertFalse(self.pb._session.get.called)
 
@@ -522,7 +568,7 @@ class ProviderBootstrapperActiveTest(unittest.TestCase):
         self.pb._provider_config.get_api_version = mock.MagicMock(
             return_value="1")
 
-        self.pb._should_proceed_cert = mock.MagicMock(return_value=True)
+        self.pb._should_check_cert = mock.MagicMock(return_value=True)
 
         def check(*args):
             with self.assertRaises(requests.exceptions.SSLError):
@@ -540,7 +586,7 @@ class ProviderBootstrapperActiveTest(unittest.TestCase):
         self.pb._provider_config.get_api_version = mock.MagicMock(
             return_value="1")
 
-        self.pb._should_proceed_cert = mock.MagicMock(return_value=True)
+        self.pb._should_check_cert = mock.MagicMock(return_value=True)
 
         def check(*args):
             self.pb._check_api_certificate()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# test_verification.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the record of the CA certificate checks
+"""
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from leap.bitmask import util
+from leap.bitmask.provider.verification import VerificationLedger
+
+
+class VerificationLedgerTest(unittest.TestCase):
+    """
+    Tests for the VerificationLedger class
+    """
+
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        self.old_get_path_prefix = util.get_path_prefix
+        util.get_path_prefix = lambda: self.prefix
+
+        self.cert_path = os.path.join(self.prefix, "cacert.pem")
+        with open(self.cert_path, "w") as f:
+            f.write("CERT")
+
+        self.provider_config = mock.Mock()
+        self.provider_config.get_domain.return_value = "example.org"
+        self.provider_config.get_ca_cert_path.return_value = self.cert_path
+        self.provider_config.get_ca_cert_fingerprint.return_value = \
+            "SHA256: 1234"
+        self.provider_config.get_api_uri.return_value = \
+            "https://api.example.org:4430"
+        self.ledger = VerificationLedger(self.provider_config)
+
+    def tearDown(self):
+        util.get_path_prefix = self.old_get_path_prefix
+        shutil.rmtree(self.prefix)
+
+    def test_not_verified(self):
+        self.assertFalse(self.ledger.is_verified())
+
+    def test_verified(self):
+        self.ledger.record()
+        self.assertTrue(self.ledger.is_verified())
+        self.assertTrue(VerificationLedger(self.provider_config)
+                        .is_verified())
+
+    def test_cert_changed(self):
+        self.ledger.record()
+        with open(self.cert_path, "a") as f:
+            f.write("MORE")
+        self.assertFalse(self.ledger.is_verified())
+
+    def test_cert_replaced_keeping_size_and_mtime(self):
+        self.ledger.record()
+        st = os.stat(self.cert_path)
+        with open(self.cert_path) as f:
+            data = f.read()
+        with open(self.cert_path, "w") as f:
+            f.write("X" * len(data))
+        os.utime(self.cert_path, (st.st_atime, st.st_mtime))
+        self.assertFalse(self.ledger.is_verified())
+
+    def test_cert_removed(self):
+        self.ledger.record()
+        os.remove(self.cert_path)
+        self.assertFalse(self.ledger.is_verified())
+
+    def test_fingerprint_changed(self):
+        self.ledger.record()
+        self.provider_config.get_ca_cert_fingerprint.return_value = \
+            "SHA256: 5678"
+        self.assertFalse(self.ledger.is_verified())
+
+    def test_too_old(self):
+        now = time.time()
+        with mock.patch("time.time",
+                        lambda: now - VerificationLedger.MAX_AGE):
+            self.ledger.record()
+        self.assertFalse(self.ledger.is_verified())
+
+    def test_clear(self):
+        self.ledger.record()
+        self.ledger.clear()
+        self.assertFalse(self.ledger.is_verified())
+        # nothing to clear
+        self.ledger.clear()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
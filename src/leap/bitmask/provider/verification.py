@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# verification.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Record of the provider CA certificate checks.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+from leap.bitmask import util
+from leap.common.files import mkdir_p
+
+logger = logging.getLogger(__name__)
+
+
+class VerificationLedger(object):
+    """
+    Remembers that the CA certificate of a provider matched the
+    fingerprint in its definition and validated its API certificate, so
+    the checks can be skipped while nothing changes.
+
+    The record is kept in leap/providers/<domain>/verification.json.
+    """
+
+    FILENAME = "verification.json"
+
+    # after this many seconds the checks are done again, even if
+    # nothing changed
+    MAX_AGE = 7 * 24 * 60 * 60
+
+    FINGERPRINT_KEY = "ca_cert_fingerprint"
+    CA_CERT_DIGEST_KEY = "ca_cert_sha256"
+    API_URI_KEY = "api_uri"
+    VERIFIED_KEY = "verified"
+
+    def __init__(self, provider_config):
+        """
+        Constructor for VerificationLedger
+
+        :param provider_config: the loaded config of the provider.
+        :type provider_config: ProviderConfig
+        """
+        self._provider_config = provider_config
+
+    def _get_path(self):
+        """
+        Returns the path to the record for the provider.
+
+        :rtype: str
+        """
+        return os.path.join(util.get_path_prefix(), "leap", "providers",
+                            self._provider_config.get_domain(),
+                            self.FILENAME)
+
+    def _get_current(self):
+        """
+        Returns what the record must hold to still be valid, or None if
+        there is no CA certificate.
+
+        :rtype: dict or None
+        """
+        ca_cert_path = self._provider_config.get_ca_cert_path(
+            about_to_download=True)
+        try:
+            with open(ca_cert_path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        except IOError:
+            return None
+        return {
+            self.FINGERPRINT_KEY:
+            self._provider_config.get_ca_cert_fingerprint(),
+            self.CA_CERT_DIGEST_KEY: digest,
+            self.API_URI_KEY: self._provider_config.get_api_uri(),
+        }
+
+    def is_verified(self):
+        """
+        Returns True if the CA certificate was checked recently and
+        neither the certificate nor the provider definition changed
+        since then.
+
+        :rtype: bool
+        """
+        try:
+            with open(self._get_path()) as f:
+                record = json.load(f)
+        except (IOError, ValueError):
+            return False
+        if not isinstance(record, dict):
+            return False
+
+        current = self._get_current()
+        if current is None:
+            return False
+        for key, value in current.items():
+            if record.get(key) != value:
+                return False
+
+        age = time.time() - record.get(self.VERIFIED_KEY, 0)
+        return 0 <= age < self.MAX_AGE
+
+    def record(self):
+        """
+        Records that the CA certificate has just been checked.
+        """
+        current = self._get_current()
+        if current is None:
+            return
+        current[self.VERIFIED_KEY] = time.time()
+
+        path = self._get_path()
+        mkdir_p(os.path.dirname(path))
+        try:
+            with open(path, "w") as f:
+                json.dump(current, f)
+        except IOError as e:
+            logger.warning("Could not save the verification record: %r"
+                           % (e,))
+
+    def clear(self):
+        """
+        Forgets the checks, so they are done again next time.
+        """
+        try:
+            os.remove(self._get_path())
+        except OSError:
+            pass
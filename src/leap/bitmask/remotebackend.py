@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+# remotebackend.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Backend running in its own process.
+
+The backend daemon listens on a local unix socket. The frontend talks to
+it through a BackendProxy, that has the same interface as the Backend
+class, so the networking and crypto work does not compete with the GUI.
+
+Every message is a json encoded list, framed with a 32 bit length
+prefix:
+
+    ["call", method, [args...]]                   frontend -> backend
+    ["signals", null, [[key, data], ...]]         backend -> frontend
+
+The signals are coalesced and sent in batches, once per frame, see
+leap.bitmask.signaler.SignalCoalescer.
+
+The wire protocol does not need Qt. The Backend and the Qt Signaler are
+only imported when the daemon is started and when a proxy is created
+without a signaler.
+
+The main window spawns the daemon with BackendProxy.spawn, it can also
+be run by hand with:
+
+    python -m leap.bitmask.remotebackend [--socket <path>]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from twisted.internet import reactor, task
+from twisted.internet.endpoints import UNIXClientEndpoint
+from twisted.internet.endpoints import UNIXServerEndpoint
+from twisted.internet.error import ConnectError, ProcessExitedAlready
+from twisted.internet.protocol import ClientFactory, Factory
+from twisted.internet.protocol import ProcessProtocol
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.python import log
+
+from leap.bitmask.signaler import SignalCoalescer, SignalerKeys
+from leap.bitmask.util import get_path_prefix
+from leap.common.files import mkdir_p
+
+logger = logging.getLogger(__name__)
+
+CALL = "call"
+SIGNALS = "signals"
+
+
+def get_socket_path():
+    """
+    Returns the default path of the backend socket.
+
+    Only one instance of the app runs at a time, so a fixed path in the
+    config dir is enough.
+
+    :rtype: str
+    """
+    return os.path.join(get_path_prefix(), "leap", "backend.sock")
+
+
+class BackendRPCProtocol(Int32StringReceiver):
+    """
+    Length prefixed json messages, common to both ends of the connection.
+    """
+
+    # bootstrapping data is small, anything bigger is garbage.
+    MAX_LENGTH = 1024 * 1024
+
+    def sendMessage(self, *message):
+        """
+        Serializes and sends a message.
+
+        :param message: the items of the message.
+        :type message: tuple
+        """
+        # the data of some signals carry exceptions, that we send
+        # as text.
+        self.sendString(json.dumps(message, default=str))
+
+    def stringReceived(self, string):
+        """
+        Deserializes a message and hands it to messageReceived.
+
+        :param string: the payload of the frame.
+        :type string: str
+        """
+        try:
+            message = json.loads(string)
+            kind, name, data = message
+        except (ValueError, TypeError):
+            logger.warning("Bad backend message: %r" % (string,))
+            return
+        self.messageReceived(kind, name, data)
+
+    def lengthLimitExceeded(self, length):
+        logger.warning("Backend message too long (%d bytes), dropping the "
+                       "connection." % (length,))
+        self.transport.loseConnection()
+
+    def messageReceived(self, kind, name, data):
+        """
+        Handles a message, subclasses must implement it.
+
+        :param kind: CALL or SIGNAL
+        :type kind: unicode
+        :param name: the method name or the signal key.
+        :type name: unicode
+        :param data: the call arguments or the signal data.
+        """
+        raise NotImplementedError()
+
+
+class RemoteSignaler(SignalerKeys):
+    """
+    Signaler that sends the signals to the connected frontends, instead
+    of emitting Qt signals.
+    """
+
+    def __init__(self, reactor=reactor):
+        """
+        :param reactor: the reactor used to schedule the batches.
+        :type reactor: twisted.internet.reactor
+        """
+        self._clients = set()
+        self._coalescer = SignalCoalescer(self._send, reactor=reactor)
+
+    def add_client(self, client):
+        """
+        :param client: the connected frontend.
+        :type client: BackendServerProtocol
+        """
+        self._clients.add(client)
+
+    def remove_client(self, client):
+        """
+        :param client: the disconnected frontend.
+        :type client: BackendServerProtocol
+        """
+        self._clients.discard(client)
+
+    def signal(self, key, data=None):
+        """
+        Sends a signal to the frontends. Can be called from any thread.
+
+        :param key: string identifying the signal to emit
+        :type key: str
+        :param data: object to send with the data, it must be json
+                     serializable.
+        :type data: object
+        """
+        self._coalescer.signal(key, data)
+
+    def get_rates(self):
+        """
+        Returns the signaled and sent rates per signal key.
+
+        :rtype: dict
+        """
+        return self._coalescer.get_rates()
+
+    def _send(self, batch):
+        """
+        Sends a batch of coalesced signals to the frontends.
+
+        :param batch: list of (key, data) tuples.
+        :type batch: list
+        """
+        log.msg("Signaling %s" % (batch,))
+        for client in list(self._clients):
+            client.sendMessage(SIGNALS, None, batch)
+
+
+class BackendServerProtocol(BackendRPCProtocol):
+    """
+    Backend side of the connection, calls the backend methods for the
+    messages received.
+    """
+
+    def connectionMade(self):
+        self.factory.signaler.add_client(self)
+
+    def connectionLost(self, reason):
+        self.factory.signaler.remove_client(self)
+
+    def messageReceived(self, kind, name, data):
+        if kind != CALL or name not in self.factory.METHODS:
+            logger.warning("Unknown backend call: %r %r" % (kind, name))
+            return
+        if not isinstance(data, list):
+            logger.warning("Bad arguments for %r: %r" % (name, data))
+            return
+        getattr(self.factory.backend, name)(*data)
+
+
+class BackendServerFactory(Factory):
+    """
+    Factory for the connections from the frontends.
+    """
+
+    protocol = BackendServerProtocol
+
+    # the backend methods the frontends can call
+    METHODS = (
+        "setup_provider",
+        "cancel_setup_provider",
+        "provider_bootstrap",
+        "prefetch_providers",
+        "register_user",
+    )
+
+    def __init__(self, backend, signaler):
+        """
+        :param backend: the backend that runs the calls.
+        :type backend: Backend
+        :param signaler: the signaler the backend uses.
+        :type signaler: RemoteSignaler
+        """
+        self.backend = backend
+        self.signaler = signaler
+
+
+class BackendClientProtocol(BackendRPCProtocol):
+    """
+    Frontend side of the connection, emits the signals received.
+    """
+
+    def messageReceived(self, kind, name, data):
+        if kind != SIGNALS:
+            logger.warning("Unexpected backend message: %r %r" %
+                           (kind, name))
+            return
+        # already coalesced by the backend
+        self.factory.signaler.emit_batch(
+            [(str(key), value) for key, value in data])
+
+    def connectionLost(self, reason):
+        logger.warning("Lost the connection to the backend: %r" %
+                       (reason.value,))
+
+
+class BackendClientFactory(ClientFactory):
+    """
+    Factory for the connection to the backend.
+    """
+
+    protocol = BackendClientProtocol
+
+    def __init__(self, signaler):
+        """
+        :param signaler: the signaler that emits the backend signals.
+        :type signaler: Signaler
+        """
+        self.signaler = signaler
+
+
+class BackendProcessProtocol(ProcessProtocol):
+    """
+    Logs the exit of a spawned backend daemon.
+    """
+
+    def processEnded(self, reason):
+        logger.debug("The backend daemon exited: %r" % (reason.value,))
+
+
+class BackendProxy(object):
+    """
+    Frontend for a backend daemon, with the same interface as Backend.
+
+    Calls done before the connection is made are queued and sent once
+    we are connected.
+    """
+
+    PASSED_KEY = "passed"
+    ERROR_KEY = "error"
+
+    # status of the providers checked in the background, as
+    # leap.bitmask.backend.ProviderPrefetch reports them
+    PROVIDER_HEALTHY = "healthy"
+    PROVIDER_STALE = "stale"
+
+    # a spawned daemon takes a moment to listen on its socket
+    CONNECT_ATTEMPTS = 50
+    CONNECT_DELAY = 0.2  # seconds
+
+    def __init__(self, socket_path, signaler=None, endpoint=None,
+                 reactor=reactor):
+        """
+        :param socket_path: the path of the backend socket.
+        :type socket_path: str
+        :param signaler: the signaler that emits the backend signals, a
+                         new one is created if None.
+        :type signaler: Signaler
+        :param endpoint: the endpoint to connect to, defaults to the unix
+                         socket.
+        :type endpoint: twisted.internet.interfaces.IStreamClientEndpoint
+        :param reactor: the reactor used to spawn the daemon and to
+                        retry the connection.
+        :type reactor: twisted.internet.reactor
+        """
+        if signaler is None:
+            # the frontend has Qt
+            from leap.bitmask.backend import Signaler
+            signaler = Signaler()
+        if endpoint is None:
+            endpoint = UNIXClientEndpoint(reactor, socket_path)
+
+        self._socket_path = socket_path
+        self._signaler = signaler
+        self._endpoint = endpoint
+        self._reactor = reactor
+        self._process = None
+        self._protocol = None
+        self._pending = []
+        self._stopped = False
+
+    @property
+    def signaler(self):
+        """
+        Public signaler access to let the UI connect to its signals.
+        """
+        return self._signaler
+
+    def spawn(self, bypass_checks=False):
+        """
+        Starts a backend daemon that listens on our socket. It is
+        terminated by stop.
+
+        :param bypass_checks: Set to true if the app should bypass
+                              first round of checks for CA
+                              certificates at bootstrap
+        :type bypass_checks: bool
+        """
+        args = [sys.executable, "-m", "leap.bitmask.remotebackend",
+                "--socket", self._socket_path]
+        if bypass_checks:
+            args.append("--danger")
+        # the daemon logs to the same output as we do
+        self._process = self._reactor.spawnProcess(
+            BackendProcessProtocol(), sys.executable, args,
+            env=os.environ, childFDs={0: "w", 1: 1, 2: 2})
+
+    def start(self):
+        """
+        Connects to the backend, retrying while a spawned daemon is not
+        listening yet.
+
+        :rtype: twisted.internet.defer.Deferred
+        """
+        return self._connect(self.CONNECT_ATTEMPTS)
+
+    def stop(self):
+        """
+        Disconnects from the backend, and terminates the daemon if we
+        spawned it.
+        """
+        self._stopped = True
+        if self._protocol is not None:
+            self._protocol.transport.loseConnection()
+            self._protocol = None
+        self._pending = []
+        if self._process is not None:
+            try:
+                self._process.signalProcess("TERM")
+            except ProcessExitedAlready:
+                pass
+            self._process = None
+
+    def _connect(self, attempts):
+        """
+        Tries to connect to the backend.
+
+        :param attempts: how many times we can still try.
+        :type attempts: int
+
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if self._stopped:
+            return None
+        d = self._endpoint.connect(BackendClientFactory(self._signaler))
+        d.addCallbacks(self._connected, self._connect_err,
+                       errbackArgs=(attempts,))
+        return d
+
+    def _connected(self, protocol):
+        """
+        Callback for the connection, sends the queued calls.
+
+        :param protocol: the connected protocol.
+        :type protocol: BackendClientProtocol
+        """
+        if self._stopped:
+            protocol.transport.loseConnection()
+            return
+        self._protocol = protocol
+        pending, self._pending = self._pending, []
+        for method, args in pending:
+            protocol.sendMessage(CALL, method, args)
+
+    def _connect_err(self, failure, attempts):
+        """
+        Errback for the connection, tries again if the socket is not
+        ready yet.
+
+        :param failure: the failure that triggered the errback.
+        :type failure: twisted.python.failure.Failure
+        :param attempts: how many times we could still try.
+        :type attempts: int
+        """
+        if failure.check(ConnectError) and attempts > 1 and \
+                not self._stopped:
+            return task.deferLater(self._reactor, self.CONNECT_DELAY,
+                                   self._connect, attempts - 1)
+        logger.error("Could not connect to the backend: %r" %
+                     (failure.value,))
+
+    def _call(self, method, *args):
+        """
+        Sends a call to the backend, or queues it until we are connected.
+
+        :param method: the name of the backend method.
+        :type method: str
+        :param args: the method arguments.
+        :type args: tuple
+        """
+        if self._protocol is None:
+            self._pending.append((method, args))
+        else:
+            self._protocol.sendMessage(CALL, method, args)
+
+    def setup_provider(self, provider):
+        self._call("setup_provider", provider)
+
+    def cancel_setup_provider(self):
+        self._call("cancel_setup_provider")
+
+    def provider_bootstrap(self, provider):
+        self._call("provider_bootstrap", provider)
+
+    def prefetch_providers(self, providers):
+        self._call("prefetch_providers", list(providers))
+
+    def register_user(self, provider, username, password):
+        self._call("register_user", provider, username, password)
+
+
+def listen(socket_path, bypass_checks=False):
+    """
+    Starts a backend listening on the given unix socket.
+
+    :param socket_path: the path of the socket.
+    :type socket_path: str
+    :param bypass_checks: Set to true if the app should bypass
+                          first round of checks for CA
+                          certificates at bootstrap
+    :type bypass_checks: bool
+
+    :returns: a deferred that fires with the listening port.
+    :rtype: twisted.internet.defer.Deferred
+    """
+    # XXX the bootstrappers are still QObjects, so this pulls in Qt
+    from leap.bitmask.backend import Backend
+
+    signaler = RemoteSignaler()
+    backend = Backend(bypass_checks, signaler=signaler)
+    backend.start()
+    reactor.addSystemEventTrigger('before', 'shutdown', backend.stop)
+
+    if os.path.exists(socket_path):
+        # left behind by a previous run
+        os.unlink(socket_path)
+    mkdir_p(os.path.dirname(socket_path))
+    endpoint = UNIXServerEndpoint(reactor, socket_path, mode=0600)
+    return endpoint.listen(BackendServerFactory(backend, signaler))
+
+
+def main():
+    """
+    Entry point for the backend daemon.
+    """
+    parser = argparse.ArgumentParser(description="Bitmask backend daemon.")
+    parser.add_argument('--socket', default=get_socket_path(),
+                        help='path of the unix socket to listen on.')
+    parser.add_argument('--danger', action="store_true",
+                        help='bypass the certificate checks for bootstrap.')
+    opts = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+    d = listen(opts.socket, bypass_checks=opts.danger)
+    d.addErrback(log.err)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
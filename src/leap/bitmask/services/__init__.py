@@ -18,21 +18,20 @@
 Services module.
 """
 import logging
-import os
 import sys
 
+import requests
+
 from PySide import QtCore
 
 from leap.bitmask.config import flags
+from leap.bitmask.crypto import authsession
 from leap.bitmask.crypto.srpauth import SRPAuth
-from leap.bitmask.util.constants import REQUEST_TIMEOUT
+from leap.bitmask.util import http_cache
 from leap.bitmask.util.privilege_policies import is_missing_policy_permissions
-from leap.bitmask.util.request_helpers import get_content
-from leap.bitmask import util
 
 from leap.common.check import leap_assert
 from leap.common.config.baseconfig import BaseConfig
-from leap.common.files import get_mtime
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +40,12 @@ EIP_SERVICE = u"openvpn"
 MX_SERVICE = u"mx"
 DEPLOYED = [EIP_SERVICE, MX_SERVICE]
 
+# path -> (api version, content, config checker) of the last service
+# definition loaded. The checker is only read once loaded, so an
+# unchanged definition shares it instead of being parsed and validated
+# again on each bootstrap.
+_loaded_configs = {}
+
 
 def get_service_display_name(service):
     """
@@ -107,15 +112,6 @@ def download_service_config(provider_config, service_config,
     """
     service_name = service_config.name
     service_json = "{0}-service.json".format(service_name)
-    headers = {}
-    mtime = get_mtime(os.path.join(util.get_path_prefix(),
-                                   "leap", "providers",
-                                   provider_config.get_domain(),
-                                   service_json))
-
-    if download_if_needed and mtime:
-        headers['if-modified-since'] = mtime
-
     api_version = provider_config.get_api_version()
 
     config_uri = "%s/%s/config/%s-service.json" % (
@@ -126,43 +122,61 @@ def download_service_config(provider_config, service_config,
         service_name.upper(),
         config_uri))
 
-    # XXX make and use @with_srp_auth decorator
-    srp_auth = SRPAuth(provider_config)
-    session_id = srp_auth.get_session_id()
-    token = srp_auth.get_token()
-    cookies = None
-    if session_id is not None:
-        cookies = {"_session_id": session_id}
-
-    # API v2 will only support token auth, but in v1 we can send both
-    if token is not None:
-        headers["Authorization"] = 'Token token="{0}"'.format(token)
-
     verify = provider_config.get_ca_cert_path()
     if verify:
         verify = verify.encode(sys.getfilesystemencoding())
 
-    res = session.get(config_uri,
-                      verify=verify,
-                      headers=headers,
-                      timeout=REQUEST_TIMEOUT,
-                      cookies=cookies)
-    res.raise_for_status()
+    service_path = ("leap", "providers", provider_config.get_domain(),
+                    service_json)
+
+    def fetch():
+        # XXX make and use @with_srp_auth decorator
+        credentials = SRPAuth(provider_config).get_credentials()
+        headers = {}
+        cookies = None
+        if credentials.session_id is not None:
+            cookies = {"_session_id": credentials.session_id}
+
+        # API v2 will only support token auth, but in v1 we can send both
+        if credentials.token is not None:
+            headers["Authorization"] = 'Token token="{0}"'.format(
+                credentials.token)
+
+        return http_cache.fetch(session, config_uri, service_path,
+                                download_if_needed=download_if_needed,
+                                verify=verify,
+                                headers=headers,
+                                cookies=cookies)
+
+    try:
+        res = fetch()
+    except requests.exceptions.HTTPError as e:
+        # the token expired, try once more with a new one
+        if e.response is None or e.response.status_code != 401 or \
+                authsession.refresh_token() is None:
+            raise
+        logger.debug("Retrying the download with a refreshed token")
+        res = fetch()
 
     service_config.set_api_version(api_version)
+    loaded = _loaded_configs.get(service_path)
+    if not res.modified and loaded is not None and \
+            loaded[:2] == (api_version, res.content):
+        service_config._config_checker = loaded[2]
+    else:
+        service_config.load(data=res.content, mtime=res.mtime)
+        if service_config.loaded():
+            _loaded_configs[service_path] = (
+                api_version, res.content, service_config._config_checker)
 
     # Not modified
-    service_path = ("leap", "providers", provider_config.get_domain(),
-                    service_json)
-    if res.status_code == 304:
+    if not res.modified:
         logger.debug(
             "{0} definition has not been modified".format(
                 service_name.upper()))
-        service_config.load(os.path.join(*service_path))
     else:
-        service_definition, mtime = get_content(res)
-        service_config.load(data=service_definition, mtime=mtime)
         service_config.save(service_path)
+    res.commit()
 
 
 class ServiceConfig(BaseConfig):
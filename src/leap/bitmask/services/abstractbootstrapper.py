@@ -20,16 +20,15 @@ Abstract bootstrapper implementation
 """
 import logging
 
-import requests
-
 from functools import partial
 
 from PySide import QtCore
 
 from twisted.python import log
-from twisted.internet import threads
+from twisted.internet import defer, threads
 from twisted.internet.defer import CancelledError
 
+from leap.bitmask.util import http_client
 from leap.common.check import leap_assert, leap_assert_type
 
 logger = logging.getLogger(__name__)
@@ -70,7 +69,7 @@ class AbstractBootstrapper(QtCore.QObject):
         # **************************************************** #
         # Dependency injection helpers, override this for more
         # granular testing
-        self._fetcher = requests
+        self._fetcher = http_client
         # **************************************************** #
 
         self._session = self._fetcher.session()
@@ -191,3 +190,98 @@ class AbstractBootstrapper(QtCore.QObject):
             d.addCallback(self._gui_notify, signal=sig)
         d.addErrback(self._gui_errback)
         return d
+
+    def addCallbackGraph(self, steps):
+        """
+        Runs the steps in threads, as soon as the steps they depend on are
+        done, so independent steps run concurrently.
+
+        The signals are emitted in the order the steps are listed, as
+        addCallbackChain does: a step is not notified before the ones
+        listed above it, and nothing is notified after the first
+        failure. The steps are called without arguments.
+
+        :param steps: List of tuples of callbacks, the signal associated
+                      to that callback and the list of callbacks it
+                      depends on, that must be listed before it.
+        :type steps: list(tuple(func, func, list(func)))
+
+        :returns: the defer that fires once all the steps are notified
+        :rtype: deferred
+        """
+        leap_assert_type(steps, list)
+
+        self._signal_to_emit = None
+        self._err_msg = None
+
+        running = {}
+        notify = []
+        for cb, sig, requires in steps:
+            leap_assert(all(req in running for req in requires),
+                        "Steps must be listed after their dependencies")
+            if requires:
+                d = defer.DeferredList([running[req] for req in requires])
+                d.addCallback(self._check_requirements)
+                d.addCallback(self._thread_step, cb)
+            else:
+                d = threads.deferToThread(cb)
+            running[cb] = d
+            notify.append((defer.DeferredList([d]), sig))
+
+        for d in running.values():
+            # the failures are handled through the DeferredLists above
+            d.addErrback(lambda _: None)
+
+        d = defer.succeed(None)
+        for done, sig in notify:
+            d.addCallback(self._wait_for_step, done)
+            d.addErrback(self._errback, signal=sig)
+            d.addCallback(self._gui_notify, signal=sig)
+        d.addErrback(self._cancel_steps, running.values())
+        d.addErrback(self._gui_errback)
+        return d
+
+    def _check_requirements(self, results):
+        """
+        Callback for the steps a step depends on.
+
+        :param results: the results of a DeferredList.
+        :type results: list(tuple(bool, object))
+
+        :returns: the first failure, if any.
+        """
+        for succeeded, result in results:
+            if not succeeded:
+                return result
+
+    def _thread_step(self, _, cb):
+        return threads.deferToThread(cb)
+
+    def _wait_for_step(self, _, done):
+        """
+        Waits for a step of the graph to finish.
+
+        :param done: a DeferredList with the defer of the step.
+        :type done: deferred
+
+        :returns: the result of the step, or its failure.
+        :rtype: deferred
+        """
+        return done.addCallback(lambda results: results[0][1])
+
+    def _cancel_steps(self, failure, steps):
+        """
+        Cancels the steps still running when the graph is cancelled.
+
+        :param failure: failure object that Twisted generates
+        :type failure: twisted.python.failure.Failure
+        :param steps: the defers of the steps.
+        :type steps: list(deferred)
+
+        :returns: the failure, to keep handling it.
+        :rtype: twisted.python.failure.Failure
+        """
+        if failure.check(CancelledError):
+            for d in steps:
+                d.cancel()
+        return failure
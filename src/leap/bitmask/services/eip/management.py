@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+# management.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Non-blocking client for the openvpn management interface.
+
+Instead of polling openvpn with `state` and `status` commands, we subscribe
+to the real-time notifications (`state on`, `bytecount N`) and parse the
+pushed `>STATE:` and `>BYTECOUNT:` lines as they arrive.
+
+Commands can be pipelined: openvpn answers them in order, so we keep a FIFO
+of pending commands and fire the Deferred of the oldest one each time a
+response (terminated by END, or a single SUCCESS:/ERROR: line) is complete.
+
+The connection itself is handled by ManagementConnector, that retries with
+a jittered exponential backoff until the management socket is ready.
+"""
+import logging
+import random
+
+from collections import deque
+
+from twisted.internet import defer
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.internet.endpoints import UNIXClientEndpoint
+from twisted.internet.protocol import ClientFactory
+from twisted.protocols.basic import LineReceiver
+
+logger = logging.getLogger(__name__)
+
+
+class ManagementCommandError(Exception):
+    """
+    Raised when the management interface answers a command with ERROR:
+    """
+    pass
+
+
+class ManagementProtocol(LineReceiver):
+    """
+    Line based protocol that speaks to the openvpn management interface.
+
+    The manager passed on initialization gets notified about the events
+    read from the socket. It is expected to implement:
+
+      * management_state_received(state_line)
+      * management_bytecount_received(bytes_in, bytes_out)
+      * management_connection_lost(protocol, reason)
+    """
+
+    # openvpn terminates its lines with \r\n, we strip the \r ourselves
+    # so we can also talk to implementations that only send \n.
+    delimiter = '\n'
+
+    NOTIFICATION_PREFIX = '>'
+    STATE_PREFIX = '>STATE:'
+    BYTECOUNT_PREFIX = '>BYTECOUNT:'
+
+    END = 'END'
+    SUCCESS = 'SUCCESS:'
+    ERROR = 'ERROR:'
+
+    def __init__(self, manager, bytecount_interval=1):
+        """
+        :param manager: the object that will be notified of the parsed
+                        events.
+        :type manager: VPNManager
+        :param bytecount_interval: seconds between each >BYTECOUNT:
+                                   notification.
+        :type bytecount_interval: int
+        """
+        self._manager = manager
+        self._bytecount_interval = bytecount_interval
+        self._response = []
+        self._pending = deque()
+
+    def connectionMade(self):
+        """
+        Subscribes to the real time notifications.
+        """
+        self.sendCommand("state on").addErrback(self._subscribeErr)
+        self.sendCommand(
+            "bytecount %d" % (self._bytecount_interval,)).addErrback(
+                self._subscribeErr)
+
+    def _subscribeErr(self, failure):
+        """
+        Errback for the subscription commands.
+
+        :param failure: the failure that triggered the errback.
+        :type failure: twisted.python.failure.Failure
+        """
+        logger.warning("Could not subscribe to management notifications: "
+                       "%r" % (failure.value,))
+
+    def connectionLost(self, reason):
+        """
+        Fails the commands still waiting for an answer and lets the
+        manager know that we are gone.
+
+        :param reason: the reason for the disconnection.
+        :type reason: twisted.python.failure.Failure
+        """
+        self._response = []
+        pending, self._pending = self._pending, deque()
+        while pending:
+            _, d = pending.popleft()
+            d.errback(reason)
+        self._manager.management_connection_lost(self, reason)
+
+    def sendCommand(self, command):
+        """
+        Writes a command to the management interface.
+
+        Any number of commands can be in flight, the responses are matched
+        with the commands in the order they were sent.
+
+        :param command: the command to send.
+        :type command: str
+
+        :returns: a deferred that will fire with the list of lines of the
+                  response, or fail with ManagementCommandError.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        d = defer.Deferred()
+        self._pending.append((command, d))
+        self.sendLine(command)
+        return d
+
+    def lineReceived(self, line):
+        """
+        Dispatches every line read to the proper handler.
+
+        :param line: the line read, without the delimiter.
+        :type line: str
+        """
+        line = line.rstrip('\r')
+        if line.startswith(self.NOTIFICATION_PREFIX):
+            self._notificationReceived(line)
+            return
+
+        self._response.append(line)
+        if line == self.END:
+            self._responseReceived()
+        elif len(self._response) == 1 and (
+                line.startswith(self.SUCCESS) or line.startswith(self.ERROR)):
+            # single line answer
+            self._responseReceived()
+
+    def _notificationReceived(self, line):
+        """
+        Parses a real-time notification.
+
+        :param line: a line starting with '>'
+        :type line: str
+        """
+        if line.startswith(self.STATE_PREFIX):
+            self._manager.management_state_received(
+                line[len(self.STATE_PREFIX):])
+        elif line.startswith(self.BYTECOUNT_PREFIX):
+            parts = line[len(self.BYTECOUNT_PREFIX):].split(',')
+            try:
+                bytes_in, bytes_out = int(parts[0]), int(parts[1])
+            except (IndexError, ValueError):
+                logger.warning("Bad bytecount notification: %r" % (line,))
+                return
+            self._manager.management_bytecount_received(bytes_in, bytes_out)
+        else:
+            logger.debug("management: %s" % (line,))
+
+    def _responseReceived(self):
+        """
+        Fires the deferred of the oldest pending command with the lines of
+        the complete response.
+        """
+        response, self._response = self._response, []
+        if response[-1] == self.END:
+            del response[-1]
+        if not self._pending:
+            logger.debug("Unexpected management response: %r" % (response,))
+            return
+
+        command, d = self._pending.popleft()
+        last = response[-1] if response else ""
+        if last.startswith(self.ERROR):
+            d.errback(ManagementCommandError(
+                "%s: %s" % (command, last[len(self.ERROR):].strip())))
+        else:
+            d.callback(response)
+
+
+class ManagementFactory(ClientFactory):
+    """
+    Factory for the ManagementProtocol.
+    """
+
+    def __init__(self, manager, bytecount_interval=1):
+        """
+        :param manager: the object that will be notified of the parsed
+                        events, see ManagementProtocol.
+        :type manager: VPNManager
+        :param bytecount_interval: seconds between each >BYTECOUNT:
+                                   notification.
+        :type bytecount_interval: int
+        """
+        self._manager = manager
+        self._bytecount_interval = bytecount_interval
+
+    def buildProtocol(self, addr):
+        management = ManagementProtocol(
+            self._manager, bytecount_interval=self._bytecount_interval)
+        management.factory = self
+        return management
+
+
+def get_management_endpoint(reactor, host, port):
+    """
+    Returns the client endpoint for the management interface.
+
+    :param reactor: the reactor to use.
+    :type reactor: twisted.internet.reactor
+    :param host: either socket path (unix) or socket IP
+    :type host: str
+    :param port: either string "unix" if it's a unix socket, or port
+                 otherwise
+    :type port: str
+
+    :rtype: twisted.internet.interfaces.IStreamClientEndpoint
+    """
+    if port == "unix":
+        return UNIXClientEndpoint(reactor, host)
+    return TCP4ClientEndpoint(reactor, host, int(port))
+
+
+class ManagementConnector(object):
+    """
+    Connects to the management interface, retrying with a jittered
+    exponential backoff until it succeeds or runs out of retries.
+
+    There is only one connection attempt in flight at any time, asking
+    to connect while we are still trying just waits for the ongoing
+    attempts.
+    """
+
+    # Timers, in secs
+    INITIAL_DELAY = 0.25
+    MAX_DELAY = 5
+    FACTOR = 2
+    JITTER = 0.2
+
+    def __init__(self, endpoint, factory, reactor):
+        """
+        :param endpoint: the endpoint to connect to.
+        :type endpoint: twisted.internet.interfaces.IStreamClientEndpoint
+        :param factory: the factory for the management protocol.
+        :type factory: ManagementFactory
+        :param reactor: the reactor used to schedule the retries.
+        :type reactor: twisted.internet.reactor
+        """
+        self._endpoint = endpoint
+        self._factory = factory
+        self._reactor = reactor
+
+        self._waiting = []
+        self._attempt = None
+        self._delayed = None
+        self._max_retries = None
+        self._started_at = None
+
+        # metrics for the last round of connection attempts
+        self.attempts = 0
+        self.time_to_connect = None
+
+    @property
+    def connecting(self):
+        """
+        Whether there is a connection attempt ongoing or scheduled.
+
+        :rtype: bool
+        """
+        return self._attempt is not None or self._delayed is not None
+
+    def connect(self, max_retries=None):
+        """
+        Connects to the management interface.
+
+        If we are already trying to connect, max_retries is ignored and
+        the returned deferred waits for the ongoing attempts.
+
+        :param max_retries: how many times to retry after the first
+                            attempt fails, None to retry forever.
+        :type max_retries: int
+
+        :returns: a deferred that will fire with the connected
+                  ManagementProtocol.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        d = defer.Deferred()
+        self._waiting.append(d)
+        if not self.connecting:
+            self._max_retries = max_retries
+            self._started_at = self._reactor.seconds()
+            self.attempts = 0
+            self.time_to_connect = None
+            self._try_to_connect()
+        return d
+
+    def stop(self):
+        """
+        Stops trying to connect. The deferreds waiting for a connection
+        fail with CancelledError.
+        """
+        if self._delayed is not None:
+            self._delayed.cancel()
+            self._delayed = None
+        if self._attempt is not None:
+            attempt, self._attempt = self._attempt, None
+            attempt.cancel()
+        self._fire_waiting(failure=defer.CancelledError())
+
+    def _try_to_connect(self):
+        """
+        Does a single connection attempt.
+        """
+        self._delayed = None
+        self.attempts += 1
+        self._attempt = self._endpoint.connect(self._factory)
+        self._attempt.addCallbacks(self._connected, self._failed)
+
+    def _connected(self, management):
+        """
+        Callback for a successful connection attempt.
+
+        :param management: the connected protocol.
+        :type management: ManagementProtocol
+        """
+        self._attempt = None
+        self.time_to_connect = self._reactor.seconds() - self._started_at
+        logger.debug("Connected to management after %d attempt(s) in "
+                     "%.2f secs." % (self.attempts, self.time_to_connect))
+        self._fire_waiting(result=management)
+
+    def _failed(self, failure):
+        """
+        Errback for a failed connection attempt. Schedules the next one,
+        if we still have retries left.
+
+        :param failure: the failure that triggered the errback.
+        :type failure: twisted.python.failure.Failure
+        """
+        if self._attempt is None:
+            # stopped.
+            return
+        self._attempt = None
+
+        if (self._max_retries is not None and
+                self.attempts > self._max_retries):
+            logger.warning("Max retries reached while attempting to "
+                           "connect to management.")
+            self._fire_waiting(failure=failure)
+            return
+
+        delay = self._get_delay()
+        logger.debug("Could not connect to management yet (%r), "
+                     "retrying in %.2f secs." % (failure.value, delay))
+        self._delayed = self._reactor.callLater(delay, self._try_to_connect)
+
+    def _get_delay(self):
+        """
+        Returns the seconds to wait before the next attempt.
+
+        :rtype: float
+        """
+        delay = min(self.INITIAL_DELAY * self.FACTOR ** (self.attempts - 1),
+                    self.MAX_DELAY)
+        return delay * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+
+    def _fire_waiting(self, result=None, failure=None):
+        """
+        Fires all the deferreds waiting for a connection.
+
+        :param result: the value to callback with.
+        :param failure: the failure or exception to errback with, if any.
+        """
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            if failure is not None:
+                d.errback(failure)
+            else:
+                d.callback(result)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# processtracker.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Discovery of the openvpn processes launched by LEAP.
+"""
+import logging
+import os
+
+import psutil
+try:
+    # psutil < 2.0.0
+    from psutil.error import AccessDenied as psutil_AccessDenied
+    from psutil.error import NoSuchProcess as psutil_NoSuchProcess
+except ImportError:
+    # psutil >= 2.0.0
+    from psutil import AccessDenied as psutil_AccessDenied
+    from psutil import NoSuchProcess as psutil_NoSuchProcess
+
+from twisted.internet import defer, threads
+
+logger = logging.getLogger(__name__)
+
+
+def _get_process_attr(process, attr):
+    """
+    Returns an attribute of a psutil process, that is a property in
+    psutil < 2.0.0 and a method afterwards.
+
+    :param process: the process to query.
+    :type process: psutil.Process
+    :param attr: the name of the attribute.
+    :type attr: str
+    """
+    value = getattr(process, attr)
+    return value() if callable(value) else value
+
+
+class OpenVPNProcessTracker(object):
+    """
+    Finds the openvpn processes launched by LEAP without walking the whole
+    process table each time.
+
+    We remember the pid of the process we spawn, and check it directly.
+    Walking all the processes is only needed to find the instances left
+    behind by a previous run, and that can be done in a thread at startup.
+    The processes inspected are cached by pid and start time, so a process
+    is only looked at once no matter how many times we scan.
+    """
+
+    # Our launchers add this to the openvpn command line.
+    FINGERPRINT = "LEAPOPENVPN"
+    PROC_CMDLINE = "/proc/%d/cmdline"
+    HAS_PROCFS = os.path.exists("/proc/self/cmdline")
+
+    def __init__(self):
+        self._pid = None
+
+        # (pid, create_time) -> whether it is one of our openvpn processes
+        self._known = {}
+        # pids found on the last scan, None if we did not scan yet
+        self._candidates = None
+        # fires when the scan started by scan_in_thread is done
+        self._scanning = None
+
+    def track(self, pid):
+        """
+        Remembers the pid of the openvpn process we spawned.
+
+        :param pid: the process id.
+        :type pid: int
+        """
+        self._pid = pid
+
+    def untrack(self, pid):
+        """
+        Forgets the pid of the openvpn process we spawned, if it is the
+        one we are tracking.
+
+        :param pid: the process id.
+        :type pid: int
+        """
+        if self._pid == pid:
+            self._pid = None
+
+    def find(self):
+        """
+        Looks for a running openvpn instance launched by LEAP.
+
+        The pid we spawned and the ones found in the last scan are checked
+        right away. The whole process table is only walked if we never did
+        it before, in a thread, and if the scan started by scan_in_thread
+        is still running we wait for it instead of walking it again.
+
+        :returns: a deferred that fires with the instance found, or None.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if self._pid is not None:
+            process = self._check_pid(self._pid)
+            if process is not None:
+                return defer.succeed(process)
+
+        if self._candidates is not None:
+            return defer.succeed(self._check_candidates())
+
+        scanning = self._scanning
+        if scanning is None:
+            scanning = self.scan_in_thread()
+        logger.debug("Waiting for the scan of the running processes")
+        d = defer.Deferred()
+
+        def scanned(result):
+            d.callback(self._check_candidates())
+            return result
+
+        scanning.addBoth(scanned)
+        return d
+
+    def _check_candidates(self):
+        """
+        Returns the first process found in the last scan that is still
+        running.
+
+        :rtype: psutil.Process or None
+        """
+        for pid in self._candidates or []:
+            process = self._check_pid(pid)
+            if process is not None:
+                return process
+        return None
+
+    def scan(self):
+        """
+        Walks the whole process table looking for openvpn instances
+        launched by LEAP. This is expensive in a busy host, do not call
+        it from the reactor thread, use scan_in_thread instead.
+
+        :returns: the first instance found.
+        :rtype: psutil.Process or None
+        """
+        known = {}
+        found = []
+        for process in psutil.process_iter():
+            try:
+                key = (process.pid, _get_process_attr(process, 'create_time'))
+                is_openvpn = self._known.get(key)
+                if is_openvpn is None:
+                    is_openvpn = self._has_fingerprint(
+                        _get_process_attr(process, 'cmdline'))
+                known[key] = is_openvpn
+                if is_openvpn:
+                    found.append(process)
+            except (psutil_AccessDenied, psutil_NoSuchProcess):
+                pass
+
+        self._known = known
+        self._candidates = [process.pid for process in found]
+        return found[0] if found else None
+
+    def scan_in_thread(self):
+        """
+        Scans the process table in a thread, so the results are cached
+        by the time we need them.
+
+        :rtype: twisted.internet.defer.Deferred
+        """
+        d = self._scanning = threads.deferToThread(self.scan)
+        d.addErrback(self._scan_err)
+        d.addBoth(self._scan_done, d)
+        return d
+
+    def _scan_done(self, result, d):
+        """
+        Callback for scan_in_thread, lets the next scan start.
+
+        :param result: the result of the scan, passed along.
+        :param d: the deferred of the scan that ended.
+        :type d: twisted.internet.defer.Deferred
+        """
+        if self._scanning is d:
+            self._scanning = None
+        return result
+
+    def _scan_err(self, failure):
+        """
+        Errback for scan_in_thread.
+
+        :param failure: the failure that triggered the errback.
+        :type failure: twisted.python.failure.Failure
+        """
+        logger.warning("Could not scan the running processes: %r" %
+                       (failure.value,))
+
+    def _check_pid(self, pid):
+        """
+        Returns the process with the given pid if it is one of our openvpn
+        instances.
+
+        :param pid: the process id.
+        :type pid: int
+
+        :rtype: psutil.Process or None
+        """
+        try:
+            if self.HAS_PROCFS:
+                # cheap path, we just read the file
+                try:
+                    with open(self.PROC_CMDLINE % (pid,)) as f:
+                        cmdline = f.read().split('\0')
+                except IOError:
+                    return None
+                if not self._has_fingerprint(cmdline):
+                    return None
+                return psutil.Process(pid)
+
+            process = psutil.Process(pid)
+            if self._has_fingerprint(_get_process_attr(process, 'cmdline')):
+                return process
+        except (psutil_AccessDenied, psutil_NoSuchProcess):
+            pass
+        return None
+
+    def _has_fingerprint(self, cmdline):
+        """
+        Returns whether the command line is one of our openvpn invocations.
+
+        :param cmdline: the command line arguments.
+        :type cmdline: list of str
+
+        :rtype: bool
+        """
+        # XXX Not exact!
+        # Will give false positives.
+        # we should check that cmdline BEGINS
+        # with openvpn or with our wrapper
+        # (pkexec / osascript / whatever)
+
+        # This needs more work, see #3268, but for the moment
+        # we need to be able to filter out arguments in the form
+        # --openvpn-foo, since otherwise we are shooting ourselves
+        # in the feet.
+        return any(self.FINGERPRINT in arg for arg in cmdline)
@@ -40,7 +40,7 @@ from leap.bitmask.services.eip.eipbootstrapper import EIPBootstrapper
 from leap.bitmask.services.eip.eipconfig import EIPConfig
 from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.crypto.tests import fake_provider
-from leap.bitmask.crypto.srpauth import SRPAuth
+from leap.bitmask.crypto.srpauth import SRPAuth, SessionCredentials
 from leap.bitmask import util
 from leap.common.testing.basetest import BaseLeapTest
 from leap.common.files import mkdir_p
@@ -64,13 +64,13 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
         self.old_pp = util.get_path_prefix
         self.old_save = EIPConfig.save
         self.old_load = EIPConfig.load
-        self.old_si = SRPAuth.get_session_id
+        self.old_creds = SRPAuth.get_credentials
 
     def tearDown(self):
         util.get_path_prefix = self.old_pp
         EIPConfig.save = self.old_save
         EIPConfig.load = self.old_load
-        SRPAuth.get_session_id = self.old_si
+        SRPAuth.get_credentials = self.old_creds
 
     def _download_config_test_template(self, ifneeded, new):
         """
@@ -308,7 +308,8 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
         _, _ = self._download_certificate_test_template(
             False, False)
 
-        SRPAuth.get_session_id = mock.MagicMock(return_value="1")
+        SRPAuth.get_credentials = mock.MagicMock(
+            return_value=SessionCredentials("1", None, None, None))
 
         def check_cookie(*args, **kwargs):
             cookies = kwargs.get("cookies", None)
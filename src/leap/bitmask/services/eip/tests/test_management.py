@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# test_management.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the openvpn management protocol
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import Mock
+from twisted.internet import defer
+from twisted.internet.error import ConnectError, ConnectionLost
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+
+from leap.bitmask.services.eip.management import ManagementCommandError
+from leap.bitmask.services.eip.management import ManagementConnector
+from leap.bitmask.services.eip.management import ManagementProtocol
+
+
+class ManagementProtocolTest(unittest.TestCase):
+    """
+    Tests for the ManagementProtocol class
+    """
+
+    def setUp(self):
+        self.manager = Mock()
+        self.transport = StringTransport()
+        self.proto = ManagementProtocol(self.manager, bytecount_interval=2)
+        self.proto.makeConnection(self.transport)
+        # answer the subscription commands
+        self.proto.dataReceived(
+            "SUCCESS: real-time state notification set to ON\r\n"
+            "SUCCESS: bytecount interval changed\r\n")
+        self.transport.clear()
+
+    def _results(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results
+
+    def test_subscribes_on_connection(self):
+        transport = StringTransport()
+        proto = ManagementProtocol(self.manager, bytecount_interval=5)
+        proto.makeConnection(transport)
+        self.assertEqual(transport.value(), "state on\nbytecount 5\n")
+
+    def test_state_notification(self):
+        self.proto.dataReceived(
+            ">STATE:1234,CONNECTED,SUCCESS,10.42.0.2,1.2.3.4\r\n")
+        self.manager.management_state_received.assert_called_once_with(
+            "1234,CONNECTED,SUCCESS,10.42.0.2,1.2.3.4")
+
+    def test_bytecount_notification(self):
+        self.proto.dataReceived(">BYTECOUNT:1024,2048\r\n")
+        self.manager.management_bytecount_received.assert_called_once_with(
+            1024, 2048)
+
+    def test_bad_bytecount_notification_is_ignored(self):
+        self.proto.dataReceived(">BYTECOUNT:foo\r\n")
+        self.assertFalse(self.manager.management_bytecount_received.called)
+
+    def test_notifications_split_across_chunks(self):
+        self.proto.dataReceived(">BYTECOU")
+        self.proto.dataReceived("NT:1,2\r\n>BYTECOUNT:3,4\r\n")
+        self.assertEqual(
+            self.manager.management_bytecount_received.call_count, 2)
+
+    def test_multiline_response(self):
+        results = self._results(self.proto.sendCommand("state"))
+        self.assertEqual(self.transport.value(), "state\n")
+        self.proto.dataReceived("1234,CONNECTED,SUCCESS,10.42.0.2,1.2.3.4\r\n")
+        self.assertEqual(results, [])
+        self.proto.dataReceived("END\r\n")
+        self.assertEqual(results,
+                         [["1234,CONNECTED,SUCCESS,10.42.0.2,1.2.3.4"]])
+
+    def test_single_line_response(self):
+        results = self._results(self.proto.sendCommand("signal SIGTERM"))
+        self.proto.dataReceived("SUCCESS: signal SIGTERM thrown\r\n")
+        self.assertEqual(results, [["SUCCESS: signal SIGTERM thrown"]])
+
+    def test_error_response(self):
+        results = self._results(self.proto.sendCommand("foo"))
+        self.proto.dataReceived("ERROR: unknown command, enter 'help'\r\n")
+        self.assertTrue(results[0].check(ManagementCommandError))
+
+    def test_pipelined_commands(self):
+        first = self._results(self.proto.sendCommand("state"))
+        second = self._results(self.proto.sendCommand("signal SIGTERM"))
+        self.proto.dataReceived(
+            "1,CONNECTED,SUCCESS,10.42.0.2,1.2.3.4\r\nEND\r\n"
+            "SUCCESS: signal SIGTERM thrown\r\n")
+        self.assertEqual(first, [["1,CONNECTED,SUCCESS,10.42.0.2,1.2.3.4"]])
+        self.assertEqual(second, [["SUCCESS: signal SIGTERM thrown"]])
+
+    def test_notification_inside_response(self):
+        results = self._results(self.proto.sendCommand("state"))
+        self.proto.dataReceived("line1\r\n>BYTECOUNT:1,2\r\nEND\r\n")
+        self.manager.management_bytecount_received.assert_called_once_with(
+            1, 2)
+        self.assertEqual(results, [["line1"]])
+
+    def test_pending_commands_fail_on_connection_lost(self):
+        results = self._results(self.proto.sendCommand("state"))
+        self.proto.connectionLost(Failure(ConnectionLost()))
+        self.assertTrue(results[0].check(ConnectionLost))
+
+    def test_connection_lost(self):
+        reason = Mock()
+        self.proto.connectionLost(reason)
+        self.manager.management_connection_lost.assert_called_once_with(
+            self.proto, reason)
+
+
+class FakeEndpoint(object):
+    """
+    Endpoint whose connection attempts are fired by the tests.
+    """
+
+    def __init__(self):
+        self.connects = []
+
+    def connect(self, factory):
+        d = defer.Deferred()
+        self.connects.append(d)
+        return d
+
+
+class ManagementConnectorTest(unittest.TestCase):
+    """
+    Tests for the ManagementConnector class
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.endpoint = FakeEndpoint()
+        self.connector = ManagementConnector(
+            self.endpoint, Mock(), self.clock)
+        self.connector.JITTER = 0
+
+    def _results(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results
+
+    def test_connects(self):
+        results = self._results(self.connector.connect())
+        self.clock.advance(1)
+        self.endpoint.connects[0].callback("proto")
+        self.assertEqual(results, ["proto"])
+        self.assertEqual(self.connector.attempts, 1)
+        self.assertEqual(self.connector.time_to_connect, 1)
+        self.assertFalse(self.connector.connecting)
+
+    def test_exponential_backoff(self):
+        self.connector.connect()
+        self.endpoint.connects[0].errback(ConnectError())
+        self.clock.advance(0.25)
+        self.assertEqual(len(self.endpoint.connects), 2)
+        self.endpoint.connects[1].errback(ConnectError())
+        self.clock.advance(0.25)
+        self.assertEqual(len(self.endpoint.connects), 2)
+        self.clock.advance(0.25)
+        self.assertEqual(len(self.endpoint.connects), 3)
+
+    def test_max_delay(self):
+        self.connector.attempts = 20
+        self.assertEqual(self.connector._get_delay(),
+                         ManagementConnector.MAX_DELAY)
+
+    def test_single_attempt_in_flight(self):
+        first = self._results(self.connector.connect())
+        second = self._results(self.connector.connect())
+        self.assertEqual(len(self.endpoint.connects), 1)
+        self.endpoint.connects[0].callback("proto")
+        self.assertEqual(first, ["proto"])
+        self.assertEqual(second, ["proto"])
+
+    def test_max_retries(self):
+        results = self._results(self.connector.connect(max_retries=1))
+        self.endpoint.connects[0].errback(ConnectError())
+        self.clock.advance(1)
+        self.endpoint.connects[1].errback(ConnectError())
+        self.assertTrue(results[0].check(ConnectError))
+        self.assertEqual(self.connector.attempts, 2)
+        self.assertFalse(self.connector.connecting)
+
+    def test_stop(self):
+        results = self._results(self.connector.connect())
+        self.endpoint.connects[0].errback(ConnectError())
+        self.connector.stop()
+        self.assertTrue(results[0].check(defer.CancelledError))
+        self.assertFalse(self.connector.connecting)
+        self.clock.advance(10)
+        self.assertEqual(len(self.endpoint.connects), 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# test_processtracker.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the openvpn process tracker
+"""
+import subprocess
+import sys
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from twisted.internet import defer
+
+from leap.bitmask.services.eip import processtracker
+from leap.bitmask.services.eip.processtracker import OpenVPNProcessTracker
+
+
+def spawn(*args):
+    """
+    Starts a process that sleeps with args in its command line.
+
+    :rtype: subprocess.Popen
+    """
+    cmd = [sys.executable, "-c", "import time; time.sleep(60)"]
+    return subprocess.Popen(cmd + list(args))
+
+
+class OpenVPNProcessTrackerTest(unittest.TestCase):
+    """
+    Tests for the OpenVPNProcessTracker class
+    """
+
+    def setUp(self):
+        self.tracker = OpenVPNProcessTracker()
+        self.openvpn = self._spawn(OpenVPNProcessTracker.FINGERPRINT)
+
+    def _spawn(self, *args):
+        process = spawn(*args)
+        self.addCleanup(self._kill, process)
+        return process
+
+    def _kill(self, process):
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    def _find(self):
+        """
+        Returns the result of find, that must be already available.
+
+        :rtype: psutil.Process or None
+        """
+        results = []
+        self.tracker.find().addBoth(results.append)
+        self.assertEqual(len(results), 1)
+        return results[0]
+
+    def test_tracked_pid_is_found(self):
+        self.tracker.track(self.openvpn.pid)
+        with mock.patch.object(self.tracker, "scan") as scan:
+            self.assertEqual(self._find().pid, self.openvpn.pid)
+        self.assertFalse(scan.called)
+
+    def test_untrack(self):
+        self.tracker.track(self.openvpn.pid)
+        self.tracker.untrack(self.openvpn.pid)
+        self.tracker._candidates = []
+        self.assertIsNone(self._find())
+
+    def test_other_processes_are_ignored(self):
+        other = self._spawn("--openvpn-foo")
+        self.tracker.track(other.pid)
+        self.tracker._candidates = [other.pid]
+        self.assertIsNone(self._find())
+
+    def test_scan(self):
+        self._spawn("--openvpn-foo")
+        self.assertEqual(self.tracker.scan().pid, self.openvpn.pid)
+        self.assertEqual(self.tracker._candidates, [self.openvpn.pid])
+
+    def test_dead_pids_are_pruned(self):
+        self.tracker.scan()
+        self._kill(self.openvpn)
+
+        self.assertIsNone(self._find())
+        self.assertIsNone(self.tracker.scan())
+        self.assertEqual(self.tracker._candidates, [])
+        self.assertNotIn(self.openvpn.pid,
+                         [pid for pid, _ in self.tracker._known])
+
+    def test_find_scans_if_never_scanned(self):
+        def deferToThread(f, *args, **kwargs):
+            return defer.maybeDeferred(f, *args, **kwargs)
+
+        with mock.patch.object(processtracker.threads, "deferToThread",
+                               side_effect=deferToThread) as to_thread:
+            self.assertEqual(self._find().pid, self.openvpn.pid)
+            self.assertEqual(to_thread.call_count, 1)
+
+            # the next one uses the results of the scan
+            self.assertEqual(self._find().pid, self.openvpn.pid)
+            self.assertEqual(to_thread.call_count, 1)
+
+    def test_find_waits_for_the_running_scan(self):
+        scanning = defer.Deferred()
+        with mock.patch.object(processtracker.threads, "deferToThread",
+                               return_value=scanning) as to_thread:
+            self.tracker.scan_in_thread()
+            results = []
+            self.tracker.find().addBoth(results.append)
+            self.assertEqual(results, [])
+
+            scanning.callback(self.tracker.scan())
+            self.assertEqual(results[0].pid, self.openvpn.pid)
+            self.assertEqual(to_thread.call_count, 1)
+        self.assertIsNone(self.tracker._scanning)
+
+    def test_find_after_a_failed_scan(self):
+        with mock.patch.object(processtracker.threads, "deferToThread",
+                               return_value=defer.fail(OSError())):
+            self.assertIsNone(self._find())
+        self.assertIsNone(self.tracker._scanning)
+
+if __name__ == "__main__":
+    unittest.main()
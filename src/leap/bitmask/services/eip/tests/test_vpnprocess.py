@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+# test_vpnprocess.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for vpnprocess
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from twisted.internet import defer
+
+from leap.bitmask import util
+from leap.bitmask.config.providerconfig import ProviderConfig
+from leap.bitmask.services.eip import vpnprocess
+from leap.bitmask.services.eip.eipconfig import EIPConfig
+from leap.bitmask.services.eip.vpnlauncher import VPNLauncherException
+from leap.bitmask.services.eip.vpnprocess import TrafficCounters, VPN
+from leap.bitmask.services.eip.vpnprocess import VPNObserver
+from leap.bitmask.services.eip.vpnprocess import VPNProcess, VPNSignals
+
+
+class VPNTest(unittest.TestCase):
+    """
+    Tests for the VPN class
+    """
+
+    def setUp(self):
+        with mock.patch.object(vpnprocess, "OpenVPNProcessTracker"):
+            self.vpn = VPN()
+
+    def test_output_tail_without_process(self):
+        self.assertEqual(self.vpn.get_output_tail(), [])
+
+    def test_output_tail_of_the_process(self):
+        self.vpn._vpnproc = mock.Mock()
+        self.vpn._vpnproc.get_output_tail.return_value = ["one", "two"]
+        self.assertEqual(self.vpn.get_output_tail(), ["one", "two"])
+
+    def _start(self, running=None, stopped=None):
+        """
+        Starts the vpn with a mocked VPNProcess.
+
+        :param running: the instance found running.
+        :param stopped: the result of stopping the running instance.
+
+        :returns: the mocked VPNProcess and the results of the start.
+        :rtype: tuple
+        """
+        self.vpn._reactor = mock.Mock()
+        vpnproc = mock.Mock(vpn_env={})
+        vpnproc.getCommand.return_value = ["openvpn"]
+        vpnproc.get_openvpn_process.return_value = defer.succeed(running)
+        vpnproc.stop_if_already_running.return_value = stopped
+        results = []
+        with mock.patch.object(vpnprocess, "VPNProcess",
+                               return_value=vpnproc):
+            self.vpn.start().addBoth(results.append)
+        return vpnproc, results
+
+    def test_start(self):
+        vpnproc, results = self._start()
+        self.assertEqual(results, [None])
+        self.assertFalse(vpnproc.stop_if_already_running.called)
+        self.vpn._reactor.spawnProcess.assert_called_once_with(
+            vpnproc, "openvpn", ["openvpn"], mock.ANY)
+
+    def test_start_stops_the_running_instance(self):
+        stopped = defer.Deferred()
+        vpnproc, results = self._start(mock.Mock(), stopped)
+
+        # we do not spawn openvpn until the old one is gone
+        self.assertEqual(results, [])
+        self.assertFalse(self.vpn._reactor.spawnProcess.called)
+
+        stopped.callback(True)
+        self.assertEqual(results, [None])
+        self.assertTrue(self.vpn._reactor.spawnProcess.called)
+
+    def test_start_fails_if_the_running_instance_is_not_stopped(self):
+        stopped = defer.fail(vpnprocess.OpenVPNAlreadyRunning())
+        vpnproc, results = self._start(mock.Mock(), stopped)
+        results[0].trap(vpnprocess.OpenVPNAlreadyRunning)
+        self.assertFalse(self.vpn._reactor.spawnProcess.called)
+
+    def test_start_fails_without_launcher(self):
+        results = []
+        with mock.patch.object(vpnprocess, "VPNProcess",
+                               side_effect=VPNLauncherException):
+            self.vpn.start().addBoth(results.append)
+        results[0].trap(VPNLauncherException)
+
+
+class VPNProcessOutputTest(unittest.TestCase):
+    """
+    Tests for the framing of the openvpn output in VPNProcess
+    """
+
+    def setUp(self):
+        with mock.patch.object(vpnprocess, "get_vpn_launcher"):
+            self.proc = VPNProcess(EIPConfig(), ProviderConfig(),
+                                   "/tmp/socket", "unix", VPNSignals(), 1,
+                                   process_tracker=mock.Mock())
+        self.observer = self.proc._vpn_observer = mock.Mock()
+
+    def test_lines_split_across_chunks(self):
+        self.proc.outReceived("Initialization Seq")
+        self.assertEqual(self.proc.get_output_tail(), [])
+        self.assertFalse(self.observer.watch.called)
+
+        self.proc.outReceived("uence Completed\nnext")
+        self.assertEqual(self.proc.get_output_tail(),
+                         ["Initialization Sequence Completed"])
+        self.observer.watch.assert_called_once_with(
+            "Initialization Sequence Completed")
+
+    def test_lines_of_a_chunk_are_watched_at_once(self):
+        self.proc.outReceived("one\ntwo\nthree\n")
+        self.assertEqual(self.proc.get_output_tail(),
+                         ["one", "two", "three"])
+        self.observer.watch.assert_called_once_with("one\ntwo\nthree")
+
+    def test_crlf(self):
+        self.proc.outReceived("one\r\ntwo\r")
+        self.proc.outReceived("\nthree\r\n")
+        self.assertEqual(self.proc.get_output_tail(),
+                         ["one", "two", "three"])
+
+    def test_partial_line_at_exit(self):
+        self.proc.outReceived("one\ntwo")
+        self.proc.outConnectionLost()
+        self.assertEqual(self.proc.get_output_tail(), ["one", "two"])
+
+        self.observer.reset_mock()
+        self.proc.outConnectionLost()
+        self.assertFalse(self.observer.watch.called)
+
+    def test_too_long_line(self):
+        line = "x" * (VPNProcess.MAX_LINE_LENGTH + 1)
+        self.proc.outReceived(line)
+        self.assertEqual(self.proc.get_output_tail(), [line])
+
+        self.proc.outReceived("end\n")
+        self.assertEqual(self.proc.get_output_tail(), [line, "end"])
+
+    def test_tail_is_capped(self):
+        lines = [str(i) for i in range(VPNProcess.OUTPUT_TAIL_SIZE + 10)]
+        self.proc.outReceived("\n".join(lines[:20]) + "\n")
+        self.proc.outReceived("\n".join(lines[20:]) + "\n")
+        self.assertEqual(self.proc.get_output_tail(),
+                         lines[-VPNProcess.OUTPUT_TAIL_SIZE:])
+
+
+class VPNObserverTest(unittest.TestCase):
+    """
+    Tests for the VPNObserver class
+    """
+
+    def setUp(self):
+        self.qtsigs = mock.Mock()
+        self.observer = VPNObserver(self.qtsigs)
+
+    def _restore_patterns(self, events):
+        VPNObserver._events = events
+        VPNObserver._compile_patterns()
+
+    def test_every_pattern(self):
+        for event, patterns in VPNObserver._events.items():
+            for pattern in patterns:
+                self.qtsigs.reset_mock()
+                line = "Mon Jun  2 12:00:00 2014 %s, exiting" % (pattern,)
+                self.assertEqual(self.observer.watch(line), [event])
+                signal = getattr(self.qtsigs, event.lower())
+                signal.emit.assert_called_once_with()
+
+    def test_two_patterns_on_the_same_line(self):
+        line = ("write UDPv4: Network is unreachable (code=101) "
+                "SIGUSR1[soft,ping-restart] received")
+        self.assertEqual(self.observer.watch(line),
+                         ["NETWORK_UNREACHABLE", "PROCESS_RESTART_PING"])
+        self.qtsigs.network_unreachable.emit.assert_called_once_with()
+        self.qtsigs.process_restart_ping.emit.assert_called_once_with()
+
+    def test_event_is_signaled_once_per_batch(self):
+        lines = "\n".join(["SIGUSR1[soft,tls-error] received"] * 3)
+        self.assertEqual(self.observer.watch(lines),
+                         ["PROCESS_RESTART_TLS"])
+        self.qtsigs.process_restart_tls.emit.assert_called_once_with()
+
+    def test_no_match(self):
+        self.assertEqual(self.observer.watch("TUN/TAP device tun0 opened"),
+                         [])
+        self.assertEqual(self.qtsigs.method_calls, [])
+
+    def test_missing_signal(self):
+        observer = VPNObserver(mock.Mock(spec=[]))
+        self.assertEqual(
+            observer.watch("Initialization Sequence Completed"),
+            ["INITIALIZATION_COMPLETED"])
+
+    def test_add_patterns(self):
+        self.addCleanup(self._restore_patterns, VPNObserver._events)
+        VPNObserver.add_patterns("NETWORK_UNREACHABLE",
+                                 ["Red inalcanzable"])
+
+        self.assertEqual(self.observer.watch("Red inalcanzable"),
+                         ["NETWORK_UNREACHABLE"])
+        self.assertEqual(
+            self.observer.watch("Network is unreachable (code=101)"),
+            ["NETWORK_UNREACHABLE"])
+
+    def test_longest_pattern_wins(self):
+        self.addCleanup(self._restore_patterns, VPNObserver._events)
+        VPNObserver.add_patterns("SHORT", ["Initialization"])
+        self.assertEqual(
+            self.observer.watch("Initialization Sequence Completed"),
+            ["INITIALIZATION_COMPLETED"])
+
+
+class TrafficCountersTest(unittest.TestCase):
+    """
+    Tests for the TrafficCounters class
+    """
+
+    def test_first_reading(self):
+        counters = TrafficCounters.from_totals(100, 50)
+        self.assertEqual((counters.delta_in, counters.delta_out), (100, 50))
+
+    def test_deltas(self):
+        previous = TrafficCounters.from_totals(100, 50)
+        counters = TrafficCounters.from_totals(150, 80, previous)
+        self.assertEqual((counters.bytes_in, counters.bytes_out), (150, 80))
+        self.assertEqual((counters.delta_in, counters.delta_out), (50, 30))
+
+    def test_counter_reset(self):
+        # openvpn restarted, only the bytes in went back
+        previous = TrafficCounters.from_totals(1000, 500)
+        counters = TrafficCounters.from_totals(10, 600, previous)
+        self.assertEqual((counters.delta_in, counters.delta_out), (10, 100))
+
+    def test_wraparound(self):
+        previous = TrafficCounters.from_totals(2 ** 64 - 10, 2 ** 64 - 10)
+        counters = TrafficCounters.from_totals(5, 2 ** 64 - 5, previous)
+        self.assertEqual((counters.delta_in, counters.delta_out), (5, 5))
+
+    def test_timestamp(self):
+        with mock.patch.object(vpnprocess, "monotonic", lambda: 42.0):
+            counters = TrafficCounters.from_totals(1, 1)
+        self.assertEqual(counters.ts, 42.0)
+
+    def test_bytecount_notifications(self):
+        with mock.patch.object(vpnprocess, "get_vpn_launcher"):
+            proc = VPNProcess(EIPConfig(), ProviderConfig(), "/tmp/socket",
+                              "unix", VPNSignals(), 1,
+                              process_tracker=mock.Mock())
+        qtsigs = proc._qtsigs = mock.Mock()
+        proc._parse_bytecount_and_notify(100, 50)
+        # unchanged, not signaled again
+        proc._parse_bytecount_and_notify(100, 50)
+        proc._parse_bytecount_and_notify(300, 60)
+
+        emitted = [call[0][0]
+                   for call in qtsigs.status_changed.emit.call_args_list]
+        self.assertEqual([(c.delta_in, c.delta_out) for c in emitted],
+                         [(100, 50), (200, 10)])
+
+
+class MonotonicTest(unittest.TestCase):
+    """
+    Tests for the monotonic clock used for the traffic counters
+    """
+
+    def test_does_not_go_backwards(self):
+        first = util.monotonic()
+        self.assertGreaterEqual(util.monotonic(), first)
+
+    def test_fallback_without_clock_gettime(self):
+        with mock.patch.object(util, "_clock_gettime", None):
+            with mock.patch.object(util.time, "time", lambda: 123.0):
+                self.assertEqual(util.monotonic(), 123.0)
+
+    def test_fallback_if_clock_gettime_fails(self):
+        with mock.patch.object(util, "_clock_gettime", lambda *args: -1):
+            with mock.patch.object(util.time, "time", lambda: 123.0):
+                self.assertEqual(util.monotonic(), 123.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
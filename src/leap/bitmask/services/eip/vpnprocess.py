@@ -19,27 +19,23 @@ VPN Manager, spawned in a custom processProtocol.
 """
 import logging
 import os
+import re
 import shutil
-import socket
 import sys
 
-from itertools import chain, repeat
-
-import psutil
-try:
-    # psutil < 2.0.0
-    from psutil.error import AccessDenied as psutil_AccessDenied
-except ImportError:
-    # psutil >= 2.0.0
-    from psutil import AccessDenied as psutil_AccessDenied
+from collections import deque, namedtuple
 
 from PySide import QtCore
 
 from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.services.eip import get_vpn_launcher
 from leap.bitmask.services.eip.eipconfig import EIPConfig
+from leap.bitmask.services.eip.management import ManagementConnector
+from leap.bitmask.services.eip.management import ManagementFactory
+from leap.bitmask.services.eip.management import get_management_endpoint
+from leap.bitmask.services.eip.processtracker import OpenVPNProcessTracker
 from leap.bitmask.services.eip.udstelnet import UDSTelnet
-from leap.bitmask.util import first
+from leap.bitmask.util import first, monotonic
 from leap.bitmask.platform_init import IS_MAC
 from leap.common.check import leap_assert, leap_assert_type
 
@@ -49,7 +45,6 @@ vpnlog = logging.getLogger('leap.openvpn')
 from twisted.internet import protocol
 from twisted.internet import defer
 from twisted.internet import error as internet_error
-from twisted.internet.task import LoopingCall
 
 
 class VPNSignals(QtCore.QObject):
@@ -61,7 +56,7 @@ class VPNSignals(QtCore.QObject):
     """
     # signals for the process
     state_changed = QtCore.Signal(dict)
-    status_changed = QtCore.Signal(dict)
+    status_changed = QtCore.Signal(object)
     process_finished = QtCore.Signal(int)
 
     # signals that come from parsing
@@ -74,6 +69,44 @@ class VPNSignals(QtCore.QObject):
         QtCore.QObject.__init__(self)
 
 
+class TrafficCounters(namedtuple('TrafficCounters', [
+        'ts', 'bytes_in', 'bytes_out', 'delta_in', 'delta_out'])):
+    """
+    Traffic counters of the tcp/udp link, as reported by openvpn.
+
+    ts is the value of a monotonic clock when the counters were read,
+    bytes_in and bytes_out are the totals since the tunnel was started,
+    and delta_in and delta_out the bytes transferred since the previous
+    reading.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_totals(cls, bytes_in, bytes_out, previous=None):
+        """
+        Builds the counters for the given totals, computing the deltas
+        against the previous reading.
+
+        :param bytes_in: total bytes read.
+        :type bytes_in: int
+        :param bytes_out: total bytes written.
+        :type bytes_out: int
+        :param previous: the previous reading, if any.
+        :type previous: TrafficCounters
+
+        :rtype: TrafficCounters
+        """
+        delta_in, delta_out = bytes_in, bytes_out
+        # openvpn resets its counters on restart, in that case the
+        # deltas are the new totals.
+        if previous is not None:
+            if bytes_in >= previous.bytes_in:
+                delta_in = bytes_in - previous.bytes_in
+            if bytes_out >= previous.bytes_out:
+                delta_out = bytes_out - previous.bytes_out
+        return cls(monotonic(), bytes_in, bytes_out, delta_in, delta_out)
+
+
 class VPNObserver(object):
     """
     A class containing different patterns in the openvpn output that
@@ -95,6 +128,11 @@ class VPNObserver(object):
             "Initialization Sequence Completed",),
     }
 
+    # Both are built from _events by _compile_patterns, once at class
+    # load and again each time some patterns are added.
+    _pattern_events = None
+    _matcher = None
+
     def __init__(self, qtsigs):
         """
         Initializer. Keeps a reference to the passed qtsigs object
@@ -104,33 +142,76 @@ class VPNObserver(object):
         """
         self._qtsigs = qtsigs
 
+    @classmethod
+    def _compile_patterns(cls):
+        """
+        Compiles all the patterns in _events into a single regular
+        expression, so every line is scanned only once no matter how many
+        patterns we are looking for.
+        """
+        pattern_events = {}
+        for event, patterns in cls._events.iteritems():
+            for pattern in patterns:
+                pattern_events[pattern] = event
+
+        # longer patterns first, so they win over any shorter pattern
+        # that is a prefix of them.
+        patterns = sorted(pattern_events, key=len, reverse=True)
+        cls._pattern_events = pattern_events
+        cls._matcher = re.compile('|'.join(map(re.escape, patterns)))
+
+    @classmethod
+    def add_patterns(cls, event, patterns):
+        """
+        Adds patterns to look for in the openvpn output, for instance
+        extra translations of the existing ones.
+
+        The new patterns will be used by all the observers, including the
+        ones already instantiated.
+
+        :param event: the name of the event the patterns signal. The
+                      signal emitted will be the attribute of qtsigs
+                      named like the event, in lowercase.
+        :type event: str
+        :param patterns: the strings to look for.
+        :type patterns: iterable of str
+        """
+        events = dict(cls._events)
+        events[event] = tuple(events.get(event, ())) + tuple(patterns)
+        cls._events = events
+        cls._compile_patterns()
+
     def watch(self, line):
         """
         Inspects line searching for the different patterns. If a match
         is found, try to emit the corresponding signal.
 
+        Since no pattern spans more than one line, a batch of lines joined
+        by newlines can be inspected at once.
+
         :param line: a line of openvpn output
         :type line: str
+
+        :returns: the events found in the line, in order of appearance.
+        :rtype: list of str
         """
-        chained_iter = chain(*[
-            zip(repeat(key, len(l)), l)
-            for key, l in self._events.iteritems()])
-        for event, pattern in chained_iter:
-            if pattern in line:
-                logger.debug('pattern matched! %s' % pattern)
-                break
-        else:
-            return
+        events = []
+        for pattern in self._matcher.findall(line):
+            event = self._pattern_events[pattern]
+            if event in events:
+                continue
+            logger.debug('pattern matched! %s' % pattern)
+            events.append(event)
 
-        sig = self._get_signal(event)
-        if sig:
-            sig.emit()
-            return
-        else:
-            logger.debug(
-                'We got %s event from openvpn output but we '
-                'could not find a matching signal for it.'
-                % event)
+            sig = self._get_signal(event)
+            if sig:
+                sig.emit()
+            else:
+                logger.debug(
+                    'We got %s event from openvpn output but we '
+                    'could not find a matching signal for it.'
+                    % event)
+        return events
 
     def _get_signal(self, event):
         """
@@ -146,6 +227,9 @@ class VPNObserver(object):
         return getattr(self._qtsigs, event.lower(), None)
 
 
+VPNObserver._compile_patterns()
+
+
 class OpenVPNAlreadyRunning(Exception):
     message = ("Another openvpn instance is already running, and could "
                "not be stopped.")
@@ -166,8 +250,9 @@ class VPN(object):
     opened by the openvpn process, executing commands over that interface on
     demand.
     """
-    TERMINATE_MAXTRIES = 10
-    TERMINATE_WAIT = 1  # secs
+    # Timers, in secs
+    TERMINATE_TIMEOUT = 10
+    TERMINATE_WAIT = 1
 
     OPENVPN_VERB = "openvpn_verb"
 
@@ -179,10 +264,14 @@ class VPN(object):
         """
         from twisted.internet import reactor
         self._vpnproc = None
-        self._pollers = []
         self._reactor = reactor
         self._qtsigs = VPNSignals()
 
+        # Look for instances left behind by a previous run while we are
+        # idle, so we do not have to walk the process table on start.
+        self._process_tracker = OpenVPNProcessTracker()
+        self._process_tracker.scan_in_thread()
+
         # XXX should get it from config.flags
         self._openvpn_verb = kwargs.get(self.OPENVPN_VERB, None)
 
@@ -194,117 +283,171 @@ class VPN(object):
         """
         Starts the openvpn subprocess.
 
+        We first look for instances left running, without blocking the
+        reactor, and try to stop them.
+
         :param args: args to be passed to the VPNProcess
         :type args: tuple
 
         :param kwargs: kwargs to be passed to the VPNProcess
         :type kwargs: dict
+
+        :returns: a deferred that fires once openvpn is spawned, or fails
+                  with the exception that kept us from doing it.
+        :rtype: twisted.internet.defer.Deferred
         """
-        self._stop_pollers()
         kwargs['qtsigs'] = self.qtsigs
         kwargs['openvpn_verb'] = self._openvpn_verb
+        kwargs['process_tracker'] = self._process_tracker
 
         # start the main vpn subprocess
-        vpnproc = VPNProcess(*args, **kwargs)
-                             #qtsigs=self.qtsigs,
-                             #openvpn_verb=self._openvpn_verb)
+        try:
+            vpnproc = VPNProcess(*args, **kwargs)
+        except Exception:
+            # the launcher might not be available
+            return defer.fail()
 
-        if vpnproc.get_openvpn_process():
+        d = vpnproc.get_openvpn_process()
+        d.addCallback(self._stop_if_running, vpnproc)
+        d.addCallback(lambda _: self._spawn(vpnproc))
+        return d
+
+    def _stop_if_running(self, process, vpnproc):
+        """
+        Callback for start, stops the openvpn instance found running.
+
+        :param process: the running instance, if any.
+        :type process: psutil.Process or None
+        :param vpnproc: the process we are about to spawn.
+        :type vpnproc: VPNProcess
+
+        :rtype: twisted.internet.defer.Deferred or None
+        """
+        if process is not None:
             logger.info("Another vpn process is running. Will try to stop it.")
-            vpnproc.stop_if_already_running()
+            return vpnproc.stop_if_already_running()
+
+    def _spawn(self, vpnproc):
+        """
+        Spawns the openvpn subprocess.
 
+        :param vpnproc: the process to spawn.
+        :type vpnproc: VPNProcess
+        """
         cmd = vpnproc.getCommand()
         env = os.environ
         for key, val in vpnproc.vpn_env.items():
             env[key] = val
 
+        # There is no need to poll for the status and state, the
+        # VPNProcess subscribes to the notifications pushed by the
+        # management interface once it connects to it.
         self._reactor.spawnProcess(vpnproc, cmd[0], cmd, env)
         self._vpnproc = vpnproc
 
-        # add pollers for status and state
-        # this could be extended to a collection of
-        # generic watchers
-
-        poll_list = [LoopingCall(vpnproc.pollStatus),
-                     LoopingCall(vpnproc.pollState)]
-        self._pollers.extend(poll_list)
-        self._start_pollers()
-
-    def _kill_if_left_alive(self, tries=0):
+    def _kill_if_left_alive(self, vpnproc, ended):
         """
-        Check if the process is still alive, and sends a
-        SIGKILL after a timeout period.
+        Sends a SIGKILL to a process that did not die after a SIGTERM, and
+        stops waiting for it if that does not work either.
 
-        :param tries: counter of tries, used in recursion
-        :type tries: int
+        :param vpnproc: the process to kill.
+        :type vpnproc: VPNProcess
+        :param ended: the deferred that fires when the process ends.
+        :type ended: twisted.internet.defer.Deferred
         """
-        from twisted.internet import reactor
-        while tries < self.TERMINATE_MAXTRIES:
-            if self._vpnproc.transport.pid is None:
-                logger.debug("Process has been happily terminated.")
-                return
-            else:
-                logger.debug("Process did not die, waiting...")
-            tries += 1
-            reactor.callLater(self.TERMINATE_WAIT,
-                              self._kill_if_left_alive, tries)
-            return
-
         # after running out of patience, we try a killProcess
         logger.debug("Process did not died. Sending a SIGKILL.")
         try:
-            self.killit()
+            vpnproc.aborted = True
+            vpnproc.killProcess()
         except OSError:
             logger.error("Could not kill process!")
 
+        give_up = self._reactor.callLater(
+            self.TERMINATE_WAIT, self._stop_waiting, ended)
+        ended.addBoth(self._cancel_delayed, give_up)
+
+    def _stop_waiting(self, ended):
+        """
+        Fires the deferred of a process that we could not kill, so the
+        callers do not wait forever.
+
+        :param ended: the deferred that fires when the process ends.
+        :type ended: twisted.internet.defer.Deferred
+        """
+        if not ended.called:
+            logger.warning("Process did not die, giving up waiting for it.")
+            ended.callback(None)
+
+    def _cancel_delayed(self, result, delayed):
+        """
+        Callback that cancels a delayed call if it did not run yet.
+
+        :param result: the result of the previous callback, passed along.
+        :param delayed: the delayed call to cancel.
+        :type delayed: twisted.internet.interfaces.IDelayedCall
+        """
+        if delayed.active():
+            delayed.cancel()
+        return result
+
+    def get_output_tail(self):
+        """
+        Returns the last lines written by the openvpn process, so we can
+        inspect what happened without going through the log files.
+
+        :rtype: list of str
+        """
+        if self._vpnproc is None:
+            return []
+        return self._vpnproc.get_output_tail()
+
     def killit(self):
         """
         Sends a kill signal to the process.
         """
-        self._stop_pollers()
         self._vpnproc.aborted = True
         self._vpnproc.killProcess()
 
-    def terminate(self, shutdown=False):
+    def terminate(self, shutdown=False, timeout=None):
         """
         Stops the openvpn subprocess.
 
         Attempts to send a SIGTERM first, and after a timeout
         it sends a SIGKILL.
-        """
-        from twisted.internet import reactor
-        self._stop_pollers()
 
-        # First we try to be polite and send a SIGTERM...
-        if self._vpnproc:
-            self._sentterm = True
-            self._vpnproc.terminate_openvpn(shutdown=shutdown)
+        :param shutdown: whether we are shutting down the app, in which
+                         case we also remove the temporal files.
+        :type shutdown: bool
+        :param timeout: seconds to wait for the process to end before
+                        sending the SIGKILL, TERMINATE_TIMEOUT if None.
+        :type timeout: float
 
-            # ...but we also trigger a countdown to be unpolite
-            # if strictly needed.
+        :returns: a deferred that fires when the process has ended, or
+                  when we gave up waiting for it.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        vpnproc = self._vpnproc
+        if vpnproc is None:
+            return defer.succeed(None)
 
-            # XXX Watch out! This will fail NOW since we are running
-            # openvpn as root as a workaround for some connection issues.
-            reactor.callLater(
-                self.TERMINATE_WAIT, self._kill_if_left_alive)
+        if timeout is None:
+            timeout = self.TERMINATE_TIMEOUT
+        ended = vpnproc.wait_for_end()
 
-    def _start_pollers(self):
-        """
-        Iterate through the registered observers
-        and start the looping call for them.
-        """
-        for poller in self._pollers:
-            poller.start(VPNManager.POLL_TIME)
+        # First we try to be polite and send a SIGTERM...
+        self._sentterm = True
+        vpnproc.terminate_openvpn(shutdown=shutdown)
 
-    def _stop_pollers(self):
-        """
-        Iterate through the registered observers
-        and stop the looping calls if they are running.
-        """
-        for poller in self._pollers:
-            if poller.running:
-                poller.stop()
-        self._pollers = []
+        # ...but we also trigger a countdown to be unpolite
+        # if strictly needed.
+
+        # XXX Watch out! This will fail NOW since we are running
+        # openvpn as root as a workaround for some connection issues.
+        kill = self._reactor.callLater(
+            timeout, self._kill_if_left_alive, vpnproc, ended)
+        ended.addBoth(self._cancel_delayed, kill)
+        return ended
 
 
 class VPNManager(object):
@@ -322,11 +465,10 @@ class VPNManager(object):
     """
 
     # Timers, in secs
-    # NOTE: We need to set a bigger poll time in OSX because it seems
+    # NOTE: We need to set a bigger interval in OSX because it seems
     # openvpn malfunctions when you ask it a lot of things in a short
     # amount of time.
-    POLL_TIME = 2.5 if IS_MAC else 1.0
-    CONNECTION_RETRY_TIME = 1
+    BYTECOUNT_INTERVAL = 3 if IS_MAC else 1
 
     TS_KEY = "ts"
     STATUS_STEP_KEY = "status_step"
@@ -334,23 +476,24 @@ class VPNManager(object):
     IP_KEY = "ip"
     REMOTE_KEY = "remote"
 
-    TUNTAP_READ_KEY = "tun_tap_read"
-    TUNTAP_WRITE_KEY = "tun_tap_write"
-    TCPUDP_READ_KEY = "tcp_udp_read"
-    TCPUDP_WRITE_KEY = "tcp_udp_write"
-    AUTH_READ_KEY = "auth_read"
-
-    def __init__(self, qtsigs=None):
+    def __init__(self, qtsigs=None, process_tracker=None):
         """
         Initializes the VPNManager.
 
         :param qtsigs: a QObject containing the Qt signals used by the UI
                        to give feedback about state changes.
         :type qtsigs: QObject
+        :param process_tracker: the tracker used to find the running
+                                openvpn instances.
+        :type process_tracker: OpenVPNProcessTracker
         """
         from twisted.internet import reactor
         self._reactor = reactor
-        self._tn = None
+        if process_tracker is None:
+            process_tracker = OpenVPNProcessTracker()
+        self._process_tracker = process_tracker
+        self._management = None
+        self._connector = None
         self._qtsigs = qtsigs
         self._aborted = False
 
@@ -366,113 +509,68 @@ class VPNManager(object):
     def aborted(self, value):
         self._aborted = value
 
-    def _seek_to_eof(self):
-        """
-        Read as much as available. Position seek pointer to end of stream
-        """
-        try:
-            self._tn.read_eager()
-        except EOFError:
-            logger.debug("Could not read from socket. Assuming it died.")
-            return
-
-    def _send_command(self, command, until=b"END"):
+    def _send_command(self, command):
         """
-        Sends a command to the telnet connection and reads until END
-        is reached.
+        Sends a command to the management interface.
 
         :param command: command to send
         :type command: str
 
-        :param until: byte delimiter string for reading command output
-        :type until: byte str
-
-        :return: response read
-        :rtype: list
+        :returns: a deferred that fires with the lines of the response.
+        :rtype: twisted.internet.defer.Deferred
         """
-        leap_assert(self._tn, "We need a tn connection!")
+        leap_assert(self._management, "We need a management connection!")
+        d = self._management.sendCommand(command)
+        d.addErrback(self._command_err, command)
+        return d
 
-        try:
-            self._tn.write("%s\n" % (command,))
-            buf = self._tn.read_until(until, 2)
-            self._seek_to_eof()
-            blist = buf.split('\r\n')
-            if blist[-1].startswith(until):
-                del blist[-1]
-                return blist
-            else:
-                return []
+    def _command_err(self, failure, command):
+        """
+        Errback for the commands sent to the management interface.
 
-        except socket.error:
-            # XXX should get a counter and repeat only
-            # after mod X times.
-            logger.warning('socket error (command was: "%s")' % (command,))
-            self._close_management_socket(announce=False)
-            logger.debug('trying to connect to management again')
-            self.try_to_connect_to_management(max_retries=5)
-            return []
+        :param failure: the failure that triggered the errback.
+        :type failure: twisted.python.failure.Failure
+        :param command: the command that failed.
+        :type command: str
 
-        # XXX should move this to a errBack!
-        except Exception as e:
-            logger.warning("Error sending command %s: %r" %
-                           (command, e))
+        :returns: an empty response.
+        :rtype: list
+        """
+        logger.warning("Error sending command %s: %r" %
+                       (command, failure.value))
         return []
 
-    def _close_management_socket(self, announce=True):
-        """
-        Close connection to openvpn management interface.
+    def _get_connector(self):
         """
-        logger.debug('closing socket')
-        if announce:
-            self._tn.write("quit\n")
-            self._tn.read_all()
-        self._tn.get_socket().close()
-        self._tn = None
+        Returns the connector for the management interface of our
+        openvpn process, creating it if needed.
 
-    def _connect_management(self, socket_host, socket_port):
+        :rtype: ManagementConnector
         """
-        Connects to the management interface on the specified
-        socket_host socket_port.
-
-        :param socket_host: either socket path (unix) or socket IP
-        :type socket_host: str
-
-        :param socket_port: either string "unix" if it's a unix
-                            socket, or port otherwise
-        :type socket_port: str
-        """
-        if self.is_connected():
-            self._close_management_socket()
-
-        try:
-            self._tn = UDSTelnet(socket_host, socket_port)
-
+        if self._connector is None:
             # XXX make password optional
             # specially for win. we should generate
             # the pass on the fly when invoking manager
             # from conductor
+            endpoint = get_management_endpoint(
+                self._reactor, self._socket_host, self._socket_port)
+            factory = ManagementFactory(
+                self, bytecount_interval=self.BYTECOUNT_INTERVAL)
+            self._connector = ManagementConnector(
+                endpoint, factory, self._reactor)
+        return self._connector
 
-            # self.tn.read_until('ENTER PASSWORD:', 2)
-            # self.tn.write(self.password + '\n')
-            # self.tn.read_until('SUCCESS:', 2)
-            if self._tn:
-                self._tn.read_eager()
-
-        # XXX move this to the Errback
-        except Exception as e:
-            logger.warning("Could not connect to OpenVPN yet: %r" % (e,))
-            self._tn = None
-
-    def _connectCb(self, *args):
+    def _connectCb(self, management):
         """
         Callback for connection.
 
-        :param args: not used
+        :param management: the connected management protocol.
+        :type management: ManagementProtocol
         """
-        if self._tn:
-            logger.info('Connected to management')
-        else:
-            logger.debug('Cannot connect to management...')
+        self._management = management
+        logger.info('Connected to management')
+        # We might have missed some state changes before connecting.
+        self.get_state()
 
     def _connectErr(self, failure):
         """
@@ -480,24 +578,12 @@ class VPNManager(object):
 
         :param failure: Failure
         """
-        logger.warning(failure)
-
-    def connect_to_management(self, host, port):
-        """
-        Connect to a management interface.
-
-        :param host: the host of the management interface
-        :type host: str
-
-        :param port: the port of the management interface
-        :type port: str
-
-        :returns: a deferred
-        """
-        self.connectd = defer.maybeDeferred(
-            self._connect_management, host, port)
-        self.connectd.addCallbacks(self._connectCb, self._connectErr)
-        return self.connectd
+        if failure.check(defer.CancelledError):
+            logger.debug('Stopped trying to connect to management.')
+            return
+        logger.warning("Could not connect to management: %r. Aborting." %
+                       (failure.value,))
+        self.aborted = True
 
     def is_connected(self):
         """
@@ -506,38 +592,86 @@ class VPNManager(object):
         :returns: True if connected, False otherwise
         :rtype: bool
         """
-        return True if self._tn else False
+        return True if self._management else False
 
-    def try_to_connect_to_management(self, retry=0, max_retries=None):
+    def try_to_connect_to_management(self, max_retries=None):
         """
-        Attempts to connect to a management interface, and retries
-        after CONNECTION_RETRY_TIME if not successful.
+        Attempts to connect to a management interface, and retries with
+        an increasing delay if not successful.
 
-        :param retry: number of the retry
-        :type retry: int
-        """
-        if max_retries and retry > max_retries:
-            logger.warning("Max retries reached while attempting to connect "
-                           "to management. Aborting.")
-            self.aborted = True
-            return
+        If we are already trying to connect, this does nothing.
 
+        :param max_retries: how many times to retry, None to retry until
+                            the process dies.
+        :type max_retries: int
+        """
         # _alive flag is set in the VPNProcess class.
         if not self._alive:
             logger.debug('Tried to connect to management but process is '
                          'not alive.')
             return
+        if self.aborted or self.is_connected():
+            return
+
+        connector = self._get_connector()
+        if connector.connecting:
+            logger.debug('Already trying to connect to management.')
+            return
+
         logger.debug('trying to connect to management')
-        if not self.aborted and not self.is_connected():
-            self.connect_to_management(self._socket_host, self._socket_port)
-            self._reactor.callLater(
-                self.CONNECTION_RETRY_TIME,
-                self.try_to_connect_to_management, retry + 1)
+        d = connector.connect(max_retries=max_retries)
+        d.addCallbacks(self._connectCb, self._connectErr)
+
+    # management notifications
+
+    def management_state_received(self, state_line):
+        """
+        Called by the management protocol with the payload of each
+        >STATE: notification.
+
+        :param state_line: the comma separated state fields.
+        :type state_line: str
+        """
+        self._parse_state_and_notify([state_line])
+
+    def management_bytecount_received(self, bytes_in, bytes_out):
+        """
+        Called by the management protocol with the payload of each
+        >BYTECOUNT: notification.
+
+        :param bytes_in: total bytes read from the tcp/udp link.
+        :type bytes_in: int
+        :param bytes_out: total bytes written to the tcp/udp link.
+        :type bytes_out: int
+        """
+        self._parse_bytecount_and_notify(bytes_in, bytes_out)
+
+    def management_connection_lost(self, management, reason):
+        """
+        Called by the management protocol when the connection is lost.
+
+        If we did not close it ourselves and the process is still alive,
+        we try to connect again.
+
+        :param management: the protocol that lost its connection.
+        :type management: ManagementProtocol
+        :param reason: the reason for the disconnection.
+        :type reason: twisted.python.failure.Failure
+        """
+        if management is not self._management:
+            # we closed it on purpose.
+            return
+        logger.warning('management connection lost: %r' % (reason.value,))
+        self._management = None
+        if self._alive:
+            logger.debug('trying to connect to management again')
+            self.try_to_connect_to_management(max_retries=5)
 
     def _parse_state_and_notify(self, output):
         """
-        Parses the output of the state command and emits state_changed
-        signal when the state changes.
+        Parses the output of the state command (or the payload of the
+        >STATE: notifications) and emits state_changed signal when the
+        state changes.
 
         :param output: list of lines that the state command printed as
                        its output
@@ -550,7 +684,7 @@ class VPNManager(object):
             parts = stripped.split(",")
             if len(parts) < 5:
                 continue
-            ts, status_step, ok, ip, remote = parts
+            ts, status_step, ok, ip, remote = parts[:5]
 
             state_dict = {
                 self.TS_KEY: ts,
@@ -564,65 +698,37 @@ class VPNManager(object):
                 self.qtsigs.state_changed.emit(state_dict)
                 self._last_state = state_dict
 
-    def _parse_status_and_notify(self, output):
+    def _parse_bytecount_and_notify(self, bytes_in, bytes_out):
         """
-        Parses the output of the status command and emits
-        status_changed signal when the status changes.
+        Emits status_changed signal with the traffic counters pushed by
+        the >BYTECOUNT: notifications, if they changed.
 
-        :param output: list of lines that the status command printed
-                       as its output
-        :type output: list
+        :param bytes_in: total bytes read from the tcp/udp link.
+        :type bytes_in: int
+        :param bytes_out: total bytes written to the tcp/udp link.
+        :type bytes_out: int
         """
-        tun_tap_read = ""
-        tun_tap_write = ""
-        tcp_udp_read = ""
-        tcp_udp_write = ""
-        auth_read = ""
-        for line in output:
-            stripped = line.strip()
-            if stripped.endswith("STATISTICS") or stripped == "END":
-                continue
-            parts = stripped.split(",")
-            if len(parts) < 2:
-                continue
-            if parts[0].strip() == "TUN/TAP read bytes":
-                tun_tap_read = parts[1]
-            elif parts[0].strip() == "TUN/TAP write bytes":
-                tun_tap_write = parts[1]
-            elif parts[0].strip() == "TCP/UDP read bytes":
-                tcp_udp_read = parts[1]
-            elif parts[0].strip() == "TCP/UDP write bytes":
-                tcp_udp_write = parts[1]
-            elif parts[0].strip() == "Auth read bytes":
-                auth_read = parts[1]
-
-        status_dict = {
-            self.TUNTAP_READ_KEY: tun_tap_read,
-            self.TUNTAP_WRITE_KEY: tun_tap_write,
-            self.TCPUDP_READ_KEY: tcp_udp_read,
-            self.TCPUDP_WRITE_KEY: tcp_udp_write,
-            self.AUTH_READ_KEY: auth_read
-        }
-
-        if status_dict != self._last_status:
-            self.qtsigs.status_changed.emit(status_dict)
-            self._last_status = status_dict
+        last = self._last_status
+        if (last is not None and
+                last.bytes_in == bytes_in and last.bytes_out == bytes_out):
+            return
+
+        status = TrafficCounters.from_totals(bytes_in, bytes_out, last)
+        self.qtsigs.status_changed.emit(status)
+        self._last_status = status
 
     def get_state(self):
         """
         Notifies the gui of the output of the state command over
         the openvpn management interface.
-        """
-        if self.is_connected():
-            return self._parse_state_and_notify(self._send_command("state"))
 
-    def get_status(self):
-        """
-        Notifies the gui of the output of the status command over
-        the openvpn management interface.
+        :returns: a deferred that fires once the output is parsed.
+        :rtype: twisted.internet.defer.Deferred
         """
         if self.is_connected():
-            return self._parse_status_and_notify(self._send_command("status"))
+            d = self._send_command("state")
+            d.addCallback(self._parse_state_and_notify)
+            return d
 
     @property
     def vpn_env(self):
@@ -660,42 +766,61 @@ class VPNManager(object):
         """
         Looks for openvpn instances running.
 
-        :rtype: process
+        :returns: a deferred that fires with the process found, or None.
+        :rtype: twisted.internet.defer.Deferred
         """
-        openvpn_process = None
-        for p in psutil.process_iter():
-            try:
-                # XXX Not exact!
-                # Will give false positives.
-                # we should check that cmdline BEGINS
-                # with openvpn or with our wrapper
-                # (pkexec / osascript / whatever)
-
-                # This needs more work, see #3268, but for the moment
-                # we need to be able to filter out arguments in the form
-                # --openvpn-foo, since otherwise we are shooting ourselves
-                # in the feet.
-                if any(map(lambda s: s.find("LEAPOPENVPN") != -1, p.cmdline)):
-                    openvpn_process = p
-                    break
-            except psutil_AccessDenied:
-                pass
-        return openvpn_process
+        return self._process_tracker.find()
+
+    def _terminate_stale_openvpn(self, host, port):
+        """
+        Sends a SIGTERM through the management interface of an openvpn
+        instance that we did not spawn in this session.
+
+        This is done in a blocking way, since we need the old process to
+        be gone before we can launch a new one.
+
+        :param host: either socket path (unix) or socket IP
+        :type host: str
+        :param port: either string "unix" if it's a unix socket, or port
+                     otherwise
+        :type port: str
+        """
+        tn = UDSTelnet(host, port)
+        try:
+            tn.write("signal SIGTERM\n")
+            tn.read_until("SUCCESS:", 2)
+            tn.write("quit\n")
+            tn.read_all()
+        finally:
+            tn.close()
 
     def stop_if_already_running(self):
         """
         Checks if VPN is already running and tries to stop it.
 
-        Might raise OpenVPNAlreadyRunning.
+        :returns: a deferred that fires with True if stopped, False
+                  otherwise. It might fail with OpenVPNAlreadyRunning or
+                  AlienOpenVPNAlreadyRunning.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        d = self.get_openvpn_process()
+        d.addCallback(self._stop_running)
+        return d
+
+    def _stop_running(self, process):
+        """
+        Callback for stop_if_already_running, tries to stop the instance
+        found running.
 
-        :return: True if stopped, False otherwise
+        :param process: the running instance, if any.
+        :type process: psutil.Process or None
 
+        :rtype: twisted.internet.defer.Deferred or bool
         """
-        process = self.get_openvpn_process()
         if not process:
             logger.debug('Could not find openvpn process while '
                          'trying to stop it.')
-            return
+            return False
 
         logger.debug("OpenVPN is already running, trying to stop it...")
         cmdline = process.cmdline
@@ -719,7 +844,6 @@ class VPNManager(object):
                 port = cmdline[index + 2]
                 logger.debug("Trying to connect to %s:%s"
                              % (host, port))
-                self.connect_to_management(host, port)
 
                 # XXX this has a problem with connections to different
                 # remotes. So the reconnection will only work when we are
@@ -728,15 +852,26 @@ class VPNManager(object):
                 # provider, we will get:
                 # TLS Error: local/remote TLS keys are out of sync
                 # However, that should be a rare case right now.
-                self._send_command("signal SIGTERM")
-                self._close_management_socket(announce=True)
+                self._terminate_stale_openvpn(host, port)
             except Exception as e:
                 logger.warning("Problem trying to terminate OpenVPN: %r"
                                % (e,))
         else:
             logger.debug("Could not find the expected openvpn command line.")
 
-        process = self.get_openvpn_process()
+        d = self.get_openvpn_process()
+        d.addCallback(self._check_stopped)
+        return d
+
+    def _check_stopped(self, process):
+        """
+        Callback for _stop_running, checks that the instance is gone.
+
+        :param process: the instance still running, if any.
+        :type process: psutil.Process or None
+
+        :rtype: bool
+        """
         if process is None:
             logger.debug("Successfully finished already running "
                          "openvpn process.")
@@ -753,8 +888,13 @@ class VPNProcess(protocol.ProcessProtocol, VPNManager):
     programmatically.
     """
 
+    # openvpn output framing
+    DELIMITER = '\n'
+    MAX_LINE_LENGTH = 16384
+    OUTPUT_TAIL_SIZE = 500
+
     def __init__(self, eipconfig, providerconfig, socket_host, socket_port,
-                 qtsigs, openvpn_verb):
+                 qtsigs, openvpn_verb, process_tracker=None):
         """
         :param eipconfig: eip configuration object
         :type eipconfig: EIPConfig
@@ -776,8 +916,13 @@ class VPNProcess(protocol.ProcessProtocol, VPNManager):
         :param openvpn_verb: the desired level of verbosity in the
                              openvpn invocation
         :type openvpn_verb: int
+
+        :param process_tracker: the tracker used to find the running
+                                openvpn instances.
+        :type process_tracker: OpenVPNProcessTracker
         """
-        VPNManager.__init__(self, qtsigs=qtsigs)
+        VPNManager.__init__(self, qtsigs=qtsigs,
+                            process_tracker=process_tracker)
         leap_assert_type(eipconfig, EIPConfig)
         leap_assert_type(providerconfig, ProviderConfig)
         leap_assert_type(qtsigs, QtCore.QObject)
@@ -794,6 +939,11 @@ class VPNProcess(protocol.ProcessProtocol, VPNManager):
         self._last_state = None
         self._last_status = None
         self._alive = False
+        self._pid = None
+
+        self._ended = False
+        self._exit_code = None
+        self._end_waiters = []
 
         # XXX use flags, maybe, instead of passing
         # the parameter around.
@@ -801,6 +951,11 @@ class VPNProcess(protocol.ProcessProtocol, VPNManager):
 
         self._vpn_observer = VPNObserver(qtsigs)
 
+        # partial line kept between outReceived calls
+        self._out_buffer = ''
+        # last lines of openvpn output, for post-mortem inspection
+        self._output_tail = deque(maxlen=self.OUTPUT_TAIL_SIZE)
+
     # processProtocol methods
 
     def connectionMade(self):
@@ -811,6 +966,8 @@ class VPNProcess(protocol.ProcessProtocol, VPNManager):
         """
         self._alive = True
         self.aborted = False
+        self._pid = self.transport.pid
+        self._process_tracker.track(self._pid)
         self.try_to_connect_to_management(max_retries=10)
 
     def outReceived(self, data):
@@ -821,10 +978,50 @@ class VPNProcess(protocol.ProcessProtocol, VPNManager):
 
         .. seeAlso: `http://twistedmatrix.com/documents/13.0.0/api/twisted.internet.protocol.ProcessProtocol.html` # noqa
         """
-        # truncate the newline
-        line = data[:-1]
-        vpnlog.info(line)
-        self._vpn_observer.watch(line)
+        # The data we get is not aligned with the lines openvpn writes, a
+        # chunk can carry several lines or just part of one. Like a
+        # LineReceiver we keep the trailing partial line for the next
+        # call, but we hand all the complete lines at once.
+        lines = (self._out_buffer + data).split(self.DELIMITER)
+        self._out_buffer = lines.pop()
+        if len(self._out_buffer) > self.MAX_LINE_LENGTH:
+            lines.append(self._out_buffer)
+            self._out_buffer = ''
+        if lines:
+            self._lines_received(lines)
+
+    def outConnectionLost(self):
+        """
+        Called when the stdout of the process is closed. Flushes the
+        last partial line, if any.
+
+        .. seeAlso: `http://twistedmatrix.com/documents/13.0.0/api/twisted.internet.protocol.ProcessProtocol.html` # noqa
+        """
+        if self._out_buffer:
+            lines, self._out_buffer = [self._out_buffer], ''
+            self._lines_received(lines)
+
+    def _lines_received(self, lines):
+        """
+        Logs and inspects a batch of complete lines of openvpn output.
+
+        :param lines: the lines, without the delimiter.
+        :type lines: list of str
+        """
+        lines = [line.rstrip('\r') for line in lines]
+        for line in lines:
+            vpnlog.info(line)
+        self._output_tail.extend(lines)
+        self._vpn_observer.watch(self.DELIMITER.join(lines))
+
+    def get_output_tail(self):
+        """
+        Returns the last lines written by openvpn, up to
+        OUTPUT_TAIL_SIZE.
+
+        :rtype: list of str
+        """
+        return list(self._output_tail)
 
     def processExited(self, reason):
         """
@@ -837,6 +1034,8 @@ class VPNProcess(protocol.ProcessProtocol, VPNManager):
             logger.debug("processExited, status %d" % (exit_code,))
         self.qtsigs.process_finished.emit(exit_code)
         self._alive = False
+        if self._connector is not None:
+            self._connector.stop()
 
     def processEnded(self, reason):
         """
@@ -848,22 +1047,27 @@ class VPNProcess(protocol.ProcessProtocol, VPNManager):
         exit_code = reason.value.exitCode
         if isinstance(exit_code, int):
             logger.debug("processEnded, status %d" % (exit_code,))
+        self._process_tracker.untrack(self._pid)
 
-    # polling
+        self._ended = True
+        self._exit_code = exit_code
+        waiters, self._end_waiters = self._end_waiters, []
+        for d in waiters:
+            if not d.called:
+                d.callback(exit_code)
 
-    def pollStatus(self):
-        """
-        Polls connection status.
+    def wait_for_end(self):
         """
-        if self._alive:
-            self.get_status()
+        Returns a deferred that fires with the exit code once the process
+        has ended and all its file descriptors are closed.
 
-    def pollState(self):
-        """
-        Polls connection state.
+        :rtype: twisted.internet.defer.Deferred
         """
-        if self._alive:
-            self.get_state()
+        if self._ended:
+            return defer.succeed(self._exit_code)
+        d = defer.Deferred()
+        self._end_waiters.append(d)
+        return d
 
     # launcher
 
@@ -33,6 +33,7 @@ from pysqlcipher.dbapi2 import ProgrammingError as sqlcipher_ProgrammingError
 
 from leap.bitmask.config import flags
 from leap.bitmask.config.providerconfig import ProviderConfig
+from leap.bitmask.crypto import authsession
 from leap.bitmask.crypto.srpauth import SRPAuth
 from leap.bitmask.services import download_service_config
 from leap.bitmask.services.abstractbootstrapper import AbstractBootstrapper
@@ -181,6 +182,8 @@ class SoledadBootstrapper(AbstractBootstrapper):
 
     def cancel_bootstrap(self):
         self._soledad_retries = self.MAX_INIT_RETRIES
+        # the session is over, stop handing its tokens to soledad
+        authsession.remove_listener(self._set_token)
 
     def should_retry_initialization(self):
         """
@@ -343,6 +346,7 @@ class SoledadBootstrapper(AbstractBootstrapper):
         """
         # and now, let's sync
         sync_tries = self.MAX_SYNC_RETRIES
+        token_refreshed = False
         while sync_tries > 0:
             try:
                 self._try_soledad_sync()
@@ -360,6 +364,14 @@ class SoledadBootstrapper(AbstractBootstrapper):
                 sync_tries -= 1
                 continue
             except InvalidAuthTokenError:
+                # the token expired, try once more with a new one before
+                # giving up
+                if not token_refreshed:
+                    token_refreshed = True
+                    token = authsession.refresh_token()
+                    if token is not None:
+                        self._set_token(token)
+                        continue
                 self.soledad_invalid_auth_token.emit()
                 raise
             except Exception as e:
@@ -564,6 +576,9 @@ class SoledadBootstrapper(AbstractBootstrapper):
             raise
 
         if flags.OFFLINE is False:
+            # keep using a valid token after it is refreshed
+            authsession.add_listener(self._set_token)
+
             # make sure key is in server
             logger.debug('Trying to send key to server...')
             try:
@@ -576,6 +591,19 @@ class SoledadBootstrapper(AbstractBootstrapper):
                 logger.exception(exc)
                 # but we do not raise
 
+    def _set_token(self, token):
+        """
+        Makes soledad and the keymanager use a new auth token.
+
+        :param token: the auth token for accessing webapp.
+        :type token: str
+        """
+        logger.debug("Using the refreshed auth token")
+        if not sameProxiedObjects(self._soledad, None):
+            self._soledad.token = token
+        if self._keymanager is not None:
+            self._keymanager.token = token
+
     def _gen_key(self, _):
         """
         Generates the key pair if needed, uploads it to the webapp and
@@ -44,6 +44,9 @@ class TesterBootstrapper(AbstractBootstrapper):
     def _second_check_that_passes(self, *args):
         pass
 
+    def _third_check_that_passes(self, *args):
+        pass
+
     def _check_that_fails(self, *args):
         raise Exception(self.ERROR_MSG)
 
@@ -82,6 +85,24 @@ class TesterBootstrapper(AbstractBootstrapper):
         ]
         return self.addCallbackChain(cb_chain)
 
+    def run_graph_checks_pass(self):
+        cb_graph = [
+            (self._check_that_passes, self.test_signal1, []),
+            (self._second_check_that_passes, self.test_signal2, []),
+            (self._third_check_that_passes, self.test_signal3,
+             [self._check_that_passes, self._second_check_that_passes]),
+        ]
+        return self.addCallbackGraph(cb_graph)
+
+    def run_graph_checks_fail(self):
+        cb_graph = [
+            (self._check_that_passes, self.test_signal1, []),
+            (self._check_that_fails, self.test_signal2, []),
+            (self._second_check_that_passes, self.test_signal3,
+             [self._check_that_fails]),
+        ]
+        return self.addCallbackGraph(cb_graph)
+
 
 class AbstractBootstrapperTest(UsesQApplication, BasicPySlotCase):
     def setUp(self):
@@ -195,3 +216,62 @@ class AbstractBootstrapperTest(UsesQApplication, BasicPySlotCase):
     def test_sucess_without_signal(self):
         d = self.tbt.run_second_checks_pass()
         return d
+
+    @deferred()
+    def test_graph_all_checks_executed_once(self):
+        self.tbt._check_that_passes = mock.MagicMock()
+        self.tbt._second_check_that_passes = mock.MagicMock()
+        self.tbt._third_check_that_passes = mock.MagicMock()
+
+        d = self.tbt.run_graph_checks_pass()
+
+        def check(*args):
+            self.tbt._check_that_passes.assert_called_once_with()
+            self.tbt._second_check_that_passes.assert_called_once_with()
+            self.tbt._third_check_that_passes.assert_called_once_with()
+
+        d.addCallback(check)
+        return d
+
+    @deferred()
+    def test_graph_emits_correct(self):
+        self.tbt.test_signal1.connect(self.cb1)
+        self.tbt.test_signal2.connect(self.cb2)
+        d = self.tbt.run_graph_checks_pass()
+
+        self.args1 = [{
+            AbstractBootstrapper.PASSED_KEY: True,
+            AbstractBootstrapper.ERROR_KEY: ""
+        }]
+
+        self.args2 = self.args1
+
+        d.addCallback(self._check_cb12_once)
+        return d
+
+    @deferred()
+    def test_graph_emits_failed_and_stops(self):
+        self.tbt._second_check_that_passes = mock.MagicMock()
+        self.tbt.test_signal1.connect(self.cb1)
+        self.tbt.test_signal2.connect(self.cb2)
+        self.tbt.test_signal3.connect(self.cb1)
+        d = self.tbt.run_graph_checks_fail()
+
+        self.args1 = [{
+            AbstractBootstrapper.PASSED_KEY: True,
+            AbstractBootstrapper.ERROR_KEY: ""
+        }]
+
+        self.args2 = [{
+            AbstractBootstrapper.PASSED_KEY: False,
+            AbstractBootstrapper.ERROR_KEY:
+            TesterBootstrapper.ERROR_MSG
+        }]
+
+        def check(*args):
+            self._check_cb12_once()
+            # depends on the failed check
+            self.assertFalse(self.tbt._second_check_that_passes.called)
+
+        d.addCallback(check)
+        return d
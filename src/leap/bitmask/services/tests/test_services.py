@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# test_services.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the download of the service definitions
+"""
+import json
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from leap.bitmask import services
+from leap.bitmask.services import download_service_config
+from leap.bitmask.services.eip.eipconfig import EIPConfig
+
+EIP_DEFINITION = json.dumps({
+    "gateways": [{
+        "capabilities": {},
+        "host": "gateway.example.org",
+        "ip_address": "1.2.3.4",
+        "location": "earth",
+    }],
+    "serial": 1,
+    "version": 1,
+})
+
+
+class DownloadServiceConfigTest(unittest.TestCase):
+    """
+    Tests for the download_service_config function
+    """
+
+    def setUp(self):
+        services._loaded_configs.clear()
+        self.provider_config = mock.Mock()
+        self.provider_config.get_api_version.return_value = "1"
+        self.provider_config.get_api_uri.return_value = \
+            "https://api.example.org"
+        self.provider_config.get_domain.return_value = "example.org"
+        self.provider_config.get_ca_cert_path.return_value = "/ca.crt"
+
+        patcher = mock.patch.object(services, "SRPAuth")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(services.http_cache, "fetch")
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _download(self, modified, content=EIP_DEFINITION):
+        """
+        Downloads the EIP definition, as fetch returns it.
+
+        :rtype: EIPConfig
+        """
+        self.fetch.return_value = mock.Mock(
+            content=content, mtime=None, modified=modified)
+        config = EIPConfig()
+        with mock.patch.object(config, "save"):
+            download_service_config(self.provider_config, config,
+                                    mock.Mock())
+        return config
+
+    def test_unchanged_definition_is_not_loaded_again(self):
+        first = self._download(True)
+        with mock.patch.object(EIPConfig, "load") as load:
+            second = self._download(False)
+        self.assertFalse(load.called)
+        self.assertTrue(second.loaded())
+        self.assertEqual(second.get_gateways(), first.get_gateways())
+
+    def test_changed_definition_is_loaded(self):
+        self._download(True)
+        content = EIP_DEFINITION.replace("1.2.3.4", "5.6.7.8")
+        config = self._download(False, content)
+        self.assertEqual(config.get_gateways()[0]["ip_address"], "5.6.7.8")
+
+
+if __name__ == "__main__":
+    unittest.main()
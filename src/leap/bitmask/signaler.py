@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# signaler.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The parts of the signaler shared by the backend and the frontend.
+
+Nothing here depends on Qt, so the backend daemon and its wire protocol
+can use them. The Qt Signaler that emits the signals in the frontend is
+in leap.bitmask.backend.
+"""
+from collections import OrderedDict
+
+from twisted.internet import reactor
+from twisted.python import threadable
+
+from leap.bitmask.util import monotonic
+
+
+class SignalerKeys(object):
+    """
+    Keys for the signals the backend emits.
+
+    These will exist both in the backend AND the front end.
+    The frontend might choose to not "interpret" all the signals
+    from the backend, but the backend needs to have all the signals
+    it's going to emit defined here
+    """
+
+    PROV_NAME_RESOLUTION_KEY = "prov_name_resolution"
+    PROV_HTTPS_CONNECTION_KEY = "prov_https_connection"
+    PROV_DOWNLOAD_PROVIDER_INFO_KEY = "prov_download_provider_info"
+    PROV_DOWNLOAD_CA_CERT_KEY = "prov_download_ca_cert"
+    PROV_CHECK_CA_FINGERPRINT_KEY = "prov_check_ca_fingerprint"
+    PROV_CHECK_API_CERTIFICATE_KEY = "prov_check_api_certificate"
+    PROV_PROBLEM_WITH_PROVIDER_KEY = "prov_problem_with_provider"
+    PROV_UNSUPPORTED_CLIENT = "prov_unsupported_client"
+    PROV_UNSUPPORTED_API = "prov_unsupported_api"
+    PROV_CANCELLED_SETUP = "prov_cancelled_setup"
+    PROV_PREFETCHED = "prov_prefetched"
+
+    SRP_REGISTRATION_FINISHED = "srp_registration_finished"
+    SRP_REGISTRATION_FAILED = "srp_registration_failed"
+    SRP_REGISTRATION_TAKEN = "srp_registration_taken"
+
+    SIGNALS = (
+        PROV_NAME_RESOLUTION_KEY,
+        PROV_HTTPS_CONNECTION_KEY,
+        PROV_DOWNLOAD_PROVIDER_INFO_KEY,
+        PROV_DOWNLOAD_CA_CERT_KEY,
+        PROV_CHECK_CA_FINGERPRINT_KEY,
+        PROV_CHECK_API_CERTIFICATE_KEY,
+        PROV_PROBLEM_WITH_PROVIDER_KEY,
+        PROV_UNSUPPORTED_CLIENT,
+        PROV_UNSUPPORTED_API,
+        PROV_CANCELLED_SETUP,
+        PROV_PREFETCHED,
+
+        SRP_REGISTRATION_FINISHED,
+        SRP_REGISTRATION_FAILED,
+        SRP_REGISTRATION_TAKEN,
+    )
+
+
+class SignalCoalescer(object):
+    """
+    Collects the signals emitted during a frame and flushes them as a
+    single batch at its end.
+
+    Repeated signals with the same key within a frame are collapsed into
+    the latest one, in the position of the latest one, so the receiving
+    end does a bounded amount of work per frame no matter how chatty the
+    backend gets, and still sees the signals in the order they were last
+    sent.
+    """
+
+    # secs
+    FRAME = 0.016
+
+    def __init__(self, flush, reactor=reactor):
+        """
+        :param flush: called at the end of each frame with the list of
+                      (key, data) tuples signaled.
+        :type flush: callable
+        :param reactor: the reactor used to schedule the flushes.
+        :type reactor: twisted.internet.reactor
+        """
+        self._flush = flush
+        self._reactor = reactor
+        self._pending = OrderedDict()
+        self._delayed = None
+
+        self._started_at = monotonic()
+        # key -> [times signaled, times flushed]
+        self._counts = {}
+
+    def signal(self, key, data=None):
+        """
+        Queues a signal for the current frame. Can be called from any
+        thread.
+
+        :param key: string identifying the signal to emit
+        :type key: str
+        :param data: object to send with the data
+        :type data: object
+        """
+        if threadable.isInIOThread():
+            self._queue(key, data)
+        else:
+            self._reactor.callFromThread(self._queue, key, data)
+
+    def _queue(self, key, data):
+        # the latest occurrence decides the order
+        self._pending.pop(key, None)
+        self._pending[key] = data
+        self._counts.setdefault(key, [0, 0])[0] += 1
+        if self._delayed is None:
+            self._delayed = self._reactor.callLater(self.FRAME, self.flush)
+
+    def flush(self):
+        """
+        Flushes the signals queued so far.
+        """
+        if self._delayed is not None:
+            if self._delayed.active():
+                self._delayed.cancel()
+            self._delayed = None
+
+        if not self._pending:
+            return
+        batch = self._pending.items()
+        self._pending = OrderedDict()
+        for key, _ in batch:
+            self._counts[key][1] += 1
+        self._flush(batch)
+
+    def get_rates(self):
+        """
+        Returns how many times per second each signal was signaled and
+        flushed, since we started.
+
+        :returns: a dict of key -> (signaled rate, flushed rate)
+        :rtype: dict
+        """
+        elapsed = max(monotonic() - self._started_at, 1e-3)
+        return dict((key, (signaled / elapsed, flushed / elapsed))
+                    for key, (signaled, flushed) in self._counts.items())
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# test_backend.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the backend
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import ANY, Mock, patch
+from twisted.internet import defer
+from twisted.python import threadable
+
+from leap.bitmask.backend import Backend, Provider, ProviderPrefetch
+
+
+class FakeComponent(object):
+    """
+    Component whose commands are fired by the tests.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.calls = []
+
+    def command(self, *args):
+        d = defer.Deferred()
+        self.calls.append((args, d))
+        return d
+
+    other_command = register_user = command
+    setup_provider = bootstrap = command
+
+
+class BackendSchedulerTest(unittest.TestCase):
+    """
+    Tests for the scheduling of the Backend commands
+    """
+
+    def setUp(self):
+        threadable.registerAsIOThread()
+        self.backend = Backend(signaler=Mock())
+        self.provider = FakeComponent("provider")
+        self.register = FakeComponent("register")
+        self.backend._components = {"provider": self.provider,
+                                    "register": self.register}
+        self.backend.start()
+
+    def test_concurrency_limit(self):
+        self.backend._call("provider", "command", None, "a.org")
+        self.backend._call("provider", "command", None, "b.org")
+        self.assertEqual(len(self.provider.calls), 1)
+        self.provider.calls[0][1].callback(None)
+        self.assertEqual(len(self.provider.calls), 2)
+
+    def test_default_concurrency(self):
+        for i in range(3):
+            self.backend._call("register", "command", None, i)
+        self.assertEqual(len(self.register.calls),
+                         Backend.DEFAULT_CONCURRENCY)
+
+    def test_identical_commands_are_deduplicated(self):
+        self.backend._call("register", "command", None, "a.org")
+        self.backend._call("register", "command", None, "a.org")
+        self.assertEqual(len(self.register.calls), 1)
+        self.register.calls[0][1].callback(None)
+        self.backend._call("register", "command", None, "a.org")
+        self.assertEqual(len(self.register.calls), 2)
+
+    def test_private_commands_are_not_shared(self):
+        self.backend._call("register", "register_user", None,
+                           "a.org", "user", "secret")
+        self.backend._call("register", "register_user", None,
+                           "a.org", "user", "secret")
+        self.assertEqual(len(self.register.calls), 2)
+        for request in self.backend._ongoing["register"]:
+            self.assertNotIn("secret", request)
+
+    def test_failed_commands_are_forgotten(self):
+        with patch("leap.bitmask.backend.log.err") as log_err:
+            self.backend._call("register", "command", None, "a.org")
+            self.register.calls[0][1].errback(ValueError())
+        log_err.assert_called_once_with(ANY)
+        self.assertTrue(log_err.call_args[0][0].check(ValueError))
+
+        self.backend._call("register", "command", None, "a.org")
+        self.assertEqual(len(self.register.calls), 2)
+
+    def test_signal_back(self):
+        self.backend._call("register", "command", "done", "a.org")
+        self.register.calls[0][1].callback(None)
+        self.backend.signaler.signal.assert_called_once_with("done")
+
+    def test_cancel_component(self):
+        self.backend._call("provider", "command", None, "a.org")
+        self.backend._call("provider", "command", None, "b.org")
+        self.backend._call("register", "command", None, "a.org")
+        self.backend.cancel("provider")
+
+        running = self.provider.calls[0][1]
+        self.assertTrue(running.called)
+        # the waiting command never ran
+        self.assertEqual(len(self.provider.calls), 1)
+        self.assertFalse(self.register.calls[0][1].called)
+
+    def test_cancel_method(self):
+        self.backend.CONCURRENCY = {"provider": 2}
+        self.backend._call("provider", "command", None, "a.org")
+        self.backend._call("provider", "other_command", None, "a.org")
+        self.backend.cancel("provider", "command")
+
+        self.assertTrue(self.provider.calls[0][1].called)
+        self.assertFalse(self.provider.calls[1][1].called)
+        self.assertEqual(self.backend._ongoing["provider"].keys(),
+                         [("other_command", "a.org")])
+
+    def test_cancel_setup_provider(self):
+        self.backend._call("provider", "setup_provider", None, "a.org")
+        self.backend._call("provider", "bootstrap", None, "a.org")
+        self.backend.cancel_setup_provider()
+
+        # the bootstrap was waiting for its turn, and runs now
+        self.assertEqual([args for args, _ in self.provider.calls],
+                         [("a.org",), ("a.org",)])
+        self.assertTrue(self.provider.calls[0][1].called)
+        self.assertFalse(self.provider.calls[1][1].called)
+
+    def test_stop_cancels_everything(self):
+        self.backend._call("provider", "command", None, "a.org")
+        self.backend._call("register", "command", None, "a.org")
+        self.backend.stop()
+        self.assertTrue(self.provider.calls[0][1].called)
+        self.assertTrue(self.register.calls[0][1].called)
+
+
+class ProviderPrefetchTest(unittest.TestCase):
+    """
+    Tests for the ProviderPrefetch component
+    """
+
+    def setUp(self):
+        self.signaler = Mock()
+        self.prefetch = ProviderPrefetch(self.signaler)
+        self.checks = {}
+
+        def run_checks(domain):
+            d = defer.Deferred()
+            self.checks[domain] = d
+            return d
+        self.prefetch._run_checks = run_checks
+
+    def _statuses(self):
+        self.assertTrue(self.signaler.signal.called)
+        return self.signaler.signal.call_args[0][1]
+
+    def test_concurrency_limit(self):
+        domains = ["%d.org" % (i,)
+                   for i in range(ProviderPrefetch.CONCURRENCY + 2)]
+        self.prefetch.prefetch_providers(domains)
+        self.assertEqual(len(self.checks), ProviderPrefetch.CONCURRENCY)
+
+        self.checks.values()[0].callback(True)
+        self.assertEqual(len(self.checks), ProviderPrefetch.CONCURRENCY + 1)
+
+    def test_statuses(self):
+        self.prefetch.prefetch_providers(["a.org", "b.org", "c.org"])
+        self.checks["a.org"].callback(True)
+        self.checks["b.org"].callback(False)
+        self.assertFalse(self.signaler.signal.called)
+        self.checks["c.org"].errback(Exception("boom"))
+
+        self.assertEqual(self._statuses(),
+                         {"a.org": ProviderPrefetch.HEALTHY,
+                          "b.org": ProviderPrefetch.STALE,
+                          "c.org": ProviderPrefetch.STALE})
+        self.assertTrue(self.prefetch.is_healthy("a.org"))
+        self.assertFalse(self.prefetch.is_healthy("b.org"))
+        self.assertFalse(self.prefetch.is_healthy("c.org"))
+
+    def test_recent_results_are_reused(self):
+        self.prefetch.prefetch_providers(["a.org"])
+        self.checks.pop("a.org").callback(True)
+        self.signaler.reset_mock()
+
+        self.prefetch.prefetch_providers(["a.org"])
+        self.assertEqual(self.checks, {})
+        self.assertEqual(self._statuses(),
+                         {"a.org": ProviderPrefetch.HEALTHY})
+
+    def test_results_expire(self):
+        with patch("leap.bitmask.backend.monotonic", lambda: 0):
+            self.prefetch.prefetch_providers(["a.org"])
+            self.checks.pop("a.org").callback(True)
+        with patch("leap.bitmask.backend.monotonic",
+                   lambda: ProviderPrefetch.MAX_AGE):
+            self.assertFalse(self.prefetch.is_healthy("a.org"))
+            self.prefetch.prefetch_providers(["a.org"])
+        self.assertIn("a.org", self.checks)
+
+    def test_healthy_provider_skips_the_checks(self):
+        self.prefetch.prefetch_providers(["a.org"])
+        self.checks["a.org"].callback(True)
+
+        provider = Provider(self.signaler, prefetch=self.prefetch)
+        provider._provider_bootstrapper = Mock()
+        d = provider.setup_provider(u"a.org")
+        self.assertTrue(d.called)
+        self.assertFalse(provider._provider_bootstrapper
+                         .run_provider_select_checks.called)
+
+        provider.setup_provider(u"b.org")
+        self.assertTrue(provider._provider_bootstrapper
+                        .run_provider_select_checks.called)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
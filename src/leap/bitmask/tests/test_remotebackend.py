@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+# test_remotebackend.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the backend daemon protocol
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import json
+import struct
+
+from mock import Mock
+from twisted.internet import defer
+from twisted.internet.error import ConnectError
+from twisted.internet.task import Clock
+from twisted.python import threadable
+from twisted.test.proto_helpers import StringTransport
+
+from leap.bitmask.remotebackend import BackendClientFactory
+from leap.bitmask.remotebackend import BackendProxy
+from leap.bitmask.remotebackend import BackendServerFactory
+from leap.bitmask.remotebackend import RemoteSignaler
+
+
+def frame(*message):
+    """
+    Frames a message the way the other end does.
+    """
+    payload = json.dumps(message)
+    return struct.pack("!I", len(payload)) + payload
+
+
+def unframe(data):
+    """
+    Returns the list of messages in the data written to a transport.
+    """
+    messages = []
+    while data:
+        length, = struct.unpack("!I", data[:4])
+        messages.append(json.loads(data[4:4 + length]))
+        data = data[4 + length:]
+    return messages
+
+
+class BackendServerTest(unittest.TestCase):
+    """
+    Tests for the backend side, driven by a stand-in client.
+    """
+
+    def setUp(self):
+        # signals are sent right away only from the reactor thread
+        threadable.registerAsIOThread()
+        self.clock = Clock()
+        self.backend = Mock()
+        self.signaler = RemoteSignaler(reactor=self.clock)
+        self.factory = BackendServerFactory(self.backend, self.signaler)
+        self.proto = self.factory.buildProtocol(None)
+        self.transport = StringTransport()
+        self.proto.makeConnection(self.transport)
+
+    def test_call(self):
+        self.proto.dataReceived(
+            frame("call", "register_user", ["example.org", "user", "pass"]))
+        self.backend.register_user.assert_called_once_with(
+            "example.org", "user", "pass")
+
+    def test_call_split_across_chunks(self):
+        data = frame("call", "setup_provider", ["example.org"])
+        self.proto.dataReceived(data[:3])
+        self.assertFalse(self.backend.setup_provider.called)
+        self.proto.dataReceived(data[3:])
+        self.backend.setup_provider.assert_called_once_with("example.org")
+
+    def test_unknown_method_is_ignored(self):
+        self.proto.dataReceived(frame("call", "stop", []))
+        self.assertFalse(self.backend.stop.called)
+
+    def test_bad_arguments_are_ignored(self):
+        self.proto.dataReceived(frame("call", "setup_provider", "example"))
+        self.proto.dataReceived(frame("call", "setup_provider", None))
+        self.assertFalse(self.backend.setup_provider.called)
+
+    def test_garbage_is_ignored(self):
+        self.proto.dataReceived(struct.pack("!I", 3) + "foo")
+        self.proto.dataReceived(frame("call", "cancel_setup_provider", []))
+        self.backend.cancel_setup_provider.assert_called_once_with()
+
+    def test_signals_are_batched(self):
+        data = {"passed": True, "error": ""}
+        self.signaler.signal(self.signaler.PROV_NAME_RESOLUTION_KEY, data)
+        self.signaler.signal(self.signaler.PROV_HTTPS_CONNECTION_KEY, data)
+        self.assertEqual(self.transport.value(), "")
+        self.clock.advance(1)
+        self.assertEqual(
+            unframe(self.transport.value()),
+            [["signals", None, [["prov_name_resolution", data],
+                                ["prov_https_connection", data]]]])
+
+    def test_no_signals_after_disconnection(self):
+        self.proto.connectionLost(None)
+        self.signaler.signal(self.signaler.SRP_REGISTRATION_TAKEN)
+        self.clock.advance(1)
+        self.assertEqual(self.transport.value(), "")
+
+
+class FakeEndpoint(object):
+    """
+    Endpoint whose connection is fired by the tests.
+    """
+
+    def __init__(self):
+        self.connected = defer.Deferred()
+
+    def connect(self, factory):
+        self.factory = factory
+        return self.connected
+
+
+class BackendProxyTest(unittest.TestCase):
+    """
+    Tests for the frontend side.
+    """
+
+    def setUp(self):
+        self.signaler = Mock()
+        self.endpoint = FakeEndpoint()
+        self.backend = BackendProxy(None, signaler=self.signaler,
+                                    endpoint=self.endpoint)
+        self.backend.start()
+
+    def _connect(self):
+        proto = self.endpoint.factory.buildProtocol(None)
+        transport = StringTransport()
+        proto.makeConnection(transport)
+        self.endpoint.connected.callback(proto)
+        return proto, transport
+
+    def test_calls_are_queued_until_connected(self):
+        self.backend.setup_provider("example.org")
+        proto, transport = self._connect()
+        self.assertEqual(unframe(transport.value()),
+                         [["call", "setup_provider", ["example.org"]]])
+
+    def test_call(self):
+        proto, transport = self._connect()
+        self.backend.register_user("example.org", "user", "pass")
+        self.assertEqual(
+            unframe(transport.value()),
+            [["call", "register_user", ["example.org", "user", "pass"]]])
+
+    def test_signals(self):
+        proto, transport = self._connect()
+        proto.dataReceived(frame("signals", None,
+                                 [["srp_registration_taken", None]]))
+        self.signaler.emit_batch.assert_called_once_with(
+            [("srp_registration_taken", None)])
+
+    def test_stop(self):
+        proto, transport = self._connect()
+        self.backend.stop()
+        self.assertTrue(transport.disconnecting)
+
+    def test_stop_terminates_the_daemon(self):
+        self.backend._process = process = Mock()
+        self.backend.stop()
+        process.signalProcess.assert_called_once_with("TERM")
+
+    def test_all_the_backend_methods(self):
+        for method in BackendServerFactory.METHODS:
+            self.assertTrue(callable(getattr(self.backend, method, None)),
+                            method)
+
+    def test_prefetch_providers_round_trip(self):
+        proto, transport = self._connect()
+        self.backend.prefetch_providers(("example.org", "example.net"))
+
+        backend = Mock()
+        factory = BackendServerFactory(backend, RemoteSignaler())
+        server = factory.buildProtocol(None)
+        server.makeConnection(StringTransport())
+        server.dataReceived(transport.value())
+        backend.prefetch_providers.assert_called_once_with(
+            ["example.org", "example.net"])
+
+
+class BackendProxyConnectTest(unittest.TestCase):
+    """
+    Tests for the connection to a daemon that is starting.
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.endpoint = Mock()
+        self.endpoint.connect.side_effect = lambda factory: defer.fail(
+            ConnectError("not listening yet"))
+        self.backend = BackendProxy(None, signaler=Mock(),
+                                    endpoint=self.endpoint,
+                                    reactor=self.clock)
+
+    def test_retry(self):
+        self.backend.start()
+        self.assertEqual(self.endpoint.connect.call_count, 1)
+
+        self.clock.advance(BackendProxy.CONNECT_DELAY)
+        self.assertEqual(self.endpoint.connect.call_count, 2)
+
+        proto = Mock()
+        self.endpoint.connect.side_effect = lambda factory: defer.succeed(
+            proto)
+        self.clock.advance(BackendProxy.CONNECT_DELAY)
+        self.assertIs(self.backend._protocol, proto)
+
+    def test_give_up(self):
+        results = []
+        self.backend.start().addBoth(results.append)
+        self.clock.pump([BackendProxy.CONNECT_DELAY] *
+                        BackendProxy.CONNECT_ATTEMPTS)
+        self.assertEqual(self.endpoint.connect.call_count,
+                         BackendProxy.CONNECT_ATTEMPTS)
+        # the error is logged, not raised
+        self.assertEqual(results, [None])
+
+    def test_no_retry_after_stop(self):
+        self.backend.start()
+        self.backend.stop()
+        self.clock.advance(BackendProxy.CONNECT_DELAY)
+        self.assertEqual(self.endpoint.connect.call_count, 1)
+
+    def test_spawn(self):
+        self.clock.spawnProcess = Mock()
+        backend = BackendProxy("/tmp/backend.sock", signaler=Mock(),
+                               endpoint=self.endpoint, reactor=self.clock)
+        backend.spawn(bypass_checks=True)
+        args = self.clock.spawnProcess.call_args[0][2]
+        self.assertEqual(args[1:], ["-m", "leap.bitmask.remotebackend",
+                                    "--socket", "/tmp/backend.sock",
+                                    "--danger"])
+
+
+class ClientFactoryTest(unittest.TestCase):
+    """
+    Tests for the BackendClientFactory class.
+    """
+
+    def test_calls_are_ignored(self):
+        signaler = Mock()
+        proto = BackendClientFactory(signaler).buildProtocol(None)
+        proto.makeConnection(StringTransport())
+        proto.dataReceived(frame("call", "setup_provider", ["example.org"]))
+        self.assertFalse(signaler.emit_batch.called)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# test_signaler.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the parts of the signaler shared by backend and frontend
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from twisted.internet.task import Clock
+from twisted.python import threadable
+
+from leap.bitmask.signaler import SignalCoalescer
+
+
+class SignalCoalescerTest(unittest.TestCase):
+    """
+    Tests for the SignalCoalescer class
+    """
+
+    def setUp(self):
+        # signals are queued right away only from the reactor thread
+        threadable.registerAsIOThread()
+        self.clock = Clock()
+        self.batches = []
+        self.coalescer = SignalCoalescer(self.batches.append,
+                                         reactor=self.clock)
+
+    def test_flushed_at_the_end_of_the_frame(self):
+        self.coalescer.signal("a", 1)
+        self.assertEqual(self.batches, [])
+        self.clock.advance(SignalCoalescer.FRAME)
+        self.assertEqual(self.batches, [[("a", 1)]])
+
+    def test_repeated_keys_are_collapsed(self):
+        self.coalescer.signal("a", 1)
+        self.coalescer.signal("b", 2)
+        self.coalescer.signal("a", 3)
+        self.clock.advance(SignalCoalescer.FRAME)
+        self.assertEqual(self.batches, [[("b", 2), ("a", 3)]])
+
+    def test_one_batch_per_frame(self):
+        self.coalescer.signal("a", 1)
+        self.clock.advance(SignalCoalescer.FRAME)
+        self.coalescer.signal("a", 2)
+        self.clock.advance(SignalCoalescer.FRAME)
+        self.assertEqual(self.batches, [[("a", 1)], [("a", 2)]])
+
+    def test_nothing_to_flush(self):
+        self.coalescer.flush()
+        self.assertEqual(self.batches, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_flush(self):
+        self.coalescer.signal("a", 1)
+        self.coalescer.flush()
+        self.assertEqual(self.batches, [[("a", 1)]])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_rates(self):
+        for i in range(3):
+            self.coalescer.signal("a", i)
+        self.coalescer.flush()
+        signaled, flushed = self.coalescer.get_rates()["a"]
+        self.assertEqual(signaled / flushed, 3)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
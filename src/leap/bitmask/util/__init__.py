@@ -17,11 +17,15 @@
 """
 Some small and handy functions.
 """
+import ctypes
+import ctypes.util
 import datetime
 import itertools
 import os
+import time
 
 from leap.bitmask.config import flags
+from leap.bitmask.platform_init import IS_LINUX
 from leap.common.config import get_path_prefix as common_get_path_prefix
 
 # functional goodies for a healthier life:
@@ -115,3 +119,45 @@ def make_address(user, provider):
     :type provider: basestring
     """
     return "%s@%s" % (user, provider)
+
+
+# clocks
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _get_clock_gettime():
+    """
+    Returns the clock_gettime function from libc, or None if we cannot
+    find it.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'librt.so.1',
+                           use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    return clock_gettime
+
+
+_CLOCK_MONOTONIC = 1  # as defined in linux/time.h
+_clock_gettime = _get_clock_gettime() if IS_LINUX else None
+
+
+def monotonic():
+    """
+    Returns the value, in fractional seconds, of a clock that cannot go
+    backwards. Only the difference between two values is meaningful.
+
+    Falls back to the wall clock if the platform does not give us a
+    monotonic one.
+
+    :rtype: float
+    """
+    if _clock_gettime is not None:
+        ts = _timespec()
+        if _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(ts)) == 0:
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+    return time.time()
@@ -15,78 +15,217 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-Utility class for moving averages.
+Time series for traffic counters.
 
 It is used in the status panel widget for displaying up and down
-download rates.
+rates, and keeps a few hours of throughput history that can be exported.
 """
-from leap.bitmask.util import first
+import csv
+import math
 
+from array import array
+from bisect import bisect_left
 
-class RateMovingAverage(object):
+
+class _RingIndex(object):
+    """
+    Read only sequence view of the logical contents of a ring buffer,
+    oldest first. Used to bisect the timestamps in place.
     """
-    Moving window average for calculating
-    upload and download rates.
+
+    def __init__(self, buf, start, size):
+        self._buf = buf
+        self._start = start
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, i):
+        return self._buf[(self._start + i) % len(self._buf)]
+
+
+class ThroughputSeries(object):
+    """
+    Fixed capacity time series of a traffic counter.
+
+    Samples are kept in a couple of preallocated arrays used as a ring
+    buffer, so appending is O(1) and memory does not grow no matter how
+    long the tunnel is up. Besides the raw history, we keep an
+    exponentially weighted moving average of the rate, updated on each
+    append.
+
+    Timestamps are expected to come from a monotonic clock, in seconds,
+    see leap.bitmask.util.monotonic. Rates are returned in bytes/sec.
     """
-    SAMPLE_SIZE = 5
 
-    def __init__(self):
+    # three hours, at one sample per second
+    CAPACITY = 3 * 60 * 60
+
+    # seconds
+    WINDOW = 5
+    EWMA_TIME_CONSTANT = 5
+
+    def __init__(self, capacity=None):
         """
-        Initializes an empty array of fixed size
+        :param capacity: the maximum number of samples kept.
+        :type capacity: int
         """
+        if capacity is None:
+            capacity = self.CAPACITY
+        self._ts = array('d', [0.0]) * capacity
+        # The counters are stored accumulated across counter resets, so
+        # the difference between any two samples is the traffic between
+        # them.
+        self._acc = array('d', [0.0]) * capacity
         self.reset()
 
     def reset(self):
-        self._data = [None for i in xrange(self.SAMPLE_SIZE)]
+        """
+        Forgets all the samples.
+        """
+        self._start = 0
+        self._size = 0
+        self._last_total = None
+        self._ewma = None
 
-    def append(self, x):
+    def __len__(self):
+        return self._size
+
+    def _index(self, i):
         """
-        Appends a new data point to the collection.
+        Returns the position in the arrays of the i-th sample, oldest
+        first.
 
-        :param x: A tuple containing timestamp and traffic points
-                  in the form (timestamp, traffic)
-        :type x: tuple
+        :type i: int
+        :rtype: int
         """
-        self._data.pop(0)
-        self._data.append(x)
+        return (self._start + i) % len(self._ts)
 
-    def get(self):
+    def append(self, ts, total):
         """
-        Gets the collection.
+        Appends a new data point to the series.
+
+        A total lower than the previous one is taken as a counter reset,
+        and all of it is counted as new traffic.
+
+        :param ts: the monotonic timestamp, in seconds.
+        :type ts: float
+        :param total: the value of the traffic counter, in bytes.
+        :type total: int
         """
-        return self._data
+        capacity = len(self._ts)
+        if self._size == 0:
+            acc = 0.0
+        else:
+            last = self._index(self._size - 1)
+            delta = total - self._last_total
+            if delta < 0:
+                delta = total
+            acc = self._acc[last] + delta
+
+            elapsed = ts - self._ts[last]
+            if elapsed > 0:
+                rate = delta / elapsed
+                if self._ewma is None:
+                    self._ewma = rate
+                else:
+                    alpha = 1 - math.exp(
+                        -elapsed / self.EWMA_TIME_CONSTANT)
+                    self._ewma += alpha * (rate - self._ewma)
 
-    def get_average(self):
+        if self._size < capacity:
+            pos = self._index(self._size)
+            self._size += 1
+        else:
+            # full, overwrite the oldest sample
+            pos = self._start
+            self._start = (self._start + 1) % capacity
+
+        self._ts[pos] = ts
+        self._acc[pos] = acc
+        self._last_total = total
+
+    def get_rate(self, window=None):
         """
-        Gets the moving average.
+        Returns the average rate over the last seconds of the series.
+
+        :param window: the size of the window, in seconds. Defaults to
+                       WINDOW.
+        :type window: float
+
+        :rtype: float
         """
-        data = filter(None, self.get())
-        traff = [traffic for (ts, traffic) in data]
-        times = [ts for (ts, traffic) in data]
+        if self._size < 2:
+            return 0.0
+        if window is None:
+            window = self.WINDOW
 
-        try:
-            deltatraffic = traff[-1] - first(traff)
-            deltat = (times[-1] - first(times)).seconds
-        except IndexError:
-            deltatraffic = 0
-            deltat = 0
+        last = self._index(self._size - 1)
+        since = self._ts[last] - window
+        first = bisect_left(
+            _RingIndex(self._ts, self._start, self._size), since)
+        # we need at least two samples to measure anything
+        first = self._index(min(first, self._size - 2))
 
-        try:
-            rate = float(deltatraffic) / float(deltat) / 1024
-        except ZeroDivisionError:
-            rate = 0
+        elapsed = self._ts[last] - self._ts[first]
+        if elapsed <= 0:
+            return 0.0
+        return (self._acc[last] - self._acc[first]) / elapsed
 
-        # In some cases we get negative rates
-        if rate < 0:
-            rate = 0
+    def get_ewma(self):
+        """
+        Returns the exponentially weighted moving average of the rate.
 
-        return rate
+        :rtype: float
+        """
+        return self._ewma or 0.0
 
     def get_total(self):
         """
-        Gets the total accumulated throughput.
+        Returns the last value of the traffic counter, in bytes.
+
+        :rtype: int
+        """
+        return self._last_total or 0
+
+    def get_history(self):
+        """
+        Returns the samples kept in the series, oldest first.
+
+        The timestamps are the monotonic ones given to append. The bytes
+        are the traffic since the first sample appended after the last
+        reset, counter resets included, so once the oldest samples are
+        overwritten the first one kept does not start at 0. The traffic
+        between two samples is the difference of their bytes.
+
+        :returns: a list of (timestamp, bytes) tuples.
+        :rtype: list
         """
-        try:
-            return self._data[-1][1] / 1024
-        except TypeError:
-            return 0
+        history = []
+        for i in xrange(self._size):
+            pos = self._index(i)
+            history.append((self._ts[pos], int(self._acc[pos])))
+        return history
+
+
+def write_history_csv(fileobj, up, down):
+    """
+    Writes the history of the up and down series as csv, with a
+    timestamp, upload, download row per sample.
+
+    Both series are expected to be appended to at the same time, as the
+    status panel does.
+
+    :param fileobj: where to write the history.
+    :type fileobj: file
+    :param up: the upload series.
+    :type up: ThroughputSeries
+    :param down: the download series.
+    :type down: ThroughputSeries
+    """
+    writer = csv.writer(fileobj)
+    writer.writerow(("timestamp", "upload", "download"))
+    for (ts, upload), (_, download) in zip(up.get_history(),
+                                           down.get_history()):
+        writer.writerow(("%.3f" % (ts,), upload, download))
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+# http_cache.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Conditional downloads of the provider and service definitions.
+
+For each url we remember the ETag, the Last-Modified date and until when
+the response is fresh according to its Cache-Control max-age. That
+metadata is kept in a http_cache.json file next to the downloaded files,
+that is, under leap/providers/<domain>/.
+
+While a response is fresh the network is not used at all. Once it is
+stale the request is sent with If-None-Match and If-Modified-Since, so
+the server can answer 304 when nothing changed.
+
+Other response headers the caller needs, like the minimum client
+version, can be kept in the metadata too, so they are known when no
+request is done.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import namedtuple
+
+from leap.bitmask import util
+from leap.bitmask.util.constants import REQUEST_TIMEOUT
+from leap.bitmask.util.request_helpers import get_content
+from leap.common.files import get_mtime, mkdir_p
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = "http_cache.json"
+
+ETAG_KEY = "etag"
+LAST_MODIFIED_KEY = "last_modified"
+EXPIRES_KEY = "expires"
+KEPT_HEADERS_KEY = "headers"
+
+# the bootstrappers may update the same metadata file from different
+# threads
+_lock = threading.Lock()
+
+# path -> (content, mtime) of the last document seen, so it is not read
+# from disk again when it did not change
+_contents = {}
+
+
+class Download(namedtuple("Download",
+                          "content, mtime, modified, headers, path, uri, "
+                          "kept_headers")):
+    """
+    The result of a conditional download.
+
+    content is the JSON document and mtime its modification time, as
+    get_content returns them. modified is False when the copy on disk is
+    still valid, and headers holds the response headers, which are empty
+    when no request was done. path is where the document is saved and
+    uri where it was downloaded from. kept_headers holds the headers the
+    caller asked to keep, taken from the metadata when the response does
+    not have them.
+    """
+    __slots__ = ()
+
+    def commit(self):
+        """
+        Remembers the cache headers of the response, so the document is
+        not downloaded again while it is valid.
+
+        Must be called once the document was accepted and saved to path.
+        If the caller rejects it, the next fetch downloads it again
+        instead of trusting the copy on disk.
+        """
+        if not self.modified and not self.headers:
+            # the copy on disk was fresh, no request was done
+            return
+        if self.modified:
+            _contents[self.path] = (self.content, self.mtime)
+        _save_metadata(self.path, self.uri, self.headers,
+                       not_modified=not self.modified,
+                       kept_headers=self.kept_headers)
+
+
+def get_max_age(cache_control):
+    """
+    Returns the max-age in a Cache-Control header, in seconds.
+
+    :param cache_control: the value of the header.
+    :type cache_control: str
+
+    :returns: the max-age, 0 if the response must not be reused without
+              asking the server.
+    :rtype: int
+    """
+    max_age = 0
+    for directive in cache_control.lower().split(","):
+        directive = directive.strip()
+        if directive in ("no-cache", "no-store"):
+            return 0
+        if directive.startswith("max-age="):
+            try:
+                max_age = max(0, int(directive[len("max-age="):]))
+            except ValueError:
+                pass
+    return max_age
+
+
+def _get_cache_path(path):
+    """
+    Returns the path to the metadata file for the downloaded file.
+
+    :param path: path to the downloaded file.
+    :type path: str
+
+    :rtype: str
+    """
+    return os.path.join(os.path.dirname(path), CACHE_FILE)
+
+
+def _load_metadata(path):
+    """
+    Returns all the metadata in the metadata file for the downloaded file.
+
+    :param path: path to the downloaded file.
+    :type path: str
+
+    :rtype: dict
+    """
+    try:
+        with open(_get_cache_path(path)) as f:
+            metadata = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if not isinstance(metadata, dict):
+        return {}
+    return metadata
+
+
+def _save_metadata(path, uri, headers, not_modified=False,
+                   kept_headers=None):
+    """
+    Stores the cache headers of a response in the metadata file.
+
+    :param path: path to the downloaded file.
+    :type path: str
+    :param uri: the requested url.
+    :type uri: str
+    :param headers: the response headers.
+    :type headers: dict
+    :param not_modified: whether the response was a 304, which may not
+                         repeat the validators we already have.
+    :type not_modified: bool
+    :param kept_headers: other headers to remember.
+    :type kept_headers: dict
+    """
+    with _lock:
+        metadata = _load_metadata(path)
+        entry = metadata.get(uri, {}) if not_modified else {}
+        entry.pop(EXPIRES_KEY, None)
+        _update_entry(entry, headers)
+        if kept_headers:
+            entry[KEPT_HEADERS_KEY] = kept_headers
+        metadata[uri] = entry
+
+        cache_path = _get_cache_path(path)
+        mkdir_p(os.path.dirname(cache_path))
+        try:
+            with open(cache_path, "w") as f:
+                json.dump(metadata, f)
+        except IOError as e:
+            logger.warning("Could not save the http cache metadata: %r"
+                           % (e,))
+
+
+def _update_entry(entry, headers):
+    """
+    Updates the metadata entry of a url with the response headers.
+
+    :param entry: the metadata for the url.
+    :type entry: dict
+    :param headers: the response headers.
+    :type headers: dict
+    """
+    etag = headers.get("etag")
+    if etag:
+        entry[ETAG_KEY] = etag
+    last_modified = headers.get("last-modified")
+    if last_modified:
+        entry[LAST_MODIFIED_KEY] = last_modified
+    max_age = get_max_age(headers.get("cache-control", ""))
+    if max_age:
+        entry[EXPIRES_KEY] = time.time() + max_age
+
+
+def _get_kept_headers(names, headers, entry):
+    """
+    Returns the headers to keep, from the response or else from the
+    metadata.
+
+    :param names: the names of the headers to keep.
+    :type names: tuple
+    :param headers: the response headers.
+    :type headers: dict
+    :param entry: the metadata for the url.
+    :type entry: dict
+
+    :rtype: dict
+    """
+    stored = entry.get(KEPT_HEADERS_KEY)
+    if not isinstance(stored, dict):
+        stored = {}
+    kept = {}
+    for name in names:
+        value = headers.get(name, stored.get(name))
+        if value is not None:
+            kept[name] = value
+    return kept
+
+
+def _not_modified(path, uri, kept_headers):
+    """
+    Returns the copy of the document we already have.
+
+    :param path: path to the downloaded file.
+    :type path: str
+    :param uri: the url of the document.
+    :type uri: str
+    :param kept_headers: the headers kept for the document.
+    :type kept_headers: dict
+
+    :rtype: Download
+    """
+    content, mtime = _contents.get(path, (None, None))
+    if content is None:
+        with open(path) as f:
+            content = f.read()
+        _contents[path] = (content, mtime)
+    return Download(content, mtime, False, {}, path, uri, kept_headers)
+
+
+def fetch(session, uri, path_list, download_if_needed=True, headers=None,
+          keep_headers=(), **kwargs):
+    """
+    Downloads uri unless the copy at path_list is still valid.
+
+    The caller is expected to save the content to path_list when it was
+    modified, and then call commit on the result. Nothing is remembered
+    about the response until then.
+
+    :param session: the session to use for the request.
+    :type session: requests.sessions.Session
+    :param uri: the url to download.
+    :type uri: str
+    :param path_list: list of components that form the path to the
+                      downloaded file, relative to the configuration
+                      prefix.
+    :type path_list: list
+    :param download_if_needed: if False, the document is downloaded even
+                               if we have a valid copy.
+    :type download_if_needed: bool
+    :param headers: extra headers for the request.
+    :type headers: dict
+    :param keep_headers: names of the response headers to remember with
+                         the metadata.
+    :type keep_headers: tuple
+
+    The other keyword arguments are passed to session.get.
+
+    :rtype: Download
+    """
+    path = os.path.join(util.get_path_prefix(), *path_list)
+    headers = dict(headers or {})
+    entry = {}
+
+    if download_if_needed and os.path.isfile(path):
+        entry = _load_metadata(path).get(uri, {})
+        if entry.get(EXPIRES_KEY, 0) > time.time():
+            logger.debug("%s is still fresh, not downloading it" % (uri,))
+            return _not_modified(
+                path, uri, _get_kept_headers(keep_headers, {}, entry))
+
+        if ETAG_KEY in entry:
+            headers["if-none-match"] = entry[ETAG_KEY]
+        if LAST_MODIFIED_KEY in entry:
+            headers["if-modified-since"] = entry[LAST_MODIFIED_KEY]
+        else:
+            headers["if-modified-since"] = get_mtime(path)
+
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    res = session.get(uri, headers=headers, **kwargs)
+    res.raise_for_status()
+    logger.debug("Request status code: {0}".format(res.status_code))
+
+    if res.status_code == 304:
+        download = _not_modified(
+            path, uri, _get_kept_headers(keep_headers, res.headers, entry))
+        return download._replace(headers=res.headers)
+
+    content, mtime = get_content(res)
+    return Download(content, mtime, True, res.headers, path, uri,
+                    _get_kept_headers(keep_headers, res.headers, {}))
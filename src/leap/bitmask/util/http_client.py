@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+# http_client.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+HTTP client shared by the bootstrappers.
+
+The requests are done by a Twisted Agent in the reactor, over persistent
+connections kept in a pool shared by everybody, so the provider setup and
+the EIP, SMTP and Soledad bootstrappers reuse the same TLS connections to
+the provider API instead of doing a handshake each.
+
+The bootstrapping steps run in threads and expect the requests
+interface, so PooledSession is a requests.Session that blocks its thread
+until the Agent in the reactor is done with the request. Code running in
+the reactor uses request directly. Redirects are followed like a browser
+does, as requests does too, unless allow_redirects is False.
+
+The SRP authentication and registration use plain requests sessions,
+handed out by get_session, which share one connection pool for each
+provider API and CA certificate.
+"""
+import logging
+import re
+import threading
+import urllib
+
+from Cookie import CookieError, SimpleCookie
+from StringIO import StringIO
+
+import requests
+
+from OpenSSL import SSL
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from twisted.internet import defer, error, reactor, ssl, threads
+from twisted.python import threadable
+from twisted.web import error as web_error
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool
+from twisted.web.client import BrowserLikeRedirectAgent
+from twisted.web.client import RequestTransmissionFailed
+from twisted.web.client import ResponseFailed, ResponseNeverReceived
+from twisted.web.client import readBody
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import IPolicyForHTTPS
+from zope.interface import implementer
+
+from leap.bitmask.util.compat import requests_has_max_retries
+from leap.bitmask.util.constants import REQUEST_TIMEOUT
+from leap.common.check import leap_assert
+
+logger = logging.getLogger(__name__)
+
+PEM_CERTIFICATE_RE = re.compile(
+    "-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----", re.DOTALL)
+
+USER_AGENT = "bitmask"
+
+# Connections kept open to the same provider API. A login does a few
+# requests in a row and the bootstrappers may run at the same time.
+POOL_MAXSIZE = 4
+
+# We need to bump the default retries, otherwise logout fails most of
+# the times.
+# NOTE: This is a workaround for the moment, the server side seems to
+# return correctly every time, but it fails on the client end.
+MAX_RETRIES = 30
+
+# verify -> Agent
+_agents = {}
+# verify -> CountingConnectionPool
+_pools = {}
+
+# (api_uri, ca_cert_path) -> HTTPAdapter
+_adapters = {}
+_adapters_lock = threading.Lock()
+
+# how many redirects are followed before giving up, like requests
+MAX_REDIRECTS = requests.models.DEFAULT_REDIRECT_LIMIT
+
+
+@implementer(IPolicyForHTTPS)
+class CATrustPolicy(object):
+    """
+    TLS policy that trusts the certificates in a CA file, like the
+    verify parameter of requests does.
+    """
+
+    def __init__(self, verify):
+        """
+        :param verify: False to skip the verification, True to use the
+                       platform trust store, or the path to a CA bundle.
+        :type verify: bool or str
+        """
+        self._verify = verify
+
+    def creatorForNetloc(self, hostname, port):
+        if self._verify is False:
+            return ssl.CertificateOptions(verify=False)
+
+        hostname = hostname.decode("ascii")
+        if self._verify is True:
+            return ssl.optionsForClientTLS(hostname)
+
+        with open(self._verify) as f:
+            pem = f.read()
+        certificates = [ssl.Certificate.loadPEM(cert)
+                        for cert in PEM_CERTIFICATE_RE.findall(pem)]
+        return ssl.optionsForClientTLS(
+            hostname, trustRoot=ssl.trustRootFromCertificates(certificates))
+
+
+class CountingConnectionPool(HTTPConnectionPool):
+    """
+    HTTPConnectionPool that counts how many requests found a connection
+    ready to be reused.
+    """
+
+    def __init__(self, reactor, persistent=True):
+        HTTPConnectionPool.__init__(self, reactor, persistent)
+        self.hits = 0
+        self.misses = 0
+
+    def getConnection(self, key, endpoint):
+        if self._connections.get(key):
+            self.hits += 1
+        else:
+            self.misses += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+
+def get_agent(verify):
+    """
+    Returns the Agent for the given verification setting.
+
+    There is a connection pool for each different setting, so a
+    connection established without checking the certificate is never
+    reused for a request that needs it checked.
+
+    :param verify: False to skip the verification, True to use the
+                   platform trust store, or the path to a CA bundle.
+    :type verify: bool or str
+
+    :rtype: twisted.web.client.Agent
+    """
+    agent = _agents.get(verify)
+    if agent is None:
+        pool = CountingConnectionPool(reactor, persistent=True)
+        agent = Agent(reactor, contextFactory=CATrustPolicy(verify),
+                      connectTimeout=REQUEST_TIMEOUT, pool=pool)
+        _agents[verify] = agent
+        _pools[verify] = pool
+    return agent
+
+
+def get_session(api_uri, ca_cert_path):
+    """
+    Returns a new requests session for the given provider API.
+
+    The sessions for the same api_uri and ca_cert_path share their
+    connection pool, so the connections opened by one are reused by the
+    next one. The cookies are not shared. The returned session must not
+    be closed, since that would close the shared connections.
+
+    :param api_uri: the provider API uri.
+    :type api_uri: str
+    :param ca_cert_path: path to the provider CA certificate.
+    :type ca_cert_path: str
+
+    :rtype: requests.sessions.Session
+    """
+    key = (api_uri, ca_cert_path)
+    with _adapters_lock:
+        adapter = _adapters.get(key)
+        if adapter is None:
+            if requests_has_max_retries:
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=POOL_MAXSIZE,
+                                      max_retries=MAX_RETRIES)
+            else:
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=POOL_MAXSIZE)
+            _adapters[key] = adapter
+
+    session = requests.session()
+    session.headers["User-Agent"] = USER_AGENT
+    session.mount("https://", adapter)
+    return session
+
+
+def get_pool_stats():
+    """
+    Returns how many requests reused an open connection (hits) and how
+    many had to open a new one (misses), for all the pools.
+
+    :rtype: dict
+    """
+    hits = sum(pool.hits for pool in _pools.values())
+    misses = sum(pool.misses for pool in _pools.values())
+    with _adapters_lock:
+        adapters = _adapters.values()
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                hits += pool.num_requests - pool.num_connections
+                misses += pool.num_connections
+    return {"hits": hits, "misses": misses}
+
+
+def request(method, url, headers=None, cookies=None, data=None,
+            verify=True, timeout=None, allow_redirects=True):
+    """
+    Does a request through the shared Agent without blocking. Must be
+    called from the reactor thread.
+
+    Only the parameters used by the bootstrappers and the SRP
+    authentication are supported.
+
+    :param method: the HTTP method.
+    :type method: str
+    :param url: the requested url.
+    :type url: str or unicode
+    :param headers: extra headers to send.
+    :type headers: dict
+    :param cookies: cookies to send.
+    :type cookies: dict
+    :param data: the body, form encoded if it is a dict.
+    :type data: str or dict
+    :param verify: False to skip the verification, True to use the
+                   platform trust store, or the path to a CA bundle.
+    :type verify: bool or str
+    :param timeout: seconds to wait for the whole response.
+    :type timeout: float
+    :param allow_redirects: whether to follow the redirects.
+    :type allow_redirects: bool
+
+    :returns: a deferred that fires with a requests.models.Response, with
+              the cookies the server set, or fails with the requests
+              exception that corresponds to the error.
+    :rtype: twisted.internet.defer.Deferred
+    """
+    leap_assert(threadable.isInIOThread(),
+                "request must be called from the reactor thread")
+    if verify is None:
+        verify = True
+    if isinstance(url, unicode):
+        url = url.encode("idna")
+
+    all_headers = CaseInsensitiveDict({"User-Agent": USER_AGENT})
+    all_headers.update(headers or {})
+    if cookies:
+        all_headers["Cookie"] = "; ".join(
+            "%s=%s" % item for item in cookies.items())
+    if isinstance(data, dict):
+        data = urllib.urlencode(data)
+        all_headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+    tx_headers = Headers(dict((name, [value])
+                              for name, value in all_headers.items()))
+    body = FileBodyProducer(StringIO(data)) if data else None
+
+    agent = get_agent(verify)
+    if allow_redirects:
+        agent = BrowserLikeRedirectAgent(agent, redirectLimit=MAX_REDIRECTS)
+    d = agent.request(method, url, tx_headers, body)
+    d.addCallback(_read_response, url)
+
+    timeout_call = reactor.callLater(timeout or REQUEST_TIMEOUT, d.cancel)
+    d.addBoth(_cancel_timeout, timeout_call)
+    d.addErrback(_translate_error, url)
+    return d
+
+
+def _read_response(tx_response, url):
+    """
+    Reads the body and builds a requests response.
+
+    :param tx_response: the response from the Agent.
+    :type tx_response: twisted.web.iweb.IResponse
+    :param url: the requested url.
+    :type url: str
+
+    :rtype: twisted.internet.defer.Deferred
+    """
+    response = requests.models.Response()
+    response.status_code = tx_response.code
+    response.reason = tx_response.phrase
+    # the url we ended up at, after following the redirects
+    response.url = tx_response.request.absoluteURI
+    response.headers = CaseInsensitiveDict(
+        (name, ", ".join(values))
+        for name, values in tx_response.headers.getAllRawHeaders())
+    for value in tx_response.headers.getRawHeaders("set-cookie", []):
+        cookie = SimpleCookie()
+        try:
+            cookie.load(value)
+        except CookieError:
+            logger.warning("Ignoring bad cookie from %s: %r" % (url, value))
+            continue
+        for name, morsel in cookie.items():
+            response.cookies.set(name, morsel.value)
+
+    def set_content(content):
+        response._content = content
+        return response
+
+    d = readBody(tx_response)
+    d.addCallback(set_content)
+    return d
+
+
+def _cancel_timeout(result, timeout_call):
+    if timeout_call.active():
+        timeout_call.cancel()
+    return result
+
+
+def _translate_error(failure, url):
+    """
+    Raises the requests exception that corresponds to the failure, so
+    the callers can keep handling them as before.
+
+    :param failure: the failure that triggered the errback.
+    :type failure: twisted.python.failure.Failure
+    :param url: the requested url.
+    :type url: str
+    """
+    if failure.check(defer.CancelledError, error.TimeoutError):
+        raise requests.exceptions.Timeout(
+            "Request to %s timed out" % (url,))
+    if failure.check(ResponseFailed, ResponseNeverReceived,
+                     RequestTransmissionFailed):
+        reasons = failure.value.reasons
+        if any(reason.check(SSL.Error) for reason in reasons):
+            raise requests.exceptions.SSLError(
+                "TLS error connecting to %s: %r" % (url, reasons))
+        if any(reason.check(web_error.InfiniteRedirection)
+               for reason in reasons):
+            raise requests.exceptions.TooManyRedirects(
+                "Exceeded %d redirects requesting %s" % (MAX_REDIRECTS, url))
+        raise requests.exceptions.ConnectionError(
+            "Error connecting to %s: %r" % (url, reasons))
+    if failure.check(error.ConnectError, error.DNSLookupError, SSL.Error):
+        raise requests.exceptions.ConnectionError(
+            "Error connecting to %s: %r" % (url, failure.value))
+    return failure
+
+
+class PooledSession(requests.Session):
+    """
+    A requests.Session whose requests go through the shared Agent.
+
+    Only the parameters supported by request can be used, any other one
+    raises TypeError instead of being silently ignored. The headers,
+    cookies and verify setting of the session are used like requests
+    does, and the cookies set by the server are kept in the session. The
+    cookies are sent to every host, without looking at their domain or
+    path, so a session is meant to talk to a single provider.
+
+    It must not be used from the reactor thread, since it blocks until
+    the response arrives.
+    """
+
+    def __init__(self):
+        requests.Session.__init__(self)
+        # The Agent does not decode compressed bodies, so we do not send
+        # the default headers of requests, that ask for them.
+        self.headers = CaseInsensitiveDict({"User-Agent": USER_AGENT})
+
+    def request(self, method, url, headers=None, cookies=None, data=None,
+                verify=None, timeout=None, allow_redirects=True, **kwargs):
+        if kwargs:
+            raise TypeError("PooledSession does not support: %s" %
+                            (", ".join(sorted(kwargs)),))
+        leap_assert(not threadable.isInIOThread(),
+                    "PooledSession cannot be used from the reactor thread")
+        all_headers = CaseInsensitiveDict(self.headers)
+        all_headers.update(headers or {})
+        all_cookies = dict(self.cookies)
+        all_cookies.update(cookies or {})
+        if verify is None:
+            verify = self.verify
+        response = threads.blockingCallFromThread(
+            reactor, request, method, url, all_headers, all_cookies, data,
+            verify, timeout, allow_redirects)
+        self.cookies.update(response.cookies)
+        return response
+
+
+def session():
+    """
+    Returns a new session that uses the shared connection pools. Named
+    like requests.session, so this module can be used as a fetcher.
+
+    :rtype: PooledSession
+    """
+    return PooledSession()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# resolver.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Name resolution shared by the whole application.
+
+The names are resolved asynchronously with twisted.names and the
+addresses are kept for as long as their TTL says.
+
+This only resolves IPv4 addresses, so it is not installed in the reactor:
+the connections made by Twisted keep using the system resolver, that
+knows about IPv6 too. Use resolve or preresolve for the names we look up
+explicitly.
+"""
+import logging
+import socket
+
+from twisted.internet import defer, error, reactor, threads
+from twisted.internet.abstract import isIPAddress
+from twisted.names import client, dns
+from twisted.python import failure, threadable
+
+from leap.common.check import leap_assert
+
+logger = logging.getLogger(__name__)
+
+_resolver = None
+
+
+class CachingResolver(object):
+    """
+    Resolves host names to IPv4 addresses, caching the answers for their
+    TTL. Concurrent lookups of the same name share one query.
+
+    Must be used from the reactor thread, except resolve_blocking.
+    """
+
+    # bounds for the time an answer is kept, in seconds
+    MIN_TTL = 30
+    MAX_TTL = 60 * 60
+
+    def __init__(self, resolver=None, reactor=reactor):
+        """
+        Constructor for CachingResolver
+
+        :param resolver: the resolver that does the queries, by default
+                         one that uses the system configuration.
+        :type resolver: twisted.internet.interfaces.IResolver
+        :param reactor: the reactor used to tell the time.
+        :type reactor: twisted.internet.reactor
+        """
+        if resolver is None:
+            resolver = client.createResolver()
+        self._resolver = resolver
+        self._reactor = reactor
+
+        # name -> (address, expiration time)
+        self._cache = {}
+        # name -> list of deferreds waiting for the answer
+        self._pending = {}
+
+    def resolve(self, name, use_cache=True):
+        """
+        Returns the IPv4 address of name.
+
+        :param name: the host name to resolve.
+        :type name: str
+        :param use_cache: if False, the name is resolved again even if we
+                          have a valid answer.
+        :type use_cache: bool
+
+        :returns: a deferred that fires with the address, or fails with
+                  DNSLookupError.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if isIPAddress(name):
+            return defer.succeed(name)
+
+        name = name.lower()
+        if use_cache:
+            address, expiration = self._cache.get(name, (None, 0))
+            if expiration > self._reactor.seconds():
+                return defer.succeed(address)
+
+        d = defer.Deferred()
+        waiting = self._pending.setdefault(name, [])
+        waiting.append(d)
+        if len(waiting) == 1:
+            lookup = self._resolver.lookupAddress(name)
+            lookup.addCallback(self._got_answers, name)
+            lookup.addBoth(self._notify, name)
+        return d
+
+    def _got_answers(self, result, name):
+        """
+        Caches the address in the answers to a query and returns it.
+
+        :param result: the answers, authority and additional records.
+        :type result: tuple
+        :param name: the queried name.
+        :type name: str
+
+        :rtype: str
+        """
+        answers, authority, additional = result
+        address = None
+        # the answers may be a chain of CNAMEs, the shortest TTL is the
+        # one that counts
+        ttl = self.MAX_TTL
+        for answer in answers:
+            if answer.type == dns.A:
+                if address is None:
+                    address = answer.payload.dottedQuad()
+                ttl = min(ttl, answer.ttl)
+            elif answer.type == dns.CNAME:
+                ttl = min(ttl, answer.ttl)
+
+        if address is None:
+            raise error.DNSLookupError(name)
+
+        ttl = max(ttl, self.MIN_TTL)
+        self._cache[name] = (address, self._reactor.seconds() + ttl)
+        return address
+
+    def _notify(self, result, name):
+        """
+        Passes the result of a query to everybody that asked for it.
+
+        :param result: the address, or the failure.
+        :type result: str or twisted.python.failure.Failure
+        :param name: the queried name.
+        :type name: str
+        """
+        waiting = self._pending.pop(name, [])
+        if isinstance(result, failure.Failure):
+            if not result.check(error.DNSLookupError):
+                logger.debug("Could not resolve %s: %r" %
+                             (name, result.value))
+                result = failure.Failure(error.DNSLookupError(name))
+            for d in waiting:
+                d.errback(result)
+        else:
+            for d in waiting:
+                d.callback(result)
+
+    def resolve_blocking(self, name):
+        """
+        Returns the IPv4 address of name, blocking until it is resolved.
+        Must be called from a thread other than the reactor one.
+
+        Raises socket.gaierror, like socket.gethostbyname does, if the
+        name cannot be resolved.
+
+        :param name: the host name to resolve.
+        :type name: str
+
+        :rtype: str
+        """
+        leap_assert(not threadable.isInIOThread(),
+                    "resolve_blocking cannot be used from the reactor "
+                    "thread")
+        try:
+            return threads.blockingCallFromThread(
+                reactor, self.resolve, name)
+        except error.DNSLookupError as e:
+            raise socket.gaierror(socket.EAI_NONAME, str(e))
+
+    def preresolve(self, names):
+        """
+        Resolves the names in parallel, so they are cached by the time
+        they are needed.
+
+        :param names: the host names to resolve. Empty ones are ignored.
+        :type names: list of str
+
+        :returns: a deferred that fires once all the names are resolved
+                  or failed.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        names = set(name.lower() for name in names if name)
+        return defer.DeferredList([self.resolve(name) for name in names],
+                                  consumeErrors=True)
+
+
+def get_resolver():
+    """
+    Returns the resolver shared by the whole application.
+
+    :rtype: CachingResolver
+    """
+    global _resolver
+    if _resolver is None:
+        _resolver = CachingResolver()
+    return _resolver
+
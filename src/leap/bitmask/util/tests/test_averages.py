@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# test_averages.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+tests for the traffic time series
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from StringIO import StringIO
+
+from leap.bitmask.util.averages import ThroughputSeries
+from leap.bitmask.util.averages import write_history_csv
+
+
+class ThroughputSeriesTest(unittest.TestCase):
+    """
+    Tests for the ThroughputSeries class
+    """
+
+    def setUp(self):
+        self.series = ThroughputSeries(capacity=10)
+
+    def test_empty(self):
+        self.assertEqual(self.series.get_rate(), 0)
+        self.assertEqual(self.series.get_ewma(), 0)
+        self.assertEqual(self.series.get_total(), 0)
+        self.assertEqual(self.series.get_history(), [])
+
+    def test_rate(self):
+        for i in range(5):
+            self.series.append(i, i * 1000)
+        self.assertEqual(self.series.get_rate(), 1000)
+        self.assertEqual(self.series.get_ewma(), 1000)
+        self.assertEqual(self.series.get_total(), 4000)
+
+    def test_fractional_seconds(self):
+        self.series.append(0.0, 0)
+        self.series.append(0.5, 1000)
+        self.assertEqual(self.series.get_rate(), 2000)
+
+    def test_window(self):
+        self.series.append(0, 0)
+        self.series.append(1, 10000)
+        for i in range(2, 5):
+            self.series.append(i, 10000 + (i - 1) * 100)
+        self.assertEqual(self.series.get_rate(window=2), 100)
+        self.assertEqual(self.series.get_rate(window=10), 2575)
+
+    def test_counter_reset(self):
+        self.series.append(0, 5000)
+        self.series.append(1, 6000)
+        self.series.append(2, 500)
+        self.assertEqual(self.series.get_total(), 500)
+        self.assertEqual(self.series.get_rate(), 750)
+
+    def test_capacity(self):
+        for i in range(25):
+            self.series.append(i, i * 10)
+        history = self.series.get_history()
+        self.assertEqual(len(history), 10)
+        self.assertEqual(history[0][0], 15)
+        self.assertEqual(history[-1][0], 24)
+        self.assertEqual(self.series.get_rate(window=100), 10)
+
+    def test_reset(self):
+        self.series.append(0, 100)
+        self.series.append(1, 200)
+        self.series.reset()
+        self.assertEqual(len(self.series), 0)
+        self.assertEqual(self.series.get_ewma(), 0)
+
+    def test_write_history_csv(self):
+        up, down = ThroughputSeries(), ThroughputSeries()
+        up.append(0, 10)
+        down.append(0, 20)
+        up.append(1, 30)
+        down.append(1, 60)
+        out = StringIO()
+        write_history_csv(out, up, down)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ["timestamp,upload,download",
+                          "0.000,0,0",
+                          "1.000,20,40"])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# test_http_cache.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the conditional downloads
+"""
+import os
+import shutil
+import tempfile
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+import requests
+
+from leap.bitmask import util
+from leap.bitmask.util import http_cache
+from leap.common.files import mkdir_p
+
+URI = "https://api.example.org/provider.json"
+PATH = ["leap", "providers", "example.org", "provider.json"]
+KEEP = ("X-Minimum-Client-Version",)
+
+
+def make_response(status_code, content="", headers=None):
+    """
+    Returns a requests response.
+    """
+    response = requests.models.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    return response
+
+
+class FetchTest(unittest.TestCase):
+    """
+    Tests for the fetch function
+    """
+
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        self.old_get_path_prefix = util.get_path_prefix
+        util.get_path_prefix = lambda: self.prefix
+        http_cache._contents.clear()
+        self.session = mock.Mock()
+
+    def tearDown(self):
+        util.get_path_prefix = self.old_get_path_prefix
+        shutil.rmtree(self.prefix)
+
+    def _download(self, headers):
+        """
+        Downloads the document and saves it, as the callers do.
+        """
+        self.session.get.return_value = make_response(
+            200, '{"domain": "example.org"}', headers)
+        res = http_cache.fetch(self.session, URI, PATH, keep_headers=KEEP)
+        path = os.path.join(self.prefix, *PATH)
+        mkdir_p(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(res.content)
+        res.commit()
+        return res
+
+    def _sent_headers(self):
+        return self.session.get.call_args[1]["headers"]
+
+    def test_new_document(self):
+        res = self._download({})
+        self.assertTrue(res.modified)
+        self.assertEqual(res.content, '{"domain": "example.org"}')
+        self.assertEqual(self._sent_headers(), {})
+
+    def test_fresh_document_is_not_requested(self):
+        self._download({"Cache-Control": "max-age=3600"})
+        self.session.reset_mock()
+
+        res = http_cache.fetch(self.session, URI, PATH)
+        self.assertFalse(self.session.get.called)
+        self.assertFalse(res.modified)
+        self.assertEqual(res.content, '{"domain": "example.org"}')
+
+    def test_no_cache(self):
+        self._download({"Cache-Control": "no-cache, max-age=3600"})
+        self.session.get.return_value = make_response(304)
+        http_cache.fetch(self.session, URI, PATH)
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_validators_are_sent(self):
+        last_modified = "Tue, 15 Nov 1994 12:45:26 GMT"
+        self._download({"ETag": '"1234"', "Last-Modified": last_modified})
+        self.session.get.return_value = make_response(304)
+
+        res = http_cache.fetch(self.session, URI, PATH)
+        self.assertEqual(self._sent_headers(),
+                         {"if-none-match": '"1234"',
+                          "if-modified-since": last_modified})
+        self.assertFalse(res.modified)
+        self.assertEqual(res.content, '{"domain": "example.org"}')
+
+    def test_validators_are_kept_after_not_modified(self):
+        self._download({"ETag": '"1234"'})
+        self.session.get.return_value = make_response(304)
+        http_cache.fetch(self.session, URI, PATH)
+        http_cache.fetch(self.session, URI, PATH)
+        self.assertEqual(self._sent_headers()["if-none-match"], '"1234"')
+
+    def test_uncommitted_download_is_not_trusted(self):
+        self._download({})
+        self.session.get.return_value = make_response(
+            200, '{"domain": "example.org"}',
+            {"ETag": '"5678"', "Cache-Control": "max-age=3600"})
+        http_cache.fetch(self.session, URI, PATH)
+        # rejected by the caller, so there is no commit
+
+        self.session.get.return_value = make_response(304)
+        http_cache.fetch(self.session, URI, PATH)
+        self.assertEqual(self.session.get.call_count, 3)
+        self.assertNotIn("if-none-match", self._sent_headers())
+
+    def test_not_modified_commit_keeps_the_validators(self):
+        self._download({"ETag": '"1234"'})
+        self.session.get.return_value = make_response(
+            304, headers={"Cache-Control": "max-age=3600"})
+        http_cache.fetch(self.session, URI, PATH).commit()
+        self.session.reset_mock()
+
+        # fresh now, and the ETag is still there once it is stale
+        http_cache.fetch(self.session, URI, PATH)
+        self.assertFalse(self.session.get.called)
+        entry = http_cache._load_metadata(
+            os.path.join(self.prefix, *PATH))[URI]
+        self.assertEqual(entry[http_cache.ETAG_KEY], '"1234"')
+
+    def test_content_read_from_disk_after_restart(self):
+        self._download({"ETag": '"1234"'})
+        http_cache._contents.clear()
+        self.session.get.return_value = make_response(304)
+
+        res = http_cache.fetch(self.session, URI, PATH)
+        self.assertEqual(res.content, '{"domain": "example.org"}')
+
+    def test_forced_download(self):
+        self._download({"ETag": '"1234"', "Cache-Control": "max-age=3600"})
+        self.session.get.return_value = make_response(200, '{}')
+
+        res = http_cache.fetch(self.session, URI, PATH,
+                               download_if_needed=False)
+        self.assertEqual(self._sent_headers(), {})
+        self.assertTrue(res.modified)
+
+    def test_kept_headers(self):
+        res = self._download({"X-Minimum-Client-Version": "0.5",
+                              "Cache-Control": "max-age=3600"})
+        self.assertEqual(res.kept_headers, {KEEP[0]: "0.5"})
+
+        # fresh, no request is done
+        res = http_cache.fetch(self.session, URI, PATH, keep_headers=KEEP)
+        self.assertEqual(self.session.get.call_count, 1)
+        self.assertEqual(res.kept_headers, {KEEP[0]: "0.5"})
+
+    def test_kept_headers_not_repeated_by_304(self):
+        self._download({"X-Minimum-Client-Version": "0.5"})
+        self.session.get.return_value = make_response(304)
+        http_cache.fetch(self.session, URI, PATH,
+                         keep_headers=KEEP).commit()
+
+        res = http_cache.fetch(self.session, URI, PATH, keep_headers=KEEP)
+        self.assertEqual(res.kept_headers, {KEEP[0]: "0.5"})
+
+    def test_kept_headers_of_a_new_document(self):
+        self._download({"X-Minimum-Client-Version": "0.5"})
+        res = self._download({})
+        self.assertEqual(res.kept_headers, {})
+
+    def test_errors_are_raised(self):
+        self.session.get.return_value = make_response(404)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            http_cache.fetch(self.session, URI, PATH)
+
+
+class MaxAgeTest(unittest.TestCase):
+    """
+    Tests for the get_max_age function
+    """
+
+    def test_max_age(self):
+        self.assertEqual(http_cache.get_max_age("public, max-age=60"), 60)
+
+    def test_missing(self):
+        self.assertEqual(http_cache.get_max_age(""), 0)
+
+    def test_garbage(self):
+        self.assertEqual(http_cache.get_max_age("max-age=soon"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
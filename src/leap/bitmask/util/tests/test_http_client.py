@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# test_http_client.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the pooled http client
+"""
+import json
+import os
+
+import requests
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from nose.twistedtools import deferred, reactor
+from twisted.internet import error, threads
+from twisted.python import failure
+from twisted.web.client import ResponseNeverReceived
+from twisted.web.resource import Resource
+from twisted.web.util import Redirect
+
+from leap.bitmask.crypto.tests import fake_provider
+from leap.bitmask.util import http_client
+
+
+class EchoHeaders(Resource):
+    """
+    Answers with the headers of the request that the tests look at.
+    """
+    isLeaf = True
+
+    def render_GET(self, request):
+        return json.dumps(dict(
+            (name, request.getHeader(name))
+            for name in ("user-agent", "x-test", "cookie")))
+
+
+class SetCookie(Resource):
+    """
+    Sets a cookie.
+    """
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.addCookie("flavour", "oatmeal", path="/")
+        return ""
+
+
+class FakeProviderTestCase(unittest.TestCase):
+    """
+    Base class for the tests against a fake provider.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.factory = fake_provider.get_provider_factory()
+        cls.connections = []
+        build_protocol = cls.factory.buildProtocol
+
+        def counting_build_protocol(addr):
+            cls.connections.append(addr)
+            return build_protocol(addr)
+
+        cls.factory.buildProtocol = counting_build_protocol
+        cls.factory.resource.putChild("moved", Redirect("/provider.json"))
+        cls.factory.resource.putChild("loop", Redirect("/loop"))
+        cls.factory.resource.putChild("echo", EchoHeaders())
+        cls.factory.resource.putChild("setcookie", SetCookie())
+        https = reactor.listenSSL(
+            0, cls.factory, fake_provider.OpenSSLServerContextFactory())
+        cls.base_uri = "https://localhost:%s" % (https.getHost().port,)
+
+
+class PooledSessionTest(FakeProviderTestCase):
+    """
+    Tests for the PooledSession class.
+    """
+
+    @deferred()
+    def test_get(self):
+        def check(*args):
+            res = http_client.session().get(
+                self.base_uri + "/provider.json", verify=False)
+            res.raise_for_status()
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.headers["Content-Type"], "application/json")
+            self.assertEqual(res.json()["domain"], "example.com")
+        return threads.deferToThread(check)
+
+    @deferred()
+    def test_connections_are_shared(self):
+        def check(*args):
+            for i in range(2):
+                http_client.session().get(
+                    self.base_uri + "/provider.json", verify=False)
+            self.assertEqual(len(self.connections), 1)
+            self.assertEqual(http_client.get_pool_stats(),
+                             {"hits": 1, "misses": 1})
+        # start with empty pools
+        http_client._agents.clear()
+        http_client._pools.clear()
+        http_client._adapters.clear()
+        del self.connections[:]
+        return threads.deferToThread(check)
+
+    @deferred()
+    def test_http_error(self):
+        def check(*args):
+            res = http_client.session().get(
+                self.base_uri + "/nothere", verify=False)
+            with self.assertRaises(requests.exceptions.HTTPError):
+                res.raise_for_status()
+        return threads.deferToThread(check)
+
+    @deferred()
+    def test_redirects_are_followed(self):
+        def check(*args):
+            res = http_client.session().get(
+                self.base_uri + "/moved", verify=False)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.url, self.base_uri + "/provider.json")
+            self.assertEqual(res.json()["domain"], "example.com")
+        return threads.deferToThread(check)
+
+    @deferred()
+    def test_redirects_not_allowed(self):
+        def check(*args):
+            res = http_client.session().get(
+                self.base_uri + "/moved", verify=False,
+                allow_redirects=False)
+            self.assertEqual(res.status_code, 302)
+            self.assertEqual(res.headers["Location"], "/provider.json")
+        return threads.deferToThread(check)
+
+    @deferred()
+    def test_too_many_redirects(self):
+        def check(*args):
+            with self.assertRaises(requests.exceptions.TooManyRedirects):
+                http_client.session().get(
+                    self.base_uri + "/loop", verify=False)
+        return threads.deferToThread(check)
+
+    @deferred()
+    def test_session_headers(self):
+        def check(*args):
+            session = http_client.session()
+            session.headers["X-Test"] = "session"
+            res = session.get(self.base_uri + "/echo", verify=False)
+            self.assertEqual(res.json(), {"user-agent": "bitmask",
+                                          "x-test": "session",
+                                          "cookie": None})
+
+            res = session.get(self.base_uri + "/echo", verify=False,
+                              headers={"x-test": "request"})
+            self.assertEqual(res.json()["x-test"], "request")
+        return threads.deferToThread(check)
+
+    @deferred()
+    def test_session_verify(self):
+        def check(*args):
+            session = http_client.session()
+            session.verify = False
+            res = session.get(self.base_uri + "/provider.json")
+            self.assertEqual(res.status_code, 200)
+        return threads.deferToThread(check)
+
+    @deferred()
+    def test_cookies_are_kept(self):
+        def check(*args):
+            session = http_client.session()
+            session.get(self.base_uri + "/setcookie", verify=False)
+            self.assertEqual(session.cookies["flavour"], "oatmeal")
+
+            res = session.get(self.base_uri + "/echo", verify=False)
+            self.assertEqual(res.json()["cookie"], "flavour=oatmeal")
+        return threads.deferToThread(check)
+
+    def test_unsupported_arguments(self):
+        with self.assertRaises(TypeError):
+            http_client.session().get(
+                self.base_uri + "/provider.json", stream=True)
+
+    @deferred()
+    def test_wrong_ca(self):
+        wrong_cert = os.path.join(os.path.dirname(fake_provider.__file__),
+                                  "wrongcert.pem")
+
+        def check(*args):
+            with self.assertRaises(requests.exceptions.SSLError):
+                http_client.session().get(
+                    self.base_uri + "/provider.json", verify=wrong_cert)
+        return threads.deferToThread(check)
+
+
+class TranslateErrorTest(unittest.TestCase):
+    """
+    Tests for the translation of the Agent errors.
+    """
+
+    def _translate(self, exception):
+        http_client._translate_error(failure.Failure(exception), "url")
+
+    def test_response_never_received(self):
+        reasons = [failure.Failure(error.ConnectionLost())]
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self._translate(ResponseNeverReceived(reasons))
+
+    def test_timeout(self):
+        with self.assertRaises(requests.exceptions.Timeout):
+            self._translate(error.TimeoutError())
+
+
+class GetSessionTest(FakeProviderTestCase):
+    """
+    Tests for the sessions handed out by get_session.
+    """
+
+    def setUp(self):
+        http_client._agents.clear()
+        http_client._pools.clear()
+        http_client._adapters.clear()
+        del self.connections[:]
+
+    @deferred()
+    def test_connections_are_shared(self):
+        first = http_client.get_session(self.base_uri, None)
+        second = http_client.get_session(self.base_uri, None)
+
+        def check(*args):
+            for session in (first, second):
+                session.get(self.base_uri + "/provider.json", verify=False)
+            self.assertEqual(len(self.connections), 1)
+            self.assertEqual(http_client.get_pool_stats(),
+                             {"hits": 1, "misses": 1})
+        return threads.deferToThread(check)
+
+    def test_cookies_are_not_shared(self):
+        first = http_client.get_session(self.base_uri, None)
+        first.cookies.set("_session_id", "1234")
+        second = http_client.get_session(self.base_uri, None)
+        self.assertEqual(len(second.cookies), 0)
+
+    def test_different_ca(self):
+        first = http_client.get_session(self.base_uri, None)
+        second = http_client.get_session(self.base_uri, "ca.crt")
+        self.assertIsNot(first.get_adapter(self.base_uri),
+                         second.get_adapter(self.base_uri))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
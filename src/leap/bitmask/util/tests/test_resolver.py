@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# test_resolver.py
+# Copyright (C) 2014 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the caching resolver
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from twisted.internet import defer, error
+from twisted.internet.task import Clock
+from twisted.names import dns
+from twisted.names.error import DNSNameError
+
+from leap.bitmask.util.resolver import CachingResolver
+
+
+def a_record(name, address, ttl):
+    return dns.RRHeader(name, dns.A, ttl=ttl,
+                        payload=dns.Record_A(address, ttl))
+
+
+def cname_record(name, alias, ttl):
+    return dns.RRHeader(name, dns.CNAME, ttl=ttl,
+                        payload=dns.Record_CNAME(alias, ttl))
+
+
+class FakeResolver(object):
+    """
+    Resolver whose queries are answered by the tests.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def lookupAddress(self, name):
+        d = defer.Deferred()
+        self.queries.append((name, d))
+        return d
+
+    def answer(self, *answers):
+        name, d = self.queries[-1]
+        d.callback((list(answers), [], []))
+
+
+class CachingResolverTest(unittest.TestCase):
+    """
+    Tests for the CachingResolver class
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.fake = FakeResolver()
+        self.resolver = CachingResolver(self.fake, reactor=self.clock)
+        self.results = []
+
+    def _resolve(self, name, **kwargs):
+        d = self.resolver.resolve(name, **kwargs)
+        d.addBoth(self.results.append)
+
+    def test_resolve(self):
+        self._resolve("example.org")
+        self.fake.answer(a_record("example.org", "10.0.0.1", 300))
+        self.assertEqual(self.results, ["10.0.0.1"])
+
+    def test_cached_for_the_ttl(self):
+        self._resolve("example.org")
+        self.fake.answer(a_record("example.org", "10.0.0.1", 300))
+        self.clock.advance(299)
+        self._resolve("Example.org")
+        self.assertEqual(len(self.fake.queries), 1)
+        self.clock.advance(1)
+        self._resolve("example.org")
+        self.assertEqual(len(self.fake.queries), 2)
+
+    def test_ttl_bounds(self):
+        self._resolve("example.org")
+        self.fake.answer(a_record("example.org", "10.0.0.1", 0))
+        self.clock.advance(CachingResolver.MIN_TTL - 1)
+        self._resolve("example.org")
+        self.assertEqual(len(self.fake.queries), 1)
+
+    def test_cname_ttl(self):
+        self._resolve("api.example.org")
+        self.fake.answer(cname_record("api.example.org", "example.org", 60),
+                         a_record("example.org", "10.0.0.1", 300))
+        self.assertEqual(self.results, ["10.0.0.1"])
+        self.clock.advance(60)
+        self._resolve("api.example.org")
+        self.assertEqual(len(self.fake.queries), 2)
+
+    def test_cname_ttl_after_the_address(self):
+        self._resolve("api.example.org")
+        self.fake.answer(a_record("example.org", "10.0.0.1", 300),
+                         cname_record("api.example.org", "example.org", 60))
+        self.assertEqual(self.results, ["10.0.0.1"])
+        self.clock.advance(60)
+        self._resolve("api.example.org")
+        self.assertEqual(len(self.fake.queries), 2)
+
+    def test_bypass_cache(self):
+        self._resolve("example.org")
+        self.fake.answer(a_record("example.org", "10.0.0.1", 300))
+        self._resolve("example.org", use_cache=False)
+        self.assertEqual(len(self.fake.queries), 2)
+
+    def test_concurrent_lookups_are_shared(self):
+        self._resolve("example.org")
+        self._resolve("example.org")
+        self.assertEqual(len(self.fake.queries), 1)
+        self.fake.answer(a_record("example.org", "10.0.0.1", 300))
+        self.assertEqual(self.results, ["10.0.0.1", "10.0.0.1"])
+
+    def test_failures_are_not_cached(self):
+        self._resolve("example.org")
+        self._resolve("example.org")
+        self.fake.queries[0][1].errback(DNSNameError())
+        self.assertEqual(len(self.results), 2)
+        for result in self.results:
+            result.trap(error.DNSLookupError)
+
+        self._resolve("example.org")
+        self.assertEqual(len(self.fake.queries), 2)
+
+    def test_no_address(self):
+        self._resolve("example.org")
+        self.fake.answer()
+        self.results[0].trap(error.DNSLookupError)
+
+    def test_ip_address(self):
+        self._resolve("10.0.0.1")
+        self.assertEqual(self.results, ["10.0.0.1"])
+        self.assertEqual(self.fake.queries, [])
+
+    def test_preresolve(self):
+        done = []
+        d = self.resolver.preresolve(["example.org", "api.example.org",
+                                      "example.org", None])
+        d.addCallback(done.append)
+        self.assertEqual(len(self.fake.queries), 2)
+        for name, query in self.fake.queries:
+            query.callback(([a_record(name, "10.0.0.1", 300)], [], []))
+        self.assertEqual(len(done), 1)
+
+        self._resolve("api.example.org")
+        self.assertEqual(len(self.fake.queries), 2)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)